@@ -0,0 +1,490 @@
+import argparse
+import json
+import logging
+import platform
+import socket
+import sys
+import time
+import tracemalloc
+import numpy
+import curio
+from PIL import Image, ImageDraw
+
+### Omnia libraries ###
+from core.omniaMessageTypes      import OmniaMessageTypes as OMT
+from core.omniaProtocol          import OmniaProtocol
+from modules.omniaDisplay        import Omnia1BitDisplay, OmniaILI9341Display
+from modules.omniaUI             import OmniaUI
+from devices.apps.sound          import Sound
+### --- ###
+
+"""Benchmarks of the hot paths of OmniaManager, run against in-memory stand-in sockets.
+
+Run from the repository root, for example:
+    python -m benchmarks.omniaBenchmark --save before.json
+    python -m benchmarks.omniaBenchmark --compare before.json
+"""
+
+class OmniaMemorySocket:
+    """Stand-in for curio.io.SocketStream, backed by a real socket.socketpair(): written data is read back and discarded
+    by the other end of the pair, reads return EOF.
+    If gather is True the raw socket is exposed like curio does (_file), so OmniaProtocol writes with sendmsg(),
+    otherwise it joins buffers and calls write().
+    """
+
+    READ_SIZE = 256 * 1024  # bytes read back at once
+
+    def __init__(self, gather=True):
+        """Initialization
+
+        :param gather: True to let OmniaProtocol gather buffers with sendmsg(), defaults to True
+        :type gather: bool, optional
+        """
+        self.__socket, self.__peer = socket.socketpair()
+        self.__socket.setblocking(False)
+        self.__peer.setblocking(False)
+        self.__buffer = bytearray(self.READ_SIZE)
+
+        if gather:
+            self._file = self.__socket  # found by OmniaProtocol like the raw socket of a curio.io.SocketStream
+
+        self.written_bytes = 0  # bytes passed to write()
+        self.writes = 0         # write() calls
+        self.read_bytes = 0     # bytes read back by the other end, with write() or sendmsg()
+
+    async def write(self, data):
+        self.written_bytes += len(data)
+        self.writes += 1
+
+        with memoryview(data) as view:
+            while view:
+                try:
+                    view = view[self.__socket.send(view):]
+                except BlockingIOError:
+                    self.readBack()     # make room in the socket buffer
+
+    def readBack(self):
+        """Read and discard everything written so far, so that the socket buffer doesn't fill up
+        """
+        try:
+            while True:
+                n = self.__peer.recv_into(self.__buffer)
+                if not n:
+                    break
+                self.read_bytes += n
+        except BlockingIOError:
+            pass
+
+    async def read_exactly(self, n):
+        raise EOFError("Unexpected end of data")
+
+    async def readline(self):
+        return b''
+
+    async def flush(self):
+        pass
+
+    async def close(self):
+        self.__socket.close()
+        self.__peer.close()
+
+# ---------------------------------------------------- #
+
+class OmniaBenchmark:
+    """Benchmark of a single operation.
+    Subclasses implement setup() and run(), run() returns the number of bytes processed by the operation.
+    """
+
+    name = None
+    description = ""
+
+    async def setup(self):
+        """Prepare the operation, called once in the curio kernel before timing
+        """
+        pass
+
+    async def run(self):
+        """Run the operation once
+
+        :return: bytes processed
+        :rtype: int
+        """
+        raise NotImplementedError
+
+    async def teardown(self):
+        """Release resources, called once after timing
+        """
+        pass
+
+    @staticmethod
+    def newProtocol(client_info=None, gather=True):
+        """Create OmniaProtocol writing to an OmniaMemorySocket
+
+        :param client_info: extra client info (e.g. "features"), defaults to None
+        :type client_info: dict, optional
+        :param gather: True to write with sendmsg(), False to join buffers, defaults to True
+        :type gather: bool, optional
+        :return: protocol
+        :rtype: OmniaProtocol
+        """
+        info = {"name": "benchmark", "type": "device"}
+        info.update(client_info or {})
+
+        return OmniaProtocol(OmniaMemorySocket(gather), info)
+
+    @staticmethod
+    async def drain(protocol):
+        """Wait until the send task has written all queued messages, then read them back from the socket
+
+        :param protocol: protocol writing to an OmniaMemorySocket
+        :type protocol: OmniaProtocol
+        """
+        while protocol.isSending():
+            await curio.sleep(0)
+        
+        protocol.socket.readBack()
+
+class ProtocolPrepareBenchmark(OmniaBenchmark):
+    name = "protocol.prepare"
+    description = "OmniaProtocol.__prepareMsg() of a text list and a 1 KiB payload"
+
+    async def setup(self):
+        self.protocol = self.newProtocol()
+        self.prepare = self.protocol._OmniaProtocol__prepareMsg
+        self.payload = bytes(1024)
+
+    async def run(self):
+        header, payload = self.prepare([ 1, 440, 50 ], OMT.PWM_PIN)
+        size = len(header) + len(payload)
+        payload.release()
+
+        header, payload = self.prepare(self.payload, OMT.AUDIO_CHUNK)
+        size += len(header) + len(payload)
+        payload.release()
+
+        return size
+
+    async def teardown(self):
+        await self.protocol.socket.close()
+
+class ProtocolSendControlBenchmark(OmniaBenchmark):
+    name = "protocol.send.control"
+    description = "64 small control messages through the send queue (coalesced), written with sendmsg()"
+    gather = True
+
+    async def setup(self):
+        self.protocol = self.newProtocol({"protocol_version": OmniaProtocol.BINARY_PARAMS_VERSION}, self.gather)
+
+    async def run(self):
+        for i in range(64):
+            await self.protocol.send([ i % 40, i % 2 ], OMT.OUTPUT_PIN)
+
+        await self.drain(self.protocol)
+
+        return 64 * (OmniaProtocol.MSG_HEADER.size + 2)
+
+    async def teardown(self):
+        await self.protocol.taskGroup.cancel_remaining()
+        await self.protocol.socket.close()
+
+class ProtocolSendControlJoinBenchmark(ProtocolSendControlBenchmark):
+    name = "protocol.send.control.join"
+    description = "64 small control messages through the send queue (coalesced), joined and written with write()"
+    gather = False
+
+class ProtocolSendBulkBenchmark(OmniaBenchmark):
+    name = "protocol.send.bulk"
+    description = "64 KiB video frame through the send queue, split in chunks, written with sendmsg()"
+    gather = True
+
+    async def setup(self):
+        self.protocol = self.newProtocol({"features": OmniaProtocol.FEATURE_CHUNKED_BULK}, self.gather)
+        self.frame = bytes(64 * 1024)
+
+    async def run(self):
+        await self.protocol.send(self.frame, OMT.VIDEO_FRAME)
+        await self.drain(self.protocol)     # chunks are written after the message leaves the queue
+
+        return len(self.frame)
+
+    async def teardown(self):
+        await self.protocol.taskGroup.cancel_remaining()
+        await self.protocol.socket.close()
+
+class ProtocolSendBulkJoinBenchmark(ProtocolSendBulkBenchmark):
+    name = "protocol.send.bulk.join"
+    description = "64 KiB video frame through the send queue, split in chunks, joined and written with write()"
+    gather = False
+
+class OneBitDisplayBenchmark(OmniaBenchmark):
+    name = "display.1bit"
+    description = "Omnia1BitDisplay.sendDisplay() of a 128x64 image, rotated and inverted"
+
+    async def setup(self):
+        self.protocol = self.newProtocol()
+        self.display = Omnia1BitDisplay(self.protocol, (128, 64), {"contrast": True, "rotation": True})
+        self.display.image_draw.text((10, 0), "OMNIA", 255, self.display.FONT_ARIAL_30)
+        self.display.image_draw.ellipse((80, 30, 120, 60), fill=255)
+
+    async def run(self):
+        await self.display.sendDisplay(force_send=True)
+        await self.drain(self.protocol)
+
+        return self.display.width * self.display.height // 8
+
+    async def teardown(self):
+        await self.protocol.taskGroup.cancel_remaining()
+        await self.protocol.socket.close()
+
+class ILI9341DisplayBenchmark(OmniaBenchmark):
+    name = "display.ili9341"
+    description = "OmniaILI9341Display.sendDisplay() JPEG encoding of a 320x240 image, in the default encoder"
+
+    async def setup(self):
+        self.protocol = self.newProtocol()
+        self.display = OmniaILI9341Display(self.protocol, (320, 240))
+
+        cover = Image.open("devices/resources/audio/sally.jpg").convert("RGBA").resize((160, 160))
+        image = Image.new("RGBA", (320, 240), (60, 60, 60))
+        image.paste(cover, (80, 10))
+        ImageDraw.Draw(image).text((10, 200), "Omnia benchmark", (255, 255, 255), self.display.FONT_ARIAL_11)
+        self.display.setImage(image)
+
+    async def run(self):
+        before = self.protocol.getSendStats(OMT.RGBA_IMAGE)["bytes"]
+
+        await self.display.sendDisplay()
+
+        while self.display.in_flight:   # encoded off the event loop
+            await curio.sleep(0)
+        await self.drain(self.protocol)
+
+        return self.protocol.getSendStats(OMT.RGBA_IMAGE)["bytes"] - before
+
+    async def teardown(self):
+        await self.protocol.taskGroup.cancel_remaining()
+        await self.protocol.socket.close()
+
+class UIRefreshBenchmark(OmniaBenchmark):
+    name = "ui.refresh"
+    description = "OmniaUI.refresh_image() of devices/resources/ui/home.xml, moving the progress dot like Display"
+
+    async def setup(self):
+        self.ui = OmniaUI((320, 240))
+        self.ui.loadFromXMLFile("devices/resources/ui/home.xml")
+        self.dot = self.ui.getElement("circle")
+        self.x = 0
+
+    async def run(self):
+        self.x = (self.x + 1) % (self.ui.width - 18)
+        self.dot.setPosition((self.x, 175))
+
+        damage = self.ui.refresh_image()
+
+        return sum((x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in damage) * 4     # repainted RGBA bytes
+
+class SoundVolumeBenchmark(OmniaBenchmark):
+    name = "sound.volume"
+    description = "Sound.calculateVolume() of a 10000-frame stereo 16-bit chunk"
+
+    async def setup(self):
+        self.sound = Sound.__new__(Sound)   # skip __init__, it needs OmniaController and audio files
+        self.chunk = numpy.random.randint(-32768, 32767, 10000 * 2, dtype=numpy.int16).tobytes()
+
+    async def run(self):
+        data = self.sound.calculateVolume(self.chunk, 5)
+
+        return len(data)
+
+BENCHMARKS = [
+    ProtocolPrepareBenchmark,
+    ProtocolSendControlBenchmark,
+    ProtocolSendControlJoinBenchmark,
+    ProtocolSendBulkBenchmark,
+    ProtocolSendBulkJoinBenchmark,
+    OneBitDisplayBenchmark,
+    ILI9341DisplayBenchmark,
+    UIRefreshBenchmark,
+    SoundVolumeBenchmark,
+]
+
+# ---------------------------------------------------- #
+
+class OmniaBenchmarkRunner:
+    """Run benchmarks, save and compare results
+    """
+
+    def __init__(self, min_time=1.0, alloc_runs=20):
+        """Initialization
+
+        :param min_time: minimum seconds each benchmark is timed, defaults to 1.0
+        :type min_time: float, optional
+        :param alloc_runs: operations traced to measure allocations, defaults to 20
+        :type alloc_runs: int, optional
+        """
+        self.min_time = min_time
+        self.alloc_runs = alloc_runs
+
+    async def runBenchmark(self, benchmark):
+        """Run benchmark: warm up, time it for at least min_time seconds, then trace its allocations
+
+        :param benchmark: benchmark to run
+        :type benchmark: OmniaBenchmark
+        :return: {
+                    "ops": <operations timed>,
+                    "ops_per_s": <operations per second>,
+                    "bytes_per_s": <bytes processed per second>,
+                    "alloc_blocks": <memory blocks still allocated per operation>,
+                    "alloc_peak": <peak bytes allocated by an operation>
+                }
+        :rtype: dict
+        """
+        await benchmark.setup()
+
+        try:
+            await benchmark.run()   # warm up
+
+            ops = 0
+            processed = 0
+            start = time.perf_counter()
+            elapsed = 0.0
+
+            while elapsed < self.min_time:
+                processed += await benchmark.run()
+                ops += 1
+                elapsed = time.perf_counter() - start
+
+            tracemalloc.start()
+            blocks = 0
+            peak = 0
+
+            for _ in range(self.alloc_runs):
+                tracemalloc.clear_traces()
+                before, _ = tracemalloc.get_traced_memory()
+                before_blocks = len(tracemalloc.take_snapshot().traces)
+
+                await benchmark.run()
+
+                current, op_peak = tracemalloc.get_traced_memory()
+                blocks += len(tracemalloc.take_snapshot().traces) - before_blocks
+                peak = max(peak, op_peak - before)
+
+            tracemalloc.stop()
+        finally:
+            await benchmark.teardown()
+
+        return {
+            "ops": ops,
+            "ops_per_s": ops / elapsed,
+            "bytes_per_s": processed / elapsed,
+            "alloc_blocks": blocks / self.alloc_runs,
+            "alloc_peak": peak,
+        }
+
+    async def runAll(self, names=None):
+        """Run benchmarks
+
+        :param names: names of the benchmarks to run, None for all, defaults to None
+        :type names: list, optional
+        :return: {
+                    "python": <python version>,
+                    "platform": <platform>,
+                    "results": {name: <runBenchmark() result>}
+                }
+        :rtype: dict
+        """
+        results = {}
+
+        for benchmark_class in BENCHMARKS:
+            if names and benchmark_class.name not in names:
+                continue
+
+            results[benchmark_class.name] = await self.runBenchmark(benchmark_class())
+
+        return {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "results": results,
+        }
+
+    @staticmethod
+    def compare(baseline, current, threshold=0.1):
+        """Compare two runs
+
+        :param baseline: results of runAll()
+        :type baseline: dict
+        :param current: results of runAll()
+        :type current: dict
+        :param threshold: relative slowdown of ops/s considered a regression, defaults to 0.1 (10%)
+        :type threshold: float, optional
+        :return: {name: {"change": <relative change of ops/s>, "regression": <True if slower than threshold>}}
+        :rtype: dict
+        """
+        comparison = {}
+
+        for name, result in current["results"].items():
+            if name not in baseline["results"]:
+                continue
+
+            base_ops = baseline["results"][name]["ops_per_s"]
+            change = (result["ops_per_s"] - base_ops) / base_ops if base_ops else 0.0
+
+            comparison[name] = {
+                "change": change,
+                "regression": change < -threshold,
+            }
+
+        return comparison
+
+    @staticmethod
+    def printResults(results, comparison=None, file=sys.stdout):
+        """Print results, with the comparison to a baseline if given
+
+        :param results: results of runAll()
+        :type results: dict
+        :param comparison: result of compare(), defaults to None
+        :type comparison: dict, optional
+        :param file: where to print, defaults to sys.stdout
+        :type file: file object, optional
+        """
+        print("{:<28} {:>12} {:>12} {:>12} {:>12} {:>10}".format(
+            "benchmark", "ops/s", "MB/s", "blocks/op", "peak B/op", "vs base"), file=file)
+
+        for name, r in results["results"].items():
+            change = ""
+            if comparison and name in comparison:
+                change = "{:+.1%}{}".format(comparison[name]["change"], " !" if comparison[name]["regression"] else "")
+
+            print("{:<28} {:>12.1f} {:>12.2f} {:>12.1f} {:>12} {:>10}".format(
+                name, r["ops_per_s"], r["bytes_per_s"] / 1e6, r["alloc_blocks"], r["alloc_peak"], change), file=file)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark OmniaManager hot paths")
+    parser.add_argument("names", nargs="*", help="benchmarks to run (default: all): " + ", ".join(b.name for b in BENCHMARKS))
+    parser.add_argument("--min-time", type=float, default=1.0, help="minimum seconds each benchmark is timed")
+    parser.add_argument("--save", default=None, help="save results to this JSON file")
+    parser.add_argument("--compare", default=None, help="compare with results saved in this JSON file")
+    parser.add_argument("--threshold", type=float, default=0.1, help="ops/s slowdown considered a regression")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    runner = OmniaBenchmarkRunner(args.min_time)
+    results = curio.run(runner.runAll, args.names)
+
+    comparison = None
+    if args.compare:
+        with open(args.compare, "r") as j:
+            comparison = runner.compare(json.load(j), results, args.threshold)
+
+    runner.printResults(results, comparison)
+
+    if args.save:
+        with open(args.save, "w") as j:
+            json.dump(results, j, indent=4)
+
+    if comparison and any(c["regression"] for c in comparison.values()):
+        sys.exit(1)     # fail CI/deploy scripts on regressions
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+import collections
+
+class OmniaLatencyStats:
+    """Rolling round-trip time (RTT) statistics of a connection.
+
+    Keeps the last samples in a fixed-size ring, used for minimum and percentiles,
+    and updates exponentially weighted moving average and jitter at every sample.
+    """
+
+    def __init__(self, size=64, ewma_weight=0.125, jitter_weight=0.0625):
+        """Initialization
+
+        :param size: number of samples kept in the ring, defaults to 64
+        :type size: int, optional
+        :param ewma_weight: weight of the new sample in the moving average, defaults to 0.125 (like TCP's SRTT)
+        :type ewma_weight: float, optional
+        :param jitter_weight: weight of the new variation in the jitter, defaults to 0.0625 (like RFC 3550)
+        :type jitter_weight: float, optional
+        """
+
+        ### Samples ###
+        self.samples = collections.deque(maxlen=size)   # ring of the last RTT samples (in ms)
+        self.n_samples = 0  # samples added since creation
+        ### --- ###
+
+        ### Statistics ###
+        self.ewma_weight = ewma_weight
+        self.jitter_weight = jitter_weight
+
+        self.last = 0.0
+        self.ewma = 0.0
+        self.jitter = 0.0
+        ### --- ###
+
+    def addSample(self, rtt):
+        """Add RTT sample
+
+        :param rtt: round-trip time (in ms)
+        :type rtt: float
+        """
+        if self.n_samples == 0:
+            self.ewma = rtt
+        else:
+            self.ewma += (rtt - self.ewma) * self.ewma_weight
+            self.jitter += (abs(rtt - self.last) - self.jitter) * self.jitter_weight
+
+        self.last = rtt
+        self.samples.append(rtt)
+        self.n_samples += 1
+
+    def getPercentile(self, percentile):
+        """Get percentile of the samples in the ring
+
+        :param percentile: percentile, from 0 to 100
+        :type percentile: float
+        :return: RTT (in ms), 0.0 if there are no samples
+        :rtype: float
+        """
+        return self.__percentile(sorted(self.samples), percentile)
+
+    @staticmethod
+    def __percentile(ordered, percentile):
+        """Nearest-rank percentile of already sorted samples
+
+        :param ordered: sorted samples
+        :type ordered: list
+        :param percentile: percentile, from 0 to 100
+        :type percentile: float
+        :return: RTT (in ms), 0.0 if there are no samples
+        :rtype: float
+        """
+        if not ordered:
+            return 0.0
+
+        index = max(0, int(round(percentile / 100 * len(ordered))) - 1)
+
+        return ordered[min(index, len(ordered) - 1)]
+
+    def getStats(self):
+        """Get all statistics (in ms)
+
+        :return: {
+                    "last": <last sample>,
+                    "ewma": <moving average>,
+                    "min": <minimum in the ring>,
+                    "p50": <median in the ring>,
+                    "p95": <95th percentile in the ring>,
+                    "p99": <99th percentile in the ring>,
+                    "jitter": <smoothed variation between consecutive samples>,
+                    "samples": <number of samples added>
+                }
+        :rtype: dict
+        """
+        ordered = sorted(self.samples)
+
+        return {
+            "last": self.last,
+            "ewma": self.ewma,
+            "min": ordered[0] if ordered else 0.0,
+            "p50": self.__percentile(ordered, 50),
+            "p95": self.__percentile(ordered, 95),
+            "p99": self.__percentile(ordered, 99),
+            "jitter": self.jitter,
+            "samples": self.n_samples,
+        }
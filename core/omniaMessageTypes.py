@@ -1,8 +1,12 @@
+import struct
+
 class OmniaMessageTypes:
     
     ### Images ###
     ONE_BIT_IMAGE = 'S'
+    PARTIAL_ONE_BIT_IMAGE = 's'     # changed part of the last ONE_BIT_IMAGE, see OmniaProtocol.FEATURE_PARTIAL_IMAGE
     RGBA_IMAGE = 'd'
+    DELTA_FRAME = 'u'   # changed tiles of the last RGBA_IMAGE or VIDEO_FRAME, see OmniaProtocol.FEATURE_DELTA_FRAME
     ### --- ###
 
     ### Displays ###
@@ -40,4 +44,60 @@ class OmniaMessageTypes:
 
     ### Latency ###
     LATENCY = 'l'
-    ### --- ###
\ No newline at end of file
+    ### --- ###
+
+    ### Protocol ###
+    PROTOCOL_SETUP = 'p'
+    CHUNK = 'k'     # part of a bulk message, see OmniaProtocol.FEATURE_CHUNKED_BULK
+    ### --- ###
+
+    ### Priority classes ###
+    PRIORITY_CONTROL = 0    # small messages, sent as soon as possible
+    PRIORITY_BULK = 1       # images, video frames and audio chunks
+
+    BULK_TYPES = (ONE_BIT_IMAGE, PARTIAL_ONE_BIT_IMAGE, RGBA_IMAGE, DELTA_FRAME, VIDEO_FRAME, AUDIO_CHUNK)
+    ### --- ###
+
+    ### Binary parameters ###
+    # struct format of the parameters of list messages, sent packed (network byte order)
+    # to clients that negotiated OmniaProtocol.BINARY_PARAMS_VERSION
+    PARAMS_FORMATS = {
+        ONE_BIT_DISPLAY: 'BBHHB',       # sda, scl, width, height, display type
+        TOUCHSCREEN: 'B',               # start/stop
+        START_STOP_VIDEO_STREAM: 'B',   # start/stop
+        SET_AUDIO: 'BIBBI',             # start/stop, framerate, channels, sample width, chunk size
+        INPUT_PIN: 'B',                 # pin
+        REMOVE_INPUT_PIN: 'B',          # pin
+        OUTPUT_PIN: 'BB',               # pin, value
+        PWM_PIN: 'BHH',                 # pin, frequency, duty
+        NEOPIXEL_PIN: 'BBBB',           # pin, red, green, blue
+        READ_ADC: 'BB',                 # start/stop, pin
+        SET_I2C: 'BB',                  # sda, scl
+        READ_I2C: 'BBH',                # start/stop, address, read length
+        READ_BLE: 'B',                  # start/stop
+        SET_NFC: 'BBBBB',               # sclk, mosi, miso, rst, sda
+        READ_NFC: 'B',                  # start/stop
+    }
+
+    PARAMS_STRUCTS = {}     # PARAMS_STRUCTS[msg_type][n] packs the first n parameters, compiled below
+    ### --- ###
+
+    @classmethod
+    def getPriority(cls, msg_type):
+        """Get priority class of msg_type
+
+        :param msg_type: type of the message
+        :type msg_type: str
+        :return: PRIORITY_BULK for images, video frames and audio chunks, PRIORITY_CONTROL otherwise
+        :rtype: int
+        """
+        if msg_type in cls.BULK_TYPES:
+            return cls.PRIORITY_BULK
+        
+        return cls.PRIORITY_CONTROL
+
+for _msg_type, _params_format in OmniaMessageTypes.PARAMS_FORMATS.items():
+    OmniaMessageTypes.PARAMS_STRUCTS[_msg_type] = [
+        struct.Struct('>' + _params_format[:n]) for n in range(len(_params_format) + 1)
+    ]
+del _msg_type, _params_format
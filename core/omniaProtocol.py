@@ -1,10 +1,14 @@
 import logging
 import struct
+import collections
+import socket as _socket
+import ssl
 import curio
 import time
 
 ### Omnia libraries ###
 from core.omniaMessageTypes      import OmniaMessageTypes
+from core.omniaLatency           import OmniaLatencyStats
 ### --- ###
 
 class OmniaProtocol(OmniaMessageTypes):
@@ -16,6 +20,54 @@ class OmniaProtocol(OmniaMessageTypes):
      #*****VERSION*****#
     __version__ = "0.5.1"
 
+    ### Protocol versions (negotiated with PROTOCOL_SETUP) ###
+    TEXT_PARAMS_VERSION = 1     # list messages sent as "<param1>-<param2>-..." (legacy clients)
+    BINARY_PARAMS_VERSION = 2   # list messages packed with OmniaMessageTypes.PARAMS_STRUCTS
+    PROTOCOL_VERSION = BINARY_PARAMS_VERSION
+    ### --- ###
+
+    ### Framing ###
+    HEADER = struct.Struct('>I')    # 4-byte big-endian length prefix
+    NEW_LINE = ord('\n')    # end of message, if RECV_LINE mode
+    MSG_HEADER = struct.Struct('>Ic')   # length prefix followed by message type
+    CHUNK_HEADER = struct.Struct('>IccB')   # length prefix, CHUNK type, original message type, last chunk flag
+    MAX_RECV_SIZE = 1 << 20     # maximum length of a received message (in bytes), longer ones close the connection
+    ### --- ###
+
+    ### Receive modes ###
+    RECV_LINE = 0       # messages terminated by '\n' (default, legacy clients)
+    RECV_FRAMED = 1     # messages prefixed by a 4-byte length, like the ones we send
+    ### --- ###
+
+    ### Features (bitmask negotiated with PROTOCOL_SETUP) ###
+    FEATURE_FRAMED_RECV = 1 << 0    # client sends length-prefixed messages
+    FEATURE_CHUNKED_BULK = 1 << 1   # client reassembles bulk messages split in CHUNK messages
+    FEATURE_PARTIAL_IMAGE = 1 << 2  # client applies PARTIAL_ONE_BIT_IMAGE messages to the last 1-bit image
+    FEATURE_DELTA_FRAME = 1 << 3    # client applies DELTA_FRAME messages to the last image or video frame
+    SUPPORTED_FEATURES = FEATURE_FRAMED_RECV | FEATURE_CHUNKED_BULK | FEATURE_PARTIAL_IMAGE | FEATURE_DELTA_FRAME
+    ### --- ###
+
+    ### Send queue ###
+    SEND_BLOCK = 0          # wait until there's space in the queue
+    SEND_DROP_OLDEST = 1    # drop the oldest queued message of the same type
+    SEND_DROP_NEWEST = 2    # drop the message being sent
+
+    SEND_QUEUE_SIZE = 64    # default maximum number of queued messages
+    COALESCE_SIZE = 512     # messages smaller than this (in bytes) are written together
+    COALESCE_MAX = 8192     # maximum bytes written together
+    COALESCE_MSGS = 64      # maximum messages written together
+    BULK_CHUNK_SIZE = 4096  # bulk messages are split in chunks of this size (in bytes), if FEATURE_CHUNKED_BULK is enabled
+
+    WIRE_LATENCY_WEIGHT = 0.1   # weight of the last sample in the latency-to-wire moving average
+    ### --- ###
+
+    ### Latency sampling ###
+    LATENCY_SAMPLE_INTERVAL = 1.0   # default seconds between two LATENCY messages sent by the sampler
+    LATENCY_SAMPLES = 64            # RTT samples kept for statistics
+    LATENCY_SEQ = struct.Struct('>H')   # sequence number of LATENCY messages
+    LATENCY_MAX_IN_FLIGHT = 32      # LATENCY messages waiting for their echo
+    ### --- ###
+
     def getVersion(self):
         return self.__version__
     
@@ -39,6 +91,9 @@ class OmniaProtocol(OmniaMessageTypes):
                                 "class": "device_type"
                                 "type": "device"
                             }
+
+                            optionally, "features" (int) and "protocol_version" (int) can be set
+                            for clients that don't negotiate them with PROTOCOL_SETUP
                             
         :type client_info: dict
         """
@@ -70,25 +125,59 @@ class OmniaProtocol(OmniaMessageTypes):
 
         ### Network I/O ###
         self.socket = socket
-        self.alive = True   # set to False when resuming
+        self.__gather_socket = self.__getGatherSocket(self.socket)
+        self.alive = True   # set to False when resuming, or when the connection is closed (see __closeConnection())
+
+        self.send_stats = {}    # {msg_type: {"messages": int, "bytes": int, "copied": int, "dropped": int}}
+        ### --- ###
+
+        ### Send queues ###
+        # one queue for each priority class, of (msg_type, header, payload, enqueue time)
+        self.__send_queues = {
+            self.PRIORITY_CONTROL: collections.deque(),
+            self.PRIORITY_BULK: collections.deque(),
+        }
+        self.__chunked_msg = None   # bulk message being sent in chunks
+        self.__queue_not_empty = curio.Event()
+        self.__queue_not_full = curio.Event()
+        
+        self.send_queue_size = self.SEND_QUEUE_SIZE
+        self.send_policies = {
+            self.VIDEO_FRAME: self.SEND_DROP_OLDEST,    # only the last frame is worth sending
+            self.RGBA_IMAGE: self.SEND_DROP_OLDEST,
+        }
+
+        self.wire_latency = {
+            self.PRIORITY_CONTROL: {"avg": 0.0, "max": 0.0, "messages": 0},
+            self.PRIORITY_BULK: {"avg": 0.0, "max": 0.0, "messages": 0},
+        }
         ### --- ###
         
         ### Latency ###
-        self.l_time = 0.0   # time before sending latency message
         self.latency = 0.0
         self.tot_latency = 0.0  # sum of latency iterations
         self.latency_iterations = 10    # number of iterations
-        self.n_latency_sent = 0        # number of latency messages sent
+        self.n_latency_sent = 0        # number of latency messages sent by calculateLatency()
         self.__final_latency_callback = None
+
+        self.__latency_seq = 0  # sequence number of the next LATENCY message
+        self.__latency_in_flight = {}   # {sequence number: (time.perf_counter_ns() when sent, sent by calculateLatency(), sent packed)}
+
+        self.latency_stats = OmniaLatencyStats(self.LATENCY_SAMPLES)    # rolling RTT statistics
+        self.latency_sample_interval = self.LATENCY_SAMPLE_INTERVAL     # 0 disables the sampler
         ### --- ###
 
         ### Callbacks ###
         self.__receive_callbacks = {}
         self.__old_receive_callbacks = {}
+        self.__dispatch = [None] * 256  # callbacks indexed by message type byte
         ### --- ###
 
         ### Tasks ###
         self.recv_task = None
+        self.send_task = None   # started when the first message is sent
+        self.__send_idle = True # True while the send task waits for messages, see isSending()
+        self.latency_task = None
         self.tasks = [] # tasks created by the user
         ### --- ###
 
@@ -97,49 +186,110 @@ class OmniaProtocol(OmniaMessageTypes):
             '[{}]: OmniaProtocol'.format(self.client_info["name"])
         )
         ### --- ###
+
+        ### Negotiation ###
+        self.session = 0    # increased when the connection is resumed or features are negotiated again, see getSession()
+        self.features = 0
+        self.recv_mode = self.RECV_LINE
+        self.protocol_version = self.TEXT_PARAMS_VERSION
+        self.__setFeatures(self.client_info.get("features", 0))
+        self.__setProtocolVersion(self.client_info.get("protocol_version", self.TEXT_PARAMS_VERSION))
+
+        self.registerReceiveCallback(self.__protocolSetupCallback, self.PROTOCOL_SETUP)
+        ### --- ###
+
+        self.registerReceiveCallback(self.__latencyCallback, self.LATENCY)
     
     ### RECEIVE ###
 
     async def recv(self):
-        """Receiving Task
+        """Receiving Task. Reads messages and awaits the callback registered for their type.
+        Terminates when the client closes the connection or the socket fails, closing the connection (see __closeConnection()):
+        a new task is started by resumeSocket().
         """
         self.log.debug("RECV TASK STARTED")
-        while True:
-            #self.log.debug("receiving data")
-            
-            if self.alive:  # check if protocol is not resuming
-                
-                try:
-                    data = await self.socket.readline()
-                    data = bytearray(data).replace(b'\n',b'')   # remove end-line character
-                    
-                    if len(data) > 0:
-                        recv_type = chr(data[0])    # get message type
-                        data = data[1:]     # remove message type from data
-                        
-                        self.log.debug(f"received (type: '{recv_type}'): {data}")
-                        
-                        if recv_type in self.__receive_callbacks:    # if received message is of this type is expected
-                            #self.log.debug(f"calling callback: {self.__receive_callbacks[recv_type]}")
-                            await self.__receive_callbacks[recv_type](data)
-                        else:
-                            self.log.warning("Received message of type '{}' not expected".format(recv_type))
-                        
-                        '''for r in self.__receive_callbacks:
-                            await self.__receive_callbacks[r](data)'''
-                except:
-                    pass
+
+        while self.alive:   # check if protocol is not resuming
+            try:
+                data = await self.__readMessage()
+            except curio.CancelledError:
+                raise
+            except (EOFError, OSError) as e:
+                self.log.warning("Connection lost: {!r}".format(e))
+                await self.__closeConnection()
+                break
+            except ValueError as e:     # corrupt or hostile length prefix, the stream can't be trusted anymore
+                self.log.error("Closing connection: {}".format(e))
+                await self.__closeConnection()
+                break
             
-            else:
+            if data is None:    # client closed the connection
+                self.log.warning("Connection closed by client")
+                await self.__closeConnection()
                 break
+            
+            if len(data) == 0:
+                continue
+
+            callback = self.__dispatch[data[0]]     # data[0] is the message type
+            
+            if self.log.isEnabledFor(logging.DEBUG):
+                self.log.debug("received (type: '%s'): %s", chr(data[0]), bytes(data[1:]))
+            
+            if callback is None:
+                self.log.warning("Received message of type '%s' not expected", chr(data[0]))
+                continue
+            
+            try:
+                await callback(data[1:])    # remove message type from data, without copying it
+            except curio.CancelledError:
+                raise
+            except Exception:
+                self.log.exception("Error in callback of message type '%s'", chr(data[0]))
     
         self.log.debug("recv finished")
 
+    async def __readMessage(self):
+        """Read one message from the socket, according to the current receive mode:
+            a. RECV_LINE: read until '\\n' and remove the end-line character
+            b. RECV_FRAMED: read the 4-byte length, then exactly that many bytes
+
+        :raises ValueError: if the length prefix exceeds MAX_RECV_SIZE
+        :return: message type followed by the message, None if the client closed the connection
+        :rtype: memoryview
+        """
+        if self.recv_mode == self.RECV_FRAMED:
+            try:
+                header = await self.socket.read_exactly(self.HEADER.size)
+            except EOFError as e:
+                if e.bytes_read:    # connection closed in the middle of the header
+                    raise
+                return None
+
+            length, = self.HEADER.unpack(header)
+
+            if length > self.MAX_RECV_SIZE:     # not allocated
+                raise ValueError("message of {} bytes exceeds MAX_RECV_SIZE ({} bytes)".format(length, self.MAX_RECV_SIZE))
+
+            return memoryview(await self.socket.read_exactly(length))
+        
+        data = await self.socket.readline()
+
+        if not data:
+            return None
+        
+        data = memoryview(data)
+
+        if data[-1] == self.NEW_LINE:
+            data = data[:-1]    # remove end-line character
+        
+        return data
+
     def registerReceiveCallback(self, callback, recv_type):
         """Registers callback, called when message of type 'recv_type' is received.
         Stores the previous callback, that can be restored by calling restoreReceiveCallback()
 
-        :param callback: callback function
+        :param callback: callback coroutine function, awaited with the received message (without its type) as a memoryview
         :type callback: function object
         :param recv_type: type of the message expected to be received, use types from OmniaMessageTypes
         :type recv_type: str
@@ -148,8 +298,9 @@ class OmniaProtocol(OmniaMessageTypes):
             self.__old_receive_callbacks[recv_type] = self.__receive_callbacks[recv_type]
         
         self.__receive_callbacks[recv_type] = callback
+        self.__dispatch[ord(recv_type)] = callback
 
-        self.log.debug(f"Registering callback: {callback} of type '{recv_type}'")
+        self.log.debug("Registering callback: %s of type '%s'", callback, recv_type)
     
     def removeReceiveCallback(self, recv_type):
         """Removes the received callback with this recv_type
@@ -158,11 +309,12 @@ class OmniaProtocol(OmniaMessageTypes):
         :type recv_type: str
         """
         if recv_type in self.__old_receive_callbacks:
-            self.__old_receive_callbacks[recv_type].pop(recv_type)
+            self.__old_receive_callbacks.pop(recv_type)
         
         if recv_type in self.__receive_callbacks:
             cb = self.__receive_callbacks.pop(recv_type)
-            self.log.debug(f"Removing callback: {cb} of type '{recv_type}'")
+            self.__dispatch[ord(recv_type)] = None
+            self.log.debug("Removing callback: %s of type '%s'", cb, recv_type)
     
     def restoreReceiveCallback(self, recv_type):
         """Restores receive callback to the one saved by registerReceiveCallback()
@@ -172,66 +324,463 @@ class OmniaProtocol(OmniaMessageTypes):
         """
         if recv_type in self.__old_receive_callbacks:
             self.__receive_callbacks[recv_type] = self.__old_receive_callbacks[recv_type]
+            self.__dispatch[ord(recv_type)] = self.__receive_callbacks[recv_type]
 
     ### END RECEIVE ###
 
     ### SEND ###
 
     async def send(self, message, msg_type):
-        """Send message to client using the StreamWriter and call the writer.drain() coro.
-        If message is a list, convert it to string with '-' separator between elements, then encode.
+        """Queue message to be sent to client by the send task, that writes header and payload as separate buffers,
+        gathered in a single sendmsg() call when the socket supports it (no concatenation).
+        If message is a list, it's packed with the struct of msg_type (OmniaMessageTypes.PARAMS_STRUCTS) if BINARY_PARAMS_VERSION
+        was negotiated, otherwise converted to string with '-' separator between elements (legacy clients), then encoded.
+        Messages that can't be converted to a byte view (e.g. non-contiguous buffers) are logged and dropped.
+        Messages are queued by priority class (see OmniaMessageTypes.getPriority()): control messages are written before bulk ones.
+        When the queue is full, the send policy of msg_type is applied (see setSendPolicy()).
+        Messages sent while the connection is closed or resuming are dropped.
+
+        NOTE: message is not copied, so it must not be modified after calling send()
 
         :param message: message to be sent
-        :type message: list or bytes
+        :type message: list or bytes-like object (bytes, memoryview, numpy array, ...)
         :param msg_type: type of the message to be sent, use values from OmniaMessageTypes class 
         :type msg_type: str
         """
         if self.alive:   # check if protocol is not resuming
             try:
-                message = self.__prepareMsg(message, msg_type)
-                message = self.__addMsgLength(message)
+                header, payload = self.__prepareMsg(message, msg_type)
+            except (TypeError, ValueError, struct.error) as e:  # not bytes-like, not contiguous, or parameters not fitting the struct
+                self.log.error("Cannot send message of type '{}': {!r}".format(msg_type, e))
+                return
 
-                await self.socket.write(message)
-            except:
-                pass
+            await self.__enqueueMsg((msg_type, header, payload, time.perf_counter()))
+        else:
+            self.__getSendStats(msg_type)["dropped"] += 1
     
     def __prepareMsg(self, msg, msg_type):
         """Prepare the message to be sent:
-            1. if message is a list, convert it to string with '-' separator between elements.
-            2. add encoded msg_type in front
-            3. add lenght of the entire msg_type+message in front 
+            1. if message is a list, pack it with the struct of msg_type (if BINARY_PARAMS_VERSION was negotiated),
+               otherwise convert it to string with '-' separator between elements.
+            2. get a byte view of the message, without copying it
+            3. pack lenght of the entire msg_type+message and encoded msg_type in the header
 
-        :param msg: message to be sent, could be either a list or bytes, depending on the msg_type
-        :type msg: list or bytes
+        :param msg: message to be sent, could be either a list or bytes-like, depending on the msg_type
+        :type msg: list or bytes-like object
         :param msg_type: type of the message to be sent, use values from OmniaMessageTypes class 
         :type msg_type: str
-        :return: encoded message with its length on front
-        :rtype: bytes
+        :return: header and payload
+        :rtype: tuple (bytes, memoryview)
         """
 
         if type(msg) == list:
-            msg = '-'.join(map(str, msg)) # msg string format "<param1>-<param2>-..."
-            msg = msg.encode()  # encode message to byte string
+            if self.protocol_version >= self.BINARY_PARAMS_VERSION and msg_type in self.PARAMS_STRUCTS:
+                msg = self.__packParams(msg, msg_type)
+            else:
+                msg = '-'.join(map(str, msg)) # msg string format "<param1>-<param2>-..."
+                msg = msg.encode()  # encode message to byte string
         
-        b_msg_type = msg_type.encode()  # encode message type to byte string
+        with memoryview(msg) as view:
+            payload = view.cast('B')    # byte view, its length is the size in bytes
         
-        to_send = b_msg_type + msg 
+        b_msg_type = msg_type.encode()  # encode message type to byte string
 
-        #self.log.debug("sending message: {}".format(to_send))
+        # prefix each message with a 4-byte length (network byte order), followed by its type
+        header = self.MSG_HEADER.pack(len(b_msg_type) + len(payload), b_msg_type)
 
-        return to_send
+        return header, payload
 
-    def __addMsgLength(self, msg):
-        """Calculate lenght of msg and pack it at the beginning
+    def __packParams(self, params, msg_type):
+        """Pack parameters with the precompiled struct of msg_type
 
-        :param msg: message to be sent
-        :type msg: bytes 
-        :return: message packed with its lenght
+        :param params: parameters of the message
+        :type params: list
+        :param msg_type: type of the message, must be in OmniaMessageTypes.PARAMS_STRUCTS
+        :type msg_type: str
+        :raises struct.error: if parameters don't fit the struct format
+        :return: packed parameters
         :rtype: bytes
         """
+        params_structs = self.PARAMS_STRUCTS[msg_type]
+
+        if len(params) >= len(params_structs):
+            raise struct.error("too many parameters for message of type '{}': {}".format(msg_type, params))
+        
+        try:
+            return params_structs[len(params)].pack(*params)
+        except struct.error as e:
+            self.log.error("Cannot pack parameters {} of message type '{}': {}".format(params, msg_type, e))
+            raise
+
+    async def __enqueueMsg(self, msg):
+        """Append message to the queue of its priority class, applying the send policy of its type if the queue is full.
+        Starts the send task if it's not running.
+
+        :param msg: (msg_type, header, payload, enqueue time)
+        :type msg: tuple
+        """
+        msg_type = msg[0]
+        policy = self.send_policies.get(msg_type, self.SEND_BLOCK)
+        send_queue = self.__send_queues[self.getPriority(msg_type)]
+
+        while len(send_queue) >= self.send_queue_size:
+            if policy == self.SEND_DROP_NEWEST:
+                self.__dropMsg(msg)
+                return
+            
+            if policy == self.SEND_DROP_OLDEST:
+                old_msg = next((m for m in send_queue if m[0] == msg_type), None)
+
+                if old_msg is not None:
+                    send_queue.remove(old_msg)
+                    self.__dropMsg(old_msg)
+                    continue
+            
+            # SEND_BLOCK, or nothing of this type to replace
+            self.__queue_not_full.clear()
+            await self.__queue_not_full.wait()
+
+            if not self.alive:  # connection closed while waiting, queued messages were dropped
+                self.__dropMsg(msg)
+                return
+
+        send_queue.append(msg)
+        await self.__queue_not_empty.set()
+
+        if self.send_task is None:
+            self.send_task = await self.taskGroup.spawn(self.__sendLoop)
+    
+    def __dropMsg(self, msg):
+        """Discard message, without sending it
+
+        :param msg: (msg_type, header, payload, enqueue time)
+        :type msg: tuple
+        """
+        msg[2].release()
+        self.__getSendStats(msg[0])["dropped"] += 1
+
+    def __popMsgs(self, send_queue):
+        """Pop messages to be written together: small messages are coalesced up to COALESCE_MAX bytes.
+
+        :param send_queue: queue of a priority class
+        :type send_queue: collections.deque
+        :return: list of (msg_type, header, payload, enqueue time)
+        :rtype: list
+        """
+        msgs = [send_queue.popleft()]
+        size = len(msgs[0][1]) + len(msgs[0][2])
+
+        if size < self.COALESCE_SIZE:
+            while send_queue and len(msgs) < self.COALESCE_MSGS:
+                msg = send_queue[0]
+                msg_size = len(msg[1]) + len(msg[2])
+
+                if msg_size >= self.COALESCE_SIZE or size + msg_size > self.COALESCE_MAX:
+                    break
+
+                msgs.append(send_queue.popleft())
+                size += msg_size
+        
+        return msgs
+
+    async def __sendLoop(self):
+        """Send task: writes queued messages to the socket, control messages first.
+        If FEATURE_CHUNKED_BULK is enabled, big bulk messages are split in CHUNK messages,
+        so that control messages can be written between them.
+        Terminates when a write fails, closing the connection (see __closeConnection()).
+        """
+        self.log.debug("SEND TASK STARTED")
+
+        try:
+            await self.__writeQueues()
+        except OSError as e:    # broken connection, nothing else can be written
+            self.log.warning("Connection lost while sending: {!r}".format(e))
+            await self.__closeConnection()
+
+    async def __writeQueues(self):
+        """Write queued messages forever, control messages first
+
+        :raises OSError: if the socket can't be written
+        """
+        control_queue = self.__send_queues[self.PRIORITY_CONTROL]
+        bulk_queue = self.__send_queues[self.PRIORITY_BULK]
+
+        while True:
+            while not (control_queue or bulk_queue or self.__chunked_msg):
+                self.__send_idle = True
+                self.__queue_not_empty.clear()
+                await self.__queue_not_empty.wait()
+            
+            self.__send_idle = False
+
+            if control_queue:
+                msgs = self.__popMsgs(control_queue)
+                await self.__queue_not_full.set()
+
+                await self.__writeMsgs(msgs)
+            
+            elif self.__chunked_msg:
+                await self.__writeChunk()
+            
+            else:
+                msgs = self.__popMsgs(bulk_queue)
+                await self.__queue_not_full.set()
+
+                if len(msgs[0][2]) > self.BULK_CHUNK_SIZE and self.hasFeature(self.FEATURE_CHUNKED_BULK):
+                    self.__chunked_msg = [msgs[0], 0]   # [message, offset of the next chunk]
+                else:
+                    await self.__writeMsgs(msgs)
+
+    async def __writeMsgs(self, msgs):
+        """Write messages to the socket and release them
+
+        :param msgs: messages to be written, in order
+        :type msgs: list of (msg_type, header, payload, enqueue time)
+        :raises OSError: if the socket can't be written
+        """
+        buffers = []
+        for msg in msgs:
+            buffers.append(msg[1])
+            buffers.append(msg[2])
+        
+        try:
+            copied = await self.__writeBuffers(buffers)
+
+            for msg_type, header, payload, enqueue_time in msgs:
+                stats = self.__getSendStats(msg_type)
+                stats["messages"] += 1
+                stats["bytes"] += len(header) + len(payload)
+
+                if copied:
+                    stats["copied"] += len(payload)
+                
+                self.__updateWireLatency(msg_type, enqueue_time)
+        except (curio.CancelledError, OSError):
+            raise
+        except Exception as e:
+            self.log.error("Error sending {} message(s): {!r}".format(len(msgs), e))
+        finally:
+            for msg in msgs:
+                msg[2].release()   # release payload, so that caller's buffer can be freed
+
+    async def __writeChunk(self):
+        """Write next chunk of the bulk message being chunked, as a CHUNK message:
+            "<original msg_type><last chunk flag><chunk>"
+        Releases the message after the last chunk.
+
+        :raises OSError: if the socket can't be written, the message is dropped with the queued ones
+        """
+        msg, offset = self.__chunked_msg
+        msg_type, _, payload, enqueue_time = msg
+
+        chunk = payload[offset : offset + self.BULK_CHUNK_SIZE]
+        offset += len(chunk)
+        last = offset >= len(payload)
+
+        header = self.CHUNK_HEADER.pack(self.CHUNK_HEADER.size - self.HEADER.size + len(chunk), self.CHUNK.encode(), msg_type.encode(), last)
+
+        try:
+            copied = await self.__writeBuffers([header, chunk])
+
+            stats = self.__getSendStats(msg_type)
+            stats["bytes"] += len(header) + len(chunk)
+
+            if copied:
+                stats["copied"] += len(chunk)
+
+            if last:
+                stats["messages"] += 1
+                self.__updateWireLatency(msg_type, enqueue_time)
+            else:
+                self.__chunked_msg[1] = offset
+        except (curio.CancelledError, OSError):
+            raise
+        except Exception as e:
+            self.log.error("Error sending chunk: {!r}".format(e))
+            last = True     # give up on this message
+        finally:
+            chunk.release()
+
+        if last:
+            self.__chunked_msg = None
+            payload.release()
+
+    async def __writeBuffers(self, buffers):
+        """Write buffers to the socket. If the socket supports it, buffers are gathered in a single sendmsg() call,
+        otherwise they are joined (and copied) in a single write.
+
+        :param buffers: buffers to be written, in order
+        :type buffers: list of bytes-like objects
+        :return: True if buffers were copied before writing them
+        :rtype: bool
+        """
+        if self.__gather_socket:
+            try:
+                sent = self.__gather_socket.sendmsg(buffers)
+            except BlockingIOError:
+                sent = 0
+            
+            # write what the socket didn't take, slicing the views (no copy)
+            for buf in buffers:
+                if sent >= len(buf):
+                    sent -= len(buf)
+                else:
+                    await self.socket.write(buf[sent:])
+                    sent = 0
+            
+            return False
+        
+        await self.socket.write(b''.join(buffers))
+        return True
+
+    def __getGatherSocket(self, socket):
+        """Get the raw socket, if it can write several buffers with a single sendmsg() call
+
+        :param socket: curio stream or socket
+        :type socket: curio.io.SocketStream or curio.io.Socket
+        :return: raw socket or None
+        :rtype: socket.socket
+        """
+        raw_socket = getattr(socket, "_file", None)  # curio.io.SocketStream keeps the raw socket here
+        
+        if raw_socket is None:
+            raw_socket = getattr(socket, "_socket", None)    # curio.io.Socket
+        
+        if isinstance(raw_socket, _socket.socket) and not isinstance(raw_socket, ssl.SSLSocket):
+            return raw_socket
+        
+        return None
+
+    async def __resetSendQueue(self):
+        """Stop send task and drop all queued messages
+        """
+        if self.send_task:
+            await self.send_task.cancel()
+            self.send_task = None
+        
+        await self.__dropQueuedMsgs()
+
+    async def __dropQueuedMsgs(self):
+        """Drop all queued messages, and the one being chunked
+        """
+        if self.__chunked_msg:
+            self.__dropMsg(self.__chunked_msg[0])
+            self.__chunked_msg = None
+        
+        self.__send_idle = True
+        
+        for send_queue in self.__send_queues.values():
+            while send_queue:
+                self.__dropMsg(send_queue.popleft())
+        
+        await self.__queue_not_full.set()
+
+    def setSendPolicy(self, msg_type, policy):
+        """Sets what to do when a message of type msg_type is sent and the queue of its priority class is full:
+            a. SEND_BLOCK: wait until there's space in the queue
+            b. SEND_DROP_OLDEST: drop the oldest queued message of the same type (wait, if there's none)
+            c. SEND_DROP_NEWEST: drop the new message
+        1-bit images and delta frames always use SEND_BLOCK: partial images and delta frames are applied to the previous ones,
+        so none can be dropped.
+
+        :param msg_type: type of the message, use values from OmniaMessageTypes class
+        :type msg_type: str
+        :param policy: SEND_BLOCK, SEND_DROP_OLDEST or SEND_DROP_NEWEST
+        :type policy: int
+        """
+        if msg_type in (self.ONE_BIT_IMAGE, self.PARTIAL_ONE_BIT_IMAGE, self.DELTA_FRAME) and policy != self.SEND_BLOCK:
+            self.log.error("1-bit images and delta frames can't be dropped, send policy of type '{}' not changed".format(msg_type))
+            return
+        
+        self.send_policies[msg_type] = policy
+
+    def setSendQueueSize(self, size):
+        """Sets the maximum number of messages in the queue of each priority class
+
+        :param size: maximum number of queued messages
+        :type size: int
+        """
+        self.send_queue_size = size
+
+    def getSendQueueDepth(self, priority=None):
+        """Returns the number of messages waiting to be sent
+
+        :param priority: priority class (OmniaMessageTypes.PRIORITY_*), defaults to None (all classes)
+        :type priority: int, optional
+        :return: queued messages
+        :rtype: int
+        """
+        if priority is None:
+            return sum(len(send_queue) for send_queue in self.__send_queues.values())
+        
+        return len(self.__send_queues[priority])
+
+    def isSending(self):
+        """Returns True if messages are queued or being written to the socket
+
+        :return: False once every message sent has been written (or dropped)
+        :rtype: bool
+        """
+        return not self.__send_idle or self.getSendQueueDepth() > 0
+
+    def __getSendStats(self, msg_type):
+        """Get (and create, if needed) send statistics for msg_type
+
+        :param msg_type: type of the message
+        :type msg_type: str
+        :return: {"messages": int, "bytes": int, "copied": int, "dropped": int}
+        :rtype: dict
+        """
+        if msg_type not in self.send_stats:
+            self.send_stats[msg_type] = {"messages": 0, "bytes": 0, "copied": 0, "dropped": 0}
+        
+        return self.send_stats[msg_type]
+
+    def getSendStats(self, msg_type=None):
+        """Get send statistics: messages sent, bytes written, bytes copied before writing them and messages dropped
+
+        :param msg_type: type of the message, defaults to None (statistics for all types)
+        :type msg_type: str, optional
+        :return: {"messages": int, "bytes": int, "copied": int, "dropped": int} or a dict of them, keyed by msg_type
+        :rtype: dict
+        """
+        if msg_type is None:
+            return self.send_stats
+        
+        return self.__getSendStats(msg_type)
+
+    def __updateWireLatency(self, msg_type, enqueue_time):
+        """Update latency-to-wire statistics of the priority class of msg_type
+
+        :param msg_type: type of the message written
+        :type msg_type: str
+        :param enqueue_time: time.perf_counter() when the message was queued
+        :type enqueue_time: float
+        """
+        latency = (time.perf_counter() - enqueue_time) * 1000     # ms
+        stats = self.wire_latency[self.getPriority(msg_type)]
+
+        if stats["messages"] == 0:
+            stats["avg"] = latency
+        else:
+            stats["avg"] += (latency - stats["avg"]) * self.WIRE_LATENCY_WEIGHT
+        
+        stats["max"] = max(stats["max"], latency)
+        stats["messages"] += 1
 
-        msg = struct.pack('>I', len(msg)) + msg     # prefix each message with a 4-byte length (network byte order)
-        return msg
+    def getWireLatency(self, priority=None):
+        """Get latency-to-wire (in ms), from send() to the message being written to the socket:
+        moving average, maximum and number of messages
+
+        :param priority: priority class (OmniaMessageTypes.PRIORITY_*), defaults to None (all classes)
+        :type priority: int, optional
+        :return: {"avg": float, "max": float, "messages": int} or a dict of them, keyed by priority class
+        :rtype: dict
+        """
+        if priority is None:
+            return self.wire_latency
+        
+        return self.wire_latency[priority]
     
     ### END SEND ###
 
@@ -249,6 +798,9 @@ class OmniaProtocol(OmniaMessageTypes):
 
         await self.calculateLatency()
 
+        # keep latency statistics updated
+        self.latency_task = await self.taskGroup.spawn(self.__latencySampler)
+
         loop_task = await self.addTask(loop)
 
         await loop_task.join()
@@ -275,7 +827,7 @@ class OmniaProtocol(OmniaMessageTypes):
     ### END LOOP ###
 
     async def resumeSocket(self, new_socket, recalc_latency=True):
-        """Close old socket, restart recv_task and recalculate latency if recalc_latency is True
+        """Close old socket, restart recv_task (and the latency sampler, if the connection was closed) and recalculate latency if recalc_latency is True
 
         :param new_socket: new curio opened socket
         :type new_socket: curio.Socket
@@ -285,32 +837,161 @@ class OmniaProtocol(OmniaMessageTypes):
         self.alive = False
         
         await self.recv_task.cancel()
+        await self.__resetSendQueue()   # queued messages were meant for the old socket
 
         await self.socket.flush()
         await self.socket.close()
 
         self.socket = new_socket
+        self.__gather_socket = self.__getGatherSocket(self.socket)
+
+        # new connection, client negotiates again
+        self.__setFeatures(self.client_info.get("features", 0))
+        self.__setProtocolVersion(self.client_info.get("protocol_version", self.TEXT_PARAMS_VERSION))
 
         self.alive = True
 
         # create receive task
         self.recv_task = await self.taskGroup.spawn(self.recv)
 
+        if self.latency_task is None:   # stopped by __closeConnection()
+            self.latency_task = await self.taskGroup.spawn(self.__latencySampler)
+
         await self.calculateLatency()   # recalculate latency
 
         self.log.debug("resumed")
+
+    async def __closeConnection(self):
+        """Close the connection, after the client closed it or it broke: the protocol is marked dead, so that messages sent are dropped,
+        the tasks using the socket (receive, send and latency sampler) are stopped and queued messages are dropped, until resumeSocket().
+        Called by the receive and send tasks.
+        """
+        if not self.alive:  # already closed, or resuming
+            return
+        
+        self.alive = False
+
+        current_task = await curio.current_task()
+
+        # stopped before closing the socket, they could be waiting on it
+        for task in (self.recv_task, self.send_task, self.latency_task):
+            if task is not None and task is not current_task:
+                await task.cancel()
+        
+        self.send_task = None
+        self.latency_task = None
+        await self.__dropQueuedMsgs()
+
+        await self.socket.close()
+
+        self.log.debug("connection closed")
     
+    ### NEGOTIATION ###
+
+    async def __protocolSetupCallback(self, data):
+        """Enable the features requested by the client, answering with the ones actually enabled.
+        Received in this format: "<features>[-<protocol version>]", where features is a bitmask of FEATURE_* values.
+        If the client sent its protocol version, the answer is "<features>-<negotiated protocol version>".
+        The client must wait for the answer before sending other messages.
+
+        :param data: features requested by the client, optionally followed by its protocol version
+        :type data: memoryview
+        """
+        params = bytes(data).split(b'-')
+
+        self.__setFeatures(int(params[0]))
+        answer = [ self.features ]
+
+        if len(params) > 1:
+            self.__setProtocolVersion(int(params[1]))
+            answer.append(self.protocol_version)
+
+        self.log.debug("negotiated features: {:#x}, protocol version: {}".format(self.features, self.protocol_version))
+
+        # PROTOCOL_SETUP has no struct, so the answer is always sent as text
+        # from now on the client can use the negotiated features
+        await self.send(answer, self.PROTOCOL_SETUP)
+
+    def __setFeatures(self, features):
+        """Set enabled features, keeping only the supported ones, and update receive mode.
+        Starts a new session (see getSession())
+
+        :param features: bitmask of FEATURE_* values
+        :type features: int
+        """
+        self.features = features & self.SUPPORTED_FEATURES
+        self.session += 1
+
+        if self.hasFeature(self.FEATURE_FRAMED_RECV):
+            self.recv_mode = self.RECV_FRAMED
+        else:
+            self.recv_mode = self.RECV_LINE
+
+    def __setProtocolVersion(self, version):
+        """Set protocol version, that can't be greater than the one supported by the server
+
+        :param version: protocol version of the client
+        :type version: int
+        """
+        self.protocol_version = max(self.TEXT_PARAMS_VERSION, min(version, self.PROTOCOL_VERSION))
+
+    def getProtocolVersion(self):
+        """Get protocol version negotiated with the client
+
+        :return: protocol version
+        :rtype: int
+        """
+        return self.protocol_version
+
+    def getSession(self):
+        """Get the session number, increased when the connection is resumed or features are negotiated again (PROTOCOL_SETUP):
+        the client starts from scratch, so state kept about what was sent before (e.g. the reference frame of delta frames) is stale
+
+        :return: session number
+        :rtype: int
+        """
+        return self.session
+
+    def hasFeature(self, feature):
+        """Check if feature has been negotiated with the client
+
+        :param feature: one of the FEATURE_* values
+        :type feature: int
+        :return: True if feature is enabled
+        :rtype: bool
+        """
+        return bool(self.features & feature)
+
+    ### END NEGOTIATION ###
+
     ### LATENCY ###
 
     async def __latencyCallback(self, response):
-        """Calculate latency (in ms) by averaging all latency readings
+        """Add round-trip time of the echoed LATENCY message to latency statistics.
+        If the message was sent by calculateLatency(), calculate latency (in ms) by averaging all latency readings
 
-        :param response: latency message from protocol
-        :type response: str
+        :param response: latency message echoed by the client, containing its sequence number
+        :type response: memoryview
         """
 
-        if response != '':
-            self.tot_latency += (time.time() - float(response)) / 2     # server to client message latency
+        if len(response) > 0:
+            now = time.perf_counter_ns()
+
+            seq = self.__decodeLatencySeq(response)
+            
+            if seq is None:
+                self.log.debug("Unknown latency message: %s", bytes(response))
+                return
+            
+            sent_time, from_calculate, _ = self.__latency_in_flight.pop(seq)
+            rtt = (now - sent_time) / 1e9   # seconds
+
+            self.latency_stats.addSample(rtt * 1000)    # ms
+
+            if not from_calculate:    # sent by the latency sampler
+                return
+            
+            self.tot_latency += rtt / 2     # server to client message latency
             
             if self.n_latency_sent == self.latency_iterations:  # reached desired number of sent messages 
 
@@ -320,22 +1001,74 @@ class OmniaProtocol(OmniaMessageTypes):
 
                 self.log.debug("latency: {} ms".format(self.latency))
 
-                self.removeReceiveCallback(self.LATENCY)    # latency callback not needed anymore
-
                 # if there's a registered callback, call it with the result
                 if self.__final_latency_callback:
                     self.__final_latency_callback(self.latency)
             else:
-                await self.__sendLatencyMessage()
+                self.n_latency_sent += 1   # store how many messages are sent
+                await self.__sendLatencyMessage(from_calculate=True)
+
+    def __decodeLatencySeq(self, response):
+        """Decode the sequence number echoed by the client, the way it was sent: features can be negotiated
+        while a LATENCY message waits for its echo, so the current ones don't tell how it was encoded
+
+        :param response: latency message echoed by the client
+        :type response: memoryview
+        :return: sequence number of a message waiting for its echo, None if there's none
+        :rtype: int
+        """
+        candidates = []     # (sequence number, sent packed)
+
+        if len(response) == self.LATENCY_SEQ.size:
+            candidates.append((self.LATENCY_SEQ.unpack(response)[0], True))
+        
+        if bytes(response).isdigit():
+            candidates.append((int(bytes(response)), False))
+        
+        for seq, packed in candidates:
+            if seq in self.__latency_in_flight and self.__latency_in_flight[seq][2] == packed:
+                return seq
+        
+        return None
+
+    async def __sendLatencyMessage(self, from_calculate=False):
+        """Send message to calculate latency, containing a sequence number that the client echoes.
+        Send time of each sequence number is stored (up to LATENCY_MAX_IN_FLIGHT messages, the oldest sampler ones are forgotten first),
+        so that several messages can wait for their echo at the same time.
+        The sequence number is sent packed if the client sends framed messages, as text otherwise, and decoded the same way when echoed.
 
-    async def __sendLatencyMessage(self):
-        """Send message to calculate latency 
+        :param from_calculate: True if sent by calculateLatency(), defaults to False
+        :type from_calculate: bool, optional
         """
-        self.l_time = time.time()
+        seq = self.__latency_seq
+        self.__latency_seq = (seq + 1) % (1 << (8 * self.LATENCY_SEQ.size))
 
-        await self.send( str(self.l_time).encode(), self.LATENCY)
+        if len(self.__latency_in_flight) >= self.LATENCY_MAX_IN_FLIGHT:
+            # forget the oldest message, its echo is probably lost. Messages of calculateLatency() are kept, so that it
+            # gets to its callback: only the last one is waited for, older ones are forgotten if all the others are
+            evicted = next((old_seq for old_seq, (_, calc, _) in self.__latency_in_flight.items() if not calc), next(iter(self.__latency_in_flight)))
+            self.__latency_in_flight.pop(evicted)
+
+        packed = self.hasFeature(self.FEATURE_FRAMED_RECV)
+
+        if packed:
+            message = self.LATENCY_SEQ.pack(seq)
+        else:
+            message = str(seq).encode()     # echoed in a line, can't contain '\n'
 
-        self.n_latency_sent += 1   # store how many messages are sent
+        self.__latency_in_flight[seq] = (time.perf_counter_ns(), from_calculate, packed)
+
+        await self.send(message, self.LATENCY)
+
+    async def __latencySampler(self):
+        """Latency sampler task: sends a LATENCY message every latency_sample_interval seconds,
+        to keep latency statistics updated
+        """
+        while True:
+            await curio.sleep(self.latency_sample_interval or self.LATENCY_SAMPLE_INTERVAL)
+
+            if self.latency_sample_interval > 0:
+                await self.__sendLatencyMessage()
 
     async def calculateLatency(self, iterations=10, callback=None):
         """Calculate latency (in ms)
@@ -348,11 +1081,11 @@ class OmniaProtocol(OmniaMessageTypes):
 
         self.latency_iterations = iterations
         self.__final_latency_callback = callback
+        self.tot_latency = 0.0
         self.log.debug("calculating latency...")
 
-        self.registerReceiveCallback(self.__latencyCallback, self.LATENCY) 
-
-        await self.__sendLatencyMessage()
+        self.n_latency_sent = 1
+        await self.__sendLatencyMessage(from_calculate=True)
 
     def getLatency(self):
         """Get last calculated latency (in ms)
@@ -364,5 +1097,22 @@ class OmniaProtocol(OmniaMessageTypes):
             return self.latency
         else:
             self.log.error("Latency was never calculated")
+
+    def getLatencyStats(self):
+        """Get rolling round-trip time statistics (in ms), updated by the latency sampler. 
+        See OmniaLatencyStats.getStats()
+
+        :return: {"last", "ewma", "min", "p50", "p95", "p99", "jitter", "samples"}
+        :rtype: dict
+        """
+        return self.latency_stats.getStats()
+
+    def setLatencySampleInterval(self, interval):
+        """Sets how often the latency sampler sends a LATENCY message
+
+        :param interval: seconds between two LATENCY messages, 0 to stop sampling
+        :type interval: float
+        """
+        self.latency_sample_interval = interval
     
     ### END LATENCY ###
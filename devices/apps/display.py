@@ -5,6 +5,7 @@ import json
 ### Omnia libraries ###
 from modules.omniaUI                import OmniaUI, OmniaUIElement
 from modules.omniaDisplay           import OmniaILI9341Display, OmniaTouchscreen
+from modules.omniaAssets            import OmniaAssets
 ### --- ###
 
 class Display:
@@ -85,6 +86,7 @@ class Display:
         self.omniaDisplay = OmniaILI9341Display(self.omniaProtocol, (self.width,self.height))
         self.omniaTouchscreen = OmniaTouchscreen(self.omniaProtocol, self.width, self.height)
 
+        self.omniaDisplay.setDeltaMode(True)    # most of the UI doesn't change between two frames
     
     def touchCallback(self, xy_coordinates):
 
@@ -145,12 +147,16 @@ class Display:
         print("button '{}' clicked".format(button.id))
 
     async def send_img(self):
-        img = self.ui.get_image()
-        img=img.convert("RGB")
-        #img.rotate(90, expand=True)
+        generation = self.ui.getGeneration()
+        damage = self.ui.getDamage()    # rectangles repainted by the UI, the only ones sent in delta mode
 
-        self.omniaDisplay.setImage(img)
-        await self.omniaDisplay.sendDisplay()
+        if generation != self.omniaDisplay.sent_generation:    # otherwise the image is already on the display
+            img=self.ui.image.convert("RGB")    # a new image
+            #img.rotate(90, expand=True)
+
+            self.omniaDisplay.setImage(img)
+        
+        await self.omniaDisplay.sendDisplay(generation=generation, damage=damage)    # counts suppressed frames
 
     def setSongInfo(self):
         self.song_title = self.playlist[self.pl_index]["name"]
@@ -159,9 +165,8 @@ class Display:
 
         self.song_name.setText(self.song_title+" - "+self.song_author)
 
-        img = Image.open(self.song_cover)
-        img = img.convert("RGBA")
-        img = img.resize((160,160))
+        # decoded once per cover, shared with the other displays
+        img = OmniaAssets.getDefault().getImage(self.song_cover, "RGBA", (160,160))
         self.cover.addImage(img)
 
     async def start(self):
@@ -1,15 +1,24 @@
 # install opencv: https://stackoverflow.com/a/60201245/5094892
 # run python3: LD_PRELOAD=/usr/lib/arm-linux-gnueabihf/libatomic.so.1 python3
-import cv2
 from PIL import Image
 import io
+import time
 import curio
 
 ### Omnia libraries ###
 from modules.omniaDisplay           import OmniaILI9341Display, OmniaTouchscreen, OmniaDisplay
+from modules.omniaVideo             import OmniaVideoRateController, OmniaVideoDecoder, OmniaVideoCache
 ### --- ###
 
 class Screen():
+
+    # transcoded variants of the video, one per resolution scale of the rate controller levels, at the best quality of that scale
+    CACHE_QUALITIES = {
+        scale: max(q for q, s, _ in OmniaVideoRateController.LEVELS if s == scale)
+        for _, scale, _ in OmniaVideoRateController.LEVELS
+    }
+    CACHE_STABLE_TIME = 5.0     # seconds the rate controller must stay at another scale before its variant is transcoded
+
     def __init__(self, username, omniaController):
         self.device = 0
         self.username = username
@@ -19,6 +28,7 @@ class Screen():
 
         self.omniaDisplay = None
         self.omniaTouchscreen = None
+        self.rateController = None  # adapts quality, resolution and frame skip to hold fps
 
         self.width = 540
         self.height = 1170
@@ -27,9 +37,17 @@ class Screen():
 
         self.time_sleep = 1/self.fps
         
-        self.vidcap = cv2.VideoCapture('devices/resources/video/gaber.mp4')
-        self.success = None
-        self.image = None
+        self.video_path = 'devices/resources/video/gaber.mp4'
+
+        # JPEG frames transcoded once per (resolution, quality) and shared by all screens
+        self.videoCache = OmniaVideoCache.getDefault()
+        self.cachedVideo = None
+        self.cacheScale = None      # scale of the variant requested to the cache, see CACHE_QUALITIES
+        self.nextCacheScale = None  # scale of the rate controller, requested after CACHE_STABLE_TIME
+        self.nextCacheTime = 0.0
+        # frames decoded, resized and converted to RGB in a background thread, until the video is transcoded
+        self.decoder = OmniaVideoDecoder(self.video_path, (self.width, self.height))
+        self.position = 0   # number of the next frame in the video
         self.count = 0
         
         ## touch
@@ -64,6 +82,15 @@ class Screen():
         #self.omniaDisplay = OmniaILI9341Display(self.omniaProtocol, (self.width,self.height))
         self.omniaDisplay = OmniaDisplay(self.omniaProtocol, (self.width, self.height))
         self.omniaTouchscreen = OmniaTouchscreen(self.omniaProtocol, self.width, self.height)
+        self.rateController = OmniaVideoRateController(self.omniaDisplay, self.fps)
+
+    def getVideoMetrics(self):
+        """Get parameters chosen by the rate controller and achieved fps, see OmniaVideoRateController.getMetrics()
+        """
+        if self.rateController:
+            return self.rateController.getMetrics()
+        
+        return {}
 
     def touchCallback(self, xy_coordinates):
 
@@ -73,12 +100,16 @@ class Screen():
     async def start(self):
         await self.omniaTouchscreen.startReadingTouchscreen(self.touchCallback)
 
-        self.success, self.image = self.vidcap.read()
+        self.cachedVideo = None
+        self.cacheScale = None
+        self.decoder.start()
+        self.position = 0
         self.count = 0
 
         await self.omniaDisplay.startVideoStream()
     
     async def stop(self):
+        self.decoder.stop()
         await self.omniaDisplay.stopVideoStream()
         await self.omniaTouchscreen.stopReadingTouchscreen()
 
@@ -86,19 +117,81 @@ class Screen():
 
         if self.device:
 
-            if self.success:
+            if not self.__isFinished():
                 if self.y < 150:
-                    im=Image.fromarray(self.image)
-                    #im=im.rotate(90, expand=True)
-                    im=im.convert("RGB")
-                    im=im.resize((self.width,self.height))
-
-                    await self.omniaDisplay.sendVideoFrame(im)
-
-                    for _ in range(2):
-                        self.success, self.image = self.vidcap.read()
-                        self.count += 1
+                    await self.__sendNextFrame()
                 else:
                     await self.omniaDisplay.sendVideoFrame()    # send empty array
             else:
                 await self.omniaDisplay.stopVideoStream()
+
+    def __isFinished(self):
+        if self.cachedVideo:
+            return self.position >= self.cachedVideo.frames
+        
+        return self.decoder.isFinished()
+
+    def __getCacheScale(self, scale):
+        """Get the scale of the variant to play: the scale of the rate controller, once it held it for CACHE_STABLE_TIME,
+        so that a level moving back and forth doesn't transcode the video again and again
+
+        :param scale: resolution scale of the rate controller
+        :type scale: float
+        :return: resolution scale of the variant
+        :rtype: float
+        """
+        now = time.perf_counter()
+
+        if scale != self.nextCacheScale:
+            self.nextCacheScale = scale
+            self.nextCacheTime = now
+        
+        if self.cacheScale is None or now - self.nextCacheTime >= self.CACHE_STABLE_TIME:
+            self.cacheScale = scale
+
+        return self.cacheScale
+
+    async def __sendNextFrame(self):
+        params = self.rateController.getParameters()
+        scale = self.__getCacheScale(params["scale"])
+        size = (self.width * scale, self.height * scale)
+
+        # transcoded in background on first request, until then the previous variant (or the decoder) is used
+        cachedVideo = await self.videoCache.getFile(self.video_path, size, self.CACHE_QUALITIES[scale])
+
+        if cachedVideo:
+            if self.cachedVideo is None:    # switch from the decoder
+                self.decoder.stop()
+                self.position = self.decoder.position + 1
+            
+            self.cachedVideo = cachedVideo
+
+        if self.cachedVideo:
+            if self.position >= self.cachedVideo.frames:
+                return
+
+            params = self.rateController.nextFrame()
+
+            # slice of the mapped file: no decoding, encoding or copy
+            await self.omniaDisplay.sendEncodedVideoFrame(self.cachedVideo.getFrame(self.position))
+            self.position += 1 + params["skip"]
+        else:
+            frame = self.decoder.popFrame()
+
+            if frame is None:   # decoder is behind, try again later
+                return
+            
+            params = self.rateController.nextFrame()
+
+            im=Image.fromarray(frame)   # RGB, copied from the decoder's ring
+            #im=im.rotate(90, expand=True)
+
+            await self.omniaDisplay.sendVideoFrame(im, quality=params["quality"])
+            self.position = self.decoder.position + 1
+
+            # applied to the next decoded frames
+            self.decoder.setSize((self.width * params["scale"], self.height * params["scale"]))
+            self.decoder.setSkip(params["skip"])
+
+        self.count += 1
+        self.time_sleep = self.rateController.getSleepTime()    # used by Device to pace frames
@@ -1,6 +1,5 @@
 import wave
 import json
-import struct
 import numpy
 
 ### Omnia libraries ###
@@ -77,10 +76,11 @@ class Sound():
 
     def calculateVolume(self, data, volume):
         if volume != 0:
-            data = numpy.frombuffer(data, numpy.int16) // 20 * volume
+            samples = numpy.frombuffer(data, numpy.int16)
+            data = (samples // 20 * volume).astype(samples.dtype, copy=False)  # a float volume would promote samples to float64
             #i_data = [self.scaleSample(x,volume) for x in data]
 
-            return struct.pack('h'*len(data), *data)
+            return memoryview(data).cast('B')   # send samples as they are, without packing them again
         else:
             return b'0'
 
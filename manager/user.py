@@ -11,6 +11,7 @@ from manager.notifyService          import NotifyService
 
 from modules.omniaDisplay           import Omnia1BitDisplay
 from modules.omniaIO                import OmniaPins
+from modules.omniaAssets            import OmniaAssets
 ### --- ###
 
 class User:
@@ -72,7 +73,8 @@ class User:
     # watch startup
     async def initConnection(self):    
         # send user profile pic
-        pic = Image.open("users/" + self.name + "/resources/images/pic.png")
+        # decoded once per user, copied because the display draws on its image
+        pic = OmniaAssets.getDefault().getImage("users/" + self.name + "/resources/images/pic.png").copy()
         self.omnia1BitDisplay.setImage(pic)
         await self.omnia1BitDisplay.sendDisplay()
         
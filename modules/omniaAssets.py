@@ -0,0 +1,184 @@
+from PIL import Image
+from collections import OrderedDict
+import logging
+import os
+import threading
+
+"""Decoded images shared by UIs, device apps and user apps
+"""
+
+class OmniaAssets:
+    """Cache of images decoded from files, converted and resized, one per (path, mode, size).
+
+    Images are decoded once and shared by every caller: they must not be modified, copy them first (e.g. to draw on them).
+    The cache holds at most max_bytes of decoded pixels, the least recently used images are evicted first.
+    An image is decoded again when the size or modification time of its file change.
+    """
+
+    DEFAULT_MAX_BYTES = 32 * 1024 * 1024    # budget of decoded pixels
+
+    __default = None    # cache shared by all apps
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        """Initialization
+
+        :param max_bytes: maximum size of the cached images (in bytes), defaults to DEFAULT_MAX_BYTES
+        :type max_bytes: int, optional
+        """
+
+        ### Cache ###
+        self.max_bytes = max_bytes
+        self.__images = OrderedDict()   # {(path, mode, size): (image, file version, bytes)}, least recently used first
+        self.__bytes = 0                # size of the cached images
+        self.__lock = threading.Lock()  # images are loaded by worker threads too
+        ### --- ###
+
+        ### Statistics ###
+        self.hits = 0       # images found in the cache
+        self.misses = 0     # images decoded
+        self.evictions = 0  # images evicted to hold the budget
+        ### --- ###
+
+        ### Log ###
+        self.log = logging.getLogger('OmniaAssets')
+        ### --- ###
+
+    @classmethod
+    def getDefault(cls):
+        """Get the cache shared by all apps, created with default parameters if not set by setDefault()
+
+        :return: default cache
+        :rtype: OmniaAssets
+        """
+        if cls.__default is None:
+            cls.__default = cls()
+
+        return cls.__default
+
+    @classmethod
+    def setDefault(cls, assets):
+        """Set the cache shared by all apps
+
+        :param assets: default cache
+        :type assets: OmniaAssets
+        """
+        cls.__default = assets
+
+    def getImage(self, path, mode=None, size=None):
+        """Get an image decoded from a file, converted and resized
+
+        :param path: path to the image file
+        :type path: str
+        :param mode: mode the image is converted to, defaults to None (mode of the file). Refer to pillow modes (https://pillow.readthedocs.io/en/stable/handbook/concepts.html#concept-modes)
+        :type mode: str, optional
+        :param size: (width, height) the image is resized to, defaults to None (size of the file)
+        :type size: tuple, optional
+        :return: image, shared: it must not be modified
+        :rtype: PIL.Image
+        """
+        key = (os.path.abspath(path), mode, tuple(size) if size else None)
+        version = self.__getFileVersion(path)   # raises OSError if the file doesn't exist, like Image.open()
+
+        with self.__lock:
+            entry = self.__images.get(key)
+
+            if entry and entry[1] == version:
+                self.__images.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+
+            self.misses += 1
+
+        image = Image.open(path)
+        if mode:
+            image = image.convert(mode)
+        if size:
+            image = image.resize(size)
+        image.load()    # decoded now, not when first drawn
+
+        image_bytes = self.__getImageBytes(image)
+
+        with self.__lock:
+            old_entry = self.__images.pop(key, None)
+            if old_entry:
+                self.__bytes -= old_entry[2]
+
+            if image_bytes <= self.max_bytes:
+                self.__images[key] = (image, version, image_bytes)
+                self.__bytes += image_bytes
+                self.__evict()
+            else:
+                self.log.debug("{!r} is larger than the budget, not cached".format(path))
+
+        return image
+
+    def setMaxBytes(self, max_bytes):
+        """Set the budget of the cache, evicting images if needed
+
+        :param max_bytes: maximum size of the cached images (in bytes)
+        :type max_bytes: int
+        """
+        with self.__lock:
+            self.max_bytes = max_bytes
+            self.__evict()
+
+    def clear(self):
+        """Empty the cache, images already in use stay valid
+        """
+        with self.__lock:
+            self.__images.clear()
+            self.__bytes = 0
+
+    def __evict(self):
+        """Evict the least recently used images until the cache holds the budget, called with the lock held
+        """
+        while self.__bytes > self.max_bytes and self.__images:
+            key, (image, version, image_bytes) = self.__images.popitem(last=False)
+            self.__bytes -= image_bytes
+            self.evictions += 1
+
+    @staticmethod
+    def __getImageBytes(image):
+        """Get the memory used by the pixels of an image
+
+        :param image: image
+        :type image: PIL.Image
+        :return: size (in bytes)
+        :rtype: int
+        """
+        return image.width * image.height * len(image.getbands())
+
+    @staticmethod
+    def __getFileVersion(path):
+        """Get what identifies the content of a file
+
+        :param path: path to the file
+        :type path: str
+        :return: (modification time, size)
+        :rtype: tuple
+        """
+        stat = os.stat(path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def getStats(self):
+        """Get cache statistics
+
+        :return: {
+                    "hits": <images found in the cache>,
+                    "misses": <images decoded>,
+                    "evictions": <images evicted>,
+                    "images": <cached images>,
+                    "bytes": <size of the cached images>,
+                    "max_bytes": <budget>
+                }
+        :rtype: dict
+        """
+        with self.__lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "images": len(self.__images),
+                "bytes": self.__bytes,
+                "max_bytes": self.max_bytes,
+            }
@@ -70,10 +70,10 @@ class OmniaBLE:
         """Preprocesses received BLE message from protocol
 
         :param received_ble: has this format: "<rssi>+<first_id>,<rssi>+<second_id>,..."
-        :type received_ble: str
+        :type received_ble: memoryview
         """
 
-        ble = ble.split(',')
+        ble = bytes(received_ble).decode().split(',')
 
         nearest_RSSI = -200     # out of range initial value
         nearest_user = ""
@@ -189,10 +189,10 @@ class OmniaNFC:
         """Preprocesses received NFC message from protocol
 
         :param received_nfc: has this format: "<nfc_id>:"
-        :type received_nfc: str
+        :type received_nfc: memoryview
         """
 
-        nfc = received_nfc.split(":")    # -> nfc = ["<nfc_id>", ""]
+        nfc = bytes(received_nfc).decode().split(":")    # -> nfc = ["<nfc_id>", ""]
         
         if(len(nfc) >= 2):  # check if received nfc is valid
             
@@ -1,22 +1,38 @@
 from PIL                    import Image, ImageDraw, ImageFont, ImageOps
-import io
 import logging
 import json
 import time
+import struct
+import numpy
+import curio
 
 ### Omnia libraries ###
 from core.omniaMessageTypes      import OmniaMessageTypes as OMT
+from modules.omniaEncoder        import OmniaEncoder
+from modules.omniaFonts          import OmniaFonts
 ### --- ###
 
 class OmniaDisplay:
     """Utilities for displays. 
     Uses PIL library for image processing.
     You can draw on the display image using OmniaDisplay.image_draw, which is a PIL ImageDraw instance.
-    FONT_ARIAL_11, FONT_ARIAL_30 are ImageFont.truetype objects already instanciated.
+    FONT_ARIAL_11, FONT_ARIAL_30 are ImageFont.truetype objects already instanciated, shared through OmniaFonts.
     """
 
-    FONT_ARIAL_11 = ImageFont.truetype("fonts/Arial.ttf", 11)
-    FONT_ARIAL_30 = ImageFont.truetype("fonts/Arial.ttf", 30)
+    FONT_ARIAL_11 = OmniaFonts.getFont("fonts/Arial.ttf", 11)
+    FONT_ARIAL_30 = OmniaFonts.getFont("fonts/Arial.ttf", 30)
+
+    MAX_IN_FLIGHT = 2   # default maximum number of images being encoded at the same time for this display
+    ENCODE_TIME_WEIGHT = 0.2    # weight of the last image in the encoding time moving average
+
+    ### Delta frames ###
+    DELTA_TYPES = (OMT.RGBA_IMAGE, OMT.VIDEO_FRAME)     # types of the frames that can be sent as DELTA_FRAME
+    TILE_SIZE = 32          # side of the compared tiles (in pixels), a multiple of the JPEG block size
+    KEYFRAME_INTERVAL = 60  # a full frame is sent after this number of delta frames
+    DELTA_MAX_RATIO = 0.5   # send the full frame if more than this ratio of the tiles changed
+    DELTA_HEADER = struct.Struct('>cBH')    # type of the frame the tiles are applied to, tile size, number of tiles
+    TILE_HEADER = struct.Struct('>HHI')     # x, y of the top-left corner, length of the encoded tile
+    ### --- ###
 
     def __init__(self, omniaProtocol, dimensions, image_mode="RGBA"):
         """Initialization
@@ -50,6 +66,29 @@ class OmniaDisplay:
         self.img_is_new = False     # True if there is a new image to display
         ### --- ###
 
+        ### Encoding ###
+        self.encoder = OmniaEncoder.getDefault()    # encodes images off the event loop
+        self.max_in_flight = self.MAX_IN_FLIGHT
+        self.in_flight = 0      # images being encoded
+        self.__pending = {}     # {msg_type: (image, image_format, params, damage)}, newest image waiting for an encoding slot
+        self.__encode_seq = {}  # {msg_type: sequence number of the last image submitted}
+        self.__sent_seq = {}    # {msg_type: sequence number of the last image sent}
+        self.dropped_frames = 0 # images replaced by newer ones before being encoded, or encoded too late
+        self.encode_time = 0.0  # moving average of seconds to encode an image, waiting for a free worker included
+        ### --- ###
+
+        ### Delta frames ###
+        self.delta_mode = False
+        self.tile_size = self.TILE_SIZE
+        self.keyframe_interval = self.KEYFRAME_INTERVAL
+        self.__reference = {}   # {msg_type: (last frame sent as numpy array, delta frames sent after it)}
+        self.__session = omniaProtocol.getSession()   # session of the frames sent, see checkSession()
+        self.__send_policies = {}   # send policies of DELTA_TYPES before enabling delta mode
+        self.keyframes = 0      # full frames sent in delta mode
+        self.delta_frames = 0   # DELTA_FRAME messages sent
+        self.unchanged_frames = 0   # frames not sent in delta mode, because identical to the previous one
+        ### --- ###
+
         ### Log ###
         self.log = logging.getLogger(
             '[{}]: OmniaDisplay'.format(self.omniaProtocol.client_info["name"])
@@ -128,24 +167,259 @@ class OmniaDisplay:
         """
         self.image_draw = ImageDraw.Draw(self.image)
 
+    def setEncoder(self, encoder):
+        """Sets the encoder used by this display, instead of the shared one
+
+        :param encoder: encoder
+        :type encoder: OmniaEncoder
+        """
+        self.encoder = encoder
+    
+    def setMaxInFlight(self, max_in_flight):
+        """Sets the maximum number of images of this display being encoded at the same time
+
+        :param max_in_flight: maximum number of images
+        :type max_in_flight: int
+        """
+        self.max_in_flight = max(1, max_in_flight)
+
+    def setDeltaMode(self, delta_mode, tile_size=TILE_SIZE, keyframe_interval=KEYFRAME_INTERVAL):
+        """Send only the tiles of an image or video frame that changed since the previous one, as a DELTA_FRAME message:
+            "<type of the frame><tile size><number of tiles>" followed, for each tile, by "<x><y><length><encoded tile>"
+        (see DELTA_HEADER and TILE_HEADER). Tiles are tile_size x tile_size (smaller on the right and bottom borders)
+        and encoded with the format and parameters of the frame. Nothing is sent if the frame didn't change.
+        The full frame (keyframe) is sent first, after keyframe_interval delta frames and when more than DELTA_MAX_RATIO of the tiles changed.
+
+        Used for RGBA_IMAGE and VIDEO_FRAME messages to clients that support them (OmniaProtocol.FEATURE_DELTA_FRAME).
+        In delta mode images are encoded one at a time
+        and never dropped once queued, since each one is compared with the previous.
+
+        :param delta_mode: True to enable delta frames
+        :type delta_mode: bool
+        :param tile_size: side of the tiles (in pixels), up to 255, defaults to TILE_SIZE
+        :type tile_size: int, optional
+        :param keyframe_interval: delta frames between two full frames, defaults to KEYFRAME_INTERVAL
+        :type keyframe_interval: int, optional
+        """
+        if delta_mode and not self.delta_mode:
+            for msg_type in self.DELTA_TYPES:
+                self.__send_policies[msg_type] = self.omniaProtocol.send_policies.get(msg_type, self.omniaProtocol.SEND_BLOCK)
+                self.omniaProtocol.setSendPolicy(msg_type, self.omniaProtocol.SEND_BLOCK)
+        elif not delta_mode and self.delta_mode:
+            for msg_type, policy in self.__send_policies.items():
+                self.omniaProtocol.setSendPolicy(msg_type, policy)
+
+        self.delta_mode = delta_mode
+        self.tile_size = max(1, min(tile_size, 255))
+        self.keyframe_interval = keyframe_interval
+        self.__reference.clear()
+
+    def checkSession(self):
+        """Forget the frames sent to the client if a new session started since the last one (see OmniaProtocol.getSession()):
+        the client doesn't have them anymore, so the next frame is sent entirely. Called before sending a frame
+
+        :return: True if a new session started
+        :rtype: bool
+        """
+        session = self.omniaProtocol.getSession()
+
+        if session == self.__session:
+            return False
+        
+        self.__session = session
+        self.resetSentFrames()
+
+        return True
+
+    def resetSentFrames(self):
+        """Forget the frames sent to the client, the next frame of each type is sent entirely (a keyframe in delta mode)
+        """
+        self.__reference.clear()
+
+    def __isDeltaEnabled(self, msg_type):
+        """Check if frames of msg_type are sent as DELTA_FRAME messages
+
+        :param msg_type: type of the message
+        :type msg_type: str
+        :return: True if delta mode is enabled and supported by the client for msg_type
+        :rtype: bool
+        """
+        return (self.delta_mode and msg_type in self.DELTA_TYPES
+                and self.omniaProtocol.hasFeature(self.omniaProtocol.FEATURE_DELTA_FRAME))
+
+    async def submitImage(self, image, image_format, msg_type, damage=None, **params):
+        """Encode image with the encoder and send it, without waiting for it.
+        If max_in_flight images are already being encoded, the image waits for a free slot,
+        replacing (dropping) the image of the same type that was already waiting: images are dropped rather than queued
+        when the encoder falls behind. Images encoded after a newer one of the same type has been sent are dropped too:
+        images of different types (e.g. UI images and video frames) don't replace each other.
+
+        In delta mode (see setDeltaMode()) images are encoded one at a time.
+
+        NOTE: image must not be modified after calling this method
+
+        :param image: image to be encoded
+        :type image: PIL.Image
+        :param image_format: image format encoding. Refer to pillow image formats (https://pillow.readthedocs.io/en/stable/handbook/image-file-formats.html)
+        :type image_format: str
+        :param msg_type: type of the message, use values from OmniaMessageTypes class
+        :type msg_type: str
+        :param damage: rectangles (x0, y0, x1, y1) that changed since the previous image (e.g. OmniaUI.getDamage()),
+                        used in delta mode instead of comparing the images, defaults to None (compare them)
+        :type damage: list, optional
+        :param params: encoder parameters passed to PIL.Image.save() (e.g. quality=80)
+        """
+        self.checkSession()
+
+        if self.in_flight >= (1 if self.delta_mode else self.max_in_flight):
+            if msg_type in self.__pending:
+                self.dropped_frames += 1
+
+                # the dropped image changed these rectangles too
+                old_damage = self.__pending[msg_type][3]
+                damage = None if old_damage is None or damage is None else old_damage + damage
+            
+            self.__pending[msg_type] = (image, image_format, params, damage)
+            return
+        
+        self.in_flight += 1
+        await curio.spawn(self.__encodeAndSend, image, image_format, msg_type, params, damage, daemon=True)
+
+    async def __encodeAndSend(self, image, image_format, msg_type, params, damage):
+        """Encode and send image, then the images waiting for a free slot
+
+        :param image: image to be encoded
+        :type image: PIL.Image
+        :param image_format: image format encoding
+        :type image_format: str
+        :param msg_type: type of the message
+        :type msg_type: str
+        :param params: encoder parameters
+        :type params: dict
+        :param damage: rectangles changed since the previous image, None if unknown
+        :type damage: list
+        """
+        try:
+            while True:
+                seq = self.__encode_seq.get(msg_type, 0) + 1
+                self.__encode_seq[msg_type] = seq
+
+                self.checkSession()
+                session = self.__session
+
+                try:
+                    start = time.perf_counter()
+
+                    if self.__isDeltaEnabled(msg_type):
+                        buf, send_type = await self.__encodeDelta(image, image_format, msg_type, params, damage)
+                    else:
+                        buf, send_type = await self.encoder.encode(image, image_format, **params), msg_type
+                    
+                    self.encode_time += (time.perf_counter() - start - self.encode_time) * self.ENCODE_TIME_WEIGHT
+                except curio.CancelledError:
+                    raise
+                except Exception:
+                    self.log.exception("Cannot encode image")
+                    buf = None
+                
+                if buf is not None and send_type == OMT.DELTA_FRAME and session != self.omniaProtocol.getSession():
+                    buf = None  # the client lost its reference frame while encoding, the next frame is a keyframe
+                    self.dropped_frames += 1
+                
+                if buf is not None:
+                    if seq > self.__sent_seq.get(msg_type, 0):
+                        self.__sent_seq[msg_type] = seq
+                        await self.omniaProtocol.send(buf, send_type)   # buffer is released by omniaProtocol once sent
+                    else:   # a newer image of this type has already been sent
+                        self.dropped_frames += 1
+                        self.__reference.pop(msg_type, None)    # the client doesn't have this frame
+                
+                if not self.__pending:
+                    break
+                
+                msg_type, (image, image_format, params, damage) = self.__pending.popitem()
+        finally:
+            self.in_flight -= 1
+
+    async def __encodeDelta(self, image, image_format, msg_type, params, damage=None):
+        """Compare image with the last frame of msg_type sent, tile by tile, and encode the changed tiles
+        as a DELTA_FRAME message, or the full image if a keyframe is due (see setDeltaMode())
+
+        :param image: image to be encoded
+        :type image: PIL.Image
+        :param image_format: image format encoding
+        :type image_format: str
+        :param msg_type: type of the message, one of DELTA_TYPES
+        :type msg_type: str
+        :param params: encoder parameters
+        :type params: dict
+        :param damage: rectangles changed since the previous image, defaults to None (compare the images)
+        :type damage: list, optional
+        :return: encoded message and its type, (None, None) if the image didn't change
+        :rtype: tuple
+        """
+        frame = numpy.asarray(image)
+        reference, deltas = self.__reference.get(msg_type, (None, 0))
+
+        if reference is not None and reference.shape == frame.shape and deltas < self.keyframe_interval:
+            height, width = frame.shape[:2]
+
+            if damage is not None:
+                # tiles covered by the damaged rectangles, no need to compare
+                changed = numpy.zeros((-(-height // self.tile_size), -(-width // self.tile_size)), bool)
+                for x0, y0, x1, y1 in damage:
+                    x0, y0, x1, y1 = max(x0, 0), max(y0, 0), min(x1, width), min(y1, height)
+                    if x0 < x1 and y0 < y1:
+                        changed[y0 // self.tile_size : (y1 - 1) // self.tile_size + 1, x0 // self.tile_size : (x1 - 1) // self.tile_size + 1] = True
+            else:
+                changed = reference != frame
+                if changed.ndim == 3:   # any channel
+                    changed = changed.any(axis=2)
+                
+                # changed tiles, reducing rows then columns of tile_size pixels
+                changed = numpy.logical_or.reduceat(changed, numpy.arange(0, height, self.tile_size), axis=0)
+                changed = numpy.logical_or.reduceat(changed, numpy.arange(0, width, self.tile_size), axis=1)
+
+            if not changed.any():
+                self.unchanged_frames += 1
+                return None, None
+            
+            if changed.mean() <= self.DELTA_MAX_RATIO:
+                boxes = [
+                    (x, y, min(x + self.tile_size, width), min(y + self.tile_size, height))
+                    for y, x in numpy.argwhere(changed) * self.tile_size
+                ]
+                tiles = await self.encoder.encodeAll([ image.crop(box) for box in boxes ], image_format, **params)
+
+                parts = [ self.DELTA_HEADER.pack(msg_type.encode(), self.tile_size, len(tiles)) ]
+                for box, tile in zip(boxes, tiles):
+                    parts.append(self.TILE_HEADER.pack(box[0], box[1], len(tile)))
+                    parts.append(tile)
+
+                self.__reference[msg_type] = (frame, deltas + 1)
+                self.delta_frames += 1
+
+                return b''.join(parts), OMT.DELTA_FRAME
+        
+        buf = await self.encoder.encode(image, image_format, **params)
+
+        self.__reference[msg_type] = (frame, 0)
+        self.keyframes += 1
+
+        return buf, msg_type
+
     async def sendDisplay(self, image_format='jpeg'):
-        """Send image display, encoding it with format
+        """Send image display, encoding it with format off the event loop (see submitImage())
 
         :param image_format: image format encoding, defaults to 'jpeg'. Refer to pillow image formats (https://pillow.readthedocs.io/en/stable/handbook/image-file-formats.html)
         :type image_format: str, optional
         """
-        f = io.BytesIO()    # temp I/O file object
-        self.image.save(f, image_format)
-        buf = f.getbuffer() # buffer from I/O file object
-
-        await self.omniaProtocol.send(buf, OMT.RGBA_IMAGE)
-
-        del buf     # delete buffer, so that temp I/O file object can be closed
-        f.close()   # close temp I/O file object
+        await self.submitImage(self.image.copy(), image_format, OMT.RGBA_IMAGE)   # copy, the image can be drawn while encoding
     
     async def startVideoStream(self):
         """Tells display to start a video stream
         """
+        self.__reference.pop(OMT.VIDEO_FRAME, None)   # the first frame is a keyframe
         await self.omniaProtocol.send([ 1 ], OMT.START_STOP_VIDEO_STREAM)
     
     async def stopVideoStream(self):
@@ -153,26 +427,37 @@ class OmniaDisplay:
         """
         await self.omniaProtocol.send([ 0 ], OMT.START_STOP_VIDEO_STREAM)
 
-    async def sendVideoFrame(self, frame=None, image_format='jpeg'):
-        """Send video frame to display, encoding it with format. If none frame is set, send 1-length buffer to display
+    async def sendVideoFrame(self, frame=None, image_format='jpeg', **params):
+        """Send video frame to display, encoding it with format (see submitImage()). If none frame is set, send 1-length buffer to display
+        NOTE: frame must not be modified after calling this method
 
         :param frame: image of type PIL.Image, defaults to None
         :type frame: PIL.Image, optional
         :param image_format: image format encoding, defaults to 'jpeg'. Refer to pillow image formats (https://pillow.readthedocs.io/en/stable/handbook/image-file-formats.html)
         :type image_format: str, optional
+        :param params: encoder parameters passed to PIL.Image.save() (e.g. quality=80)
         """
         if frame:
-            f = io.BytesIO()    # temp I/O file object
-            frame.save(f, image_format) # save image with format encoding
-            buf = f.getbuffer() # buffer from I/O file object
-
-            await self.omniaProtocol.send(buf, OMT.VIDEO_FRAME)
-
-            del buf     # delete buffer, so that temp I/O file object can be closed
-            f.close()   # close temp I/O file object
+            await self.submitImage(frame, image_format, OMT.VIDEO_FRAME, **params)
         else:
+            self.__reference.pop(OMT.VIDEO_FRAME, None)
             await self.omniaProtocol.send(b'0', OMT.VIDEO_FRAME)
 
+    async def sendEncodedVideoFrame(self, buf):
+        """Send video frame already encoded (e.g. read from OmniaVideoCacheFile), without encoding or copying it.
+        Video frames still being encoded by sendVideoFrame() are dropped once encoded, as this frame is newer
+
+        :param buf: encoded frame
+        :type buf: bytes-like object (bytes, memoryview, ...)
+        """
+        seq = self.__encode_seq.get(OMT.VIDEO_FRAME, 0) + 1
+        self.__encode_seq[OMT.VIDEO_FRAME] = seq
+        self.__sent_seq[OMT.VIDEO_FRAME] = seq
+        self.encode_time -= self.encode_time * self.ENCODE_TIME_WEIGHT    # nothing to encode
+        self.__reference.pop(OMT.VIDEO_FRAME, None)   # not compared, the next frame is a keyframe
+
+        await self.omniaProtocol.send(buf, OMT.VIDEO_FRAME)   # buffer is released by omniaProtocol once sent
+
 # ---------------------------------------------------- #
 
 class Omnia1BitDisplay(OmniaDisplay):
@@ -182,6 +467,17 @@ class Omnia1BitDisplay(OmniaDisplay):
     SH1106 = 0
     SSD1306 = 1
 
+    ### Partial images ###
+    PAGE_HEIGHT = 8     # SH1106 and SSD1306 write rows in pages of 8
+    PARTIAL_HEADER = struct.Struct('>BBBB')     # first page, number of pages, first byte column, number of byte columns
+    PARTIAL_MAX_RATIO = 0.75    # send the full image if the changed part is bigger than this ratio of it
+    ### --- ###
+
+    ### Packed image transforms ###
+    BIT_REVERSE = bytes(int('{:08b}'.format(b)[::-1], 2) for b in range(256))  # reverses bits of a byte
+    TRANSFORM_TABLES = {}   # TRANSFORM_TABLES[(rotation, contrast)] translates packed bytes, compiled below
+    ### --- ###
+
     def __init__(self, omniaProtocol, dimensions, configuration={}):
         """Initialization
 
@@ -213,6 +509,11 @@ class Omnia1BitDisplay(OmniaDisplay):
         self.scl = None
         ### --- ###
 
+        ### Sent image ###
+        self.sent_frame = None  # last packed image sent, used to send only the changed part of the next one
+        self.packed_cache = None    # ((packed image, rotation, contrast), transformed image)
+        ### --- ###
+
         ### Log ###
         self.log = logging.getLogger(
             '[{}]: Omnia1BitDisplay'.format(self.omniaProtocol.client_info["name"])
@@ -312,6 +613,12 @@ class Omnia1BitDisplay(OmniaDisplay):
 
             await self.setDisplay(tmp["sda"], tmp["scl"], tmp["display_type"])
 
+    def resetSentFrames(self):
+        """Forget the images sent to the client, the next one is sent entirely
+        """
+        super().resetSentFrames()
+        self.sent_frame = None
+
     async def setDisplay(self, sda, scl, display_type):
         """Set display type and I2C pins
 
@@ -328,6 +635,8 @@ class Omnia1BitDisplay(OmniaDisplay):
         self.scl = scl
         self.display_type = display_type
 
+        self.sent_frame = None  # display is initialized again, next image must be sent entirely
+
         await self.omniaProtocol.send([
                                 self.sda,
                                 self.scl,
@@ -350,28 +659,113 @@ class Omnia1BitDisplay(OmniaDisplay):
         await self.sendDisplay(True)
 
     async def sendDisplay(self, force_send=False):
-        """Sends image to display. Avoids sending it if it didn't changed. You can send it anyway by setting force_send flag to True
+        """Sends image to display. Avoids sending it if it didn't changed. You can send it anyway by setting force_send flag to True.
+        If the client supports partial images, only the changed part is sent (see __sendFrame()).
 
         :param force_send: True if you want to force send image, defaults to False
         :type force_send: bool, optional
         """
         
-        tmp_image = self.image  # tmp variable used in this method
-        
-        if "rotation" in self.configuration and self.configuration["rotation"]:  # if rotation is set
-            tmp_image = self.image.rotate(180)
-
-        if "contrast" in self.configuration and self.configuration["contrast"]:  # if contrast is set
-            tmp_image = ImageOps.colorize(tmp_image, (255,255,255), (0,0,0))
-        
         if self.img_is_new or force_send:
             self.img_is_new = False
-            tmp_image = tmp_image.convert('1')  # 1-bit pixels, black and white, stored with one pixel per byte
-            tmp_image = tmp_image.tobytes() # serialize image
 
             #self.log.debug("sending image")
             
-            await self.omniaProtocol.send(tmp_image, OMT.ONE_BIT_IMAGE)
+            await self.__sendFrame(self.__packImage(), force_send)
+
+    def __packImage(self):
+        """Pack image in 1-bit pixels (8 per byte), applying rotation and contrast of the configuration.
+        The image is packed first, then rotation and contrast are applied to the packed bytes:
+            a. rotation: reverse bytes (rows and bytes in each row) and bits in each byte
+            b. contrast: invert bits
+        with a single translation table from TRANSFORM_TABLES.
+        The result is cached, so the same image with the same configuration is not transformed again.
+        If the width is not a multiple of 8 (rows are padded), rotation and contrast are applied by PIL before packing.
+
+        :return: packed image, each row padded to a whole byte
+        :rtype: bytes
+        """
+        rotation = bool(self.configuration.get("rotation", False))
+        contrast = bool(self.configuration.get("contrast", False))
+
+        if self.width % 8:  # padding bits would be moved by rotation and set by contrast
+            tmp_image = self.image.rotate(180) if rotation else self.image
+
+            if contrast:
+                tmp_image = ImageOps.colorize(tmp_image, (255,255,255), (0,0,0))
+            
+            return tmp_image.convert('1').tobytes()
+        
+        packed = self.image.convert('1').tobytes()  # 1-bit pixels, black and white, packed 8 per byte
+        key = (packed, rotation, contrast)
+
+        if self.packed_cache and self.packed_cache[0] == key:
+            return self.packed_cache[1]
+        
+        frame = packed[::-1] if rotation else packed
+        table = self.TRANSFORM_TABLES[(rotation, contrast)]
+
+        if table:
+            frame = frame.translate(table)
+        
+        self.packed_cache = (key, frame)
+
+        return frame
+
+    async def __sendFrame(self, frame, force_send=False):
+        """Send packed image. If the client supports partial images (OmniaProtocol.FEATURE_PARTIAL_IMAGE),
+        send only the pages and byte columns that changed since the last image, as a PARTIAL_ONE_BIT_IMAGE message:
+            "<first page><number of pages><first byte column><number of byte columns><changed rows>"
+        where each row of the changed pages has (number of byte columns) bytes (the last page has fewer rows if height isn't a multiple of PAGE_HEIGHT).
+        Nothing is sent if the image didn't change.
+        The full image is sent if force_send is True, if the client doesn't have the last image (first image, resume, new display)
+        or if the changed part is bigger than PARTIAL_MAX_RATIO of the image.
+
+        :param frame: image packed by PIL, 8 pixels per byte, each row padded to a whole byte
+        :type frame: bytes
+        :param force_send: True if you want to send the full image, defaults to False
+        :type force_send: bool, optional
+        """
+        self.checkSession()
+
+        new_frame = numpy.frombuffer(frame, numpy.uint8).reshape(self.height, -1)    # rows of (width + 7) // 8 bytes
+        old_frame = self.sent_frame
+        self.sent_frame = new_frame
+
+        if (force_send or old_frame is None or old_frame.shape != new_frame.shape
+                or not self.omniaProtocol.hasFeature(self.omniaProtocol.FEATURE_PARTIAL_IMAGE)):
+            await self.omniaProtocol.send(frame, OMT.ONE_BIT_IMAGE)
+            return
+
+        changed = old_frame != new_frame
+        changed_rows = numpy.flatnonzero(changed.any(axis=1))
+
+        if len(changed_rows) == 0:  # nothing changed
+            return
+        
+        changed_cols = numpy.flatnonzero(changed.any(axis=0))
+
+        first_page = changed_rows[0] // self.PAGE_HEIGHT
+        last_page = changed_rows[-1] // self.PAGE_HEIGHT
+        first_col = changed_cols[0]
+        last_col = changed_cols[-1]
+
+        part = new_frame[first_page * self.PAGE_HEIGHT : (last_page + 1) * self.PAGE_HEIGHT, first_col : last_col + 1]
+
+        if part.size > len(frame) * self.PARTIAL_MAX_RATIO:
+            await self.omniaProtocol.send(frame, OMT.ONE_BIT_IMAGE)
+            return
+        
+        header = self.PARTIAL_HEADER.pack(first_page, last_page - first_page + 1, first_col, last_col - first_col + 1)
+
+        await self.omniaProtocol.send(header + part.tobytes(), OMT.PARTIAL_ONE_BIT_IMAGE)
+
+for _rotation in (False, True):
+    for _contrast in (False, True):
+        Omnia1BitDisplay.TRANSFORM_TABLES[(_rotation, _contrast)] = bytes(
+            (Omnia1BitDisplay.BIT_REVERSE[b] if _rotation else b) ^ (0xFF if _contrast else 0) for b in range(256)
+        ) if _rotation or _contrast else None
+del _rotation, _contrast
 
 # ---------------------------------------------------- #
 
@@ -446,9 +840,9 @@ class OmniaTouchscreen:
         """Processes coordinates received from protocol
 
         :param raw_coordinates: received in this format: "x,y"
-        :type raw_coordinates: str
+        :type raw_coordinates: memoryview
         """
-        raw_coordinates = raw_coordinates.decode()
+        raw_coordinates = bytes(raw_coordinates).decode()
         s_x = ''
         s_y = ''
         
@@ -499,6 +893,12 @@ class OmniaILI9341Display(OmniaDisplay, OmniaTouchscreen):
         OmniaDisplay.__init__(self, omniaProtocol, dimensions, image_mode=image_mode)
 
         OmniaTouchscreen.__init__(self, omniaProtocol, self.width, self.height)
+
+        ### Frame generations ###
+        self.sent_generation = None     # generation of the last image sent, see sendDisplay()
+        self.rendered_frames = 0        # images encoded and sent
+        self.suppressed_frames = 0      # images not sent, because their generation was already sent
+        ### --- ###
         
         ### Log ###
         self.log = logging.getLogger(
@@ -506,19 +906,33 @@ class OmniaILI9341Display(OmniaDisplay, OmniaTouchscreen):
         )
         ### --- ###
 
-    async def sendDisplay(self, image_format='jpeg'):
-        """Send image display, encoding it with format
+    def resetSentFrames(self):
+        """Forget the images sent to the client, the next one is sent even if its generation was already sent
+        """
+        super().resetSentFrames()
+        self.sent_generation = None
+
+    async def sendDisplay(self, image_format='jpeg', generation=None, damage=None):
+        """Send image display, encoding it with format off the event loop (see submitImage()).
+        If generation is set (e.g. OmniaUI.getGeneration()) and it's the one of the last image sent, nothing is encoded nor sent.
 
         :param image_format: image format encoding, defaults to 'jpeg'. Refer to pillow image formats (https://pillow.readthedocs.io/en/stable/handbook/image-file-formats.html)
         :type image_format: str, optional
+        :param generation: generation of the image, increased by its source every time it changes, defaults to None (always send)
+        :type generation: int, optional
+        :param damage: rectangles changed since the last image sent (e.g. OmniaUI.getDamage()), only they are sent in delta mode, defaults to None (unknown)
+        :type damage: list, optional
         """
-        f = io.BytesIO()    # temp I/O file object
-        image = self.image.convert("RGB")   # convert image to RGB for ILI9341 display
-        image.save(f, image_format)
-        buf = f.getbuffer() # buffer from I/O file object
+        self.checkSession()     # after a resume the last generation is not on the display anymore
+
+        if generation is not None and generation == self.sent_generation:
+            self.suppressed_frames += 1
+            return
+        
+        self.sent_generation = generation
+        self.rendered_frames += 1
 
-        await self.omniaProtocol.send(buf, OMT.RGBA_IMAGE)
+        image = self.image.convert("RGB")   # convert image to RGB for ILI9341 display (a new image, safe to encode while drawing)
 
-        del buf     # delete buffer, so that temp I/O file object can be closed
-        f.close()   # close temp I/O file object
+        await self.submitImage(image, image_format, OMT.RGBA_IMAGE, damage)
 
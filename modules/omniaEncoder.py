@@ -0,0 +1,188 @@
+import io
+import logging
+import time
+import curio
+
+"""Image encoding off the event loop, shared by displays
+"""
+
+def encodeImage(image, image_format, params, copy=False):
+    """Encode image, runs in a worker thread or process
+
+    :param image: image to be encoded
+    :type image: PIL.Image
+    :param image_format: image format encoding. Refer to pillow image formats (https://pillow.readthedocs.io/en/stable/handbook/image-file-formats.html)
+    :type image_format: str
+    :param params: encoder parameters passed to PIL.Image.save() (e.g. {"quality": 80})
+    :type params: dict
+    :param copy: True to return a copy of the encoded image, needed if it's sent back from another process, defaults to False
+    :type copy: bool, optional
+    :return: encoded image
+    :rtype: bytes or memoryview
+    """
+    f = io.BytesIO()    # temp I/O file object
+    image.save(f, image_format, **params)
+
+    if copy:
+        return f.getvalue()
+
+    return f.getbuffer()    # buffer from I/O file object, no copy
+
+def encodeImages(images, image_format, params, copy=False):
+    """Encode several images with the same format and parameters, runs in a worker thread or process
+
+    :param images: images to be encoded
+    :type images: list of PIL.Image
+    :param image_format: image format encoding, see encodeImage()
+    :type image_format: str
+    :param params: encoder parameters passed to PIL.Image.save()
+    :type params: dict
+    :param copy: True to return copies of the encoded images, see encodeImage(), defaults to False
+    :type copy: bool, optional
+    :return: encoded images, in the same order
+    :rtype: list of bytes or memoryview
+    """
+    return [ encodeImage(image, image_format, params, copy) for image in images ]
+
+class OmniaEncoder:
+    """Encodes images in curio's worker threads or processes, so that the event loop (and other clients' I/O) is not blocked.
+    At most `workers` images are encoded at the same time, the others wait for a free worker.
+    """
+
+    ### Modes ###
+    INLINE = "inline"   # encode in the event loop, for small images
+    THREAD = "thread"   # curio.run_in_thread(), PIL releases the GIL while encoding
+    PROCESS = "process" # curio.run_in_process(), images are pickled to the worker
+    ### --- ###
+
+    DEFAULT_WORKERS = 2
+
+    __default = None    # encoder shared by all displays
+
+    def __init__(self, mode=THREAD, workers=DEFAULT_WORKERS):
+        """Initialization
+
+        :param mode: INLINE, THREAD or PROCESS, defaults to THREAD
+        :type mode: str, optional
+        :param workers: maximum number of images encoded at the same time, defaults to DEFAULT_WORKERS
+        :type workers: int, optional
+        """
+
+        ### Workers ###
+        self.mode = mode
+        self.workers = workers
+        self.__semaphore = curio.Semaphore(workers)
+        ### --- ###
+
+        ### Statistics ###
+        self.encoded = 0    # images encoded
+        self.encode_time = 0.0  # total seconds spent encoding, waiting for a free worker excluded
+        ### --- ###
+
+        ### Log ###
+        self.log = logging.getLogger('OmniaEncoder')
+        ### --- ###
+
+    @classmethod
+    def getDefault(cls):
+        """Get the encoder shared by all displays, created with default parameters if not set by setDefault()
+
+        :return: default encoder
+        :rtype: OmniaEncoder
+        """
+        if cls.__default is None:
+            cls.__default = cls()
+
+        return cls.__default
+
+    @classmethod
+    def setDefault(cls, encoder):
+        """Set the encoder shared by all displays created from now on
+
+        :param encoder: default encoder
+        :type encoder: OmniaEncoder
+        """
+        cls.__default = encoder
+
+    async def encode(self, image, image_format='jpeg', **params):
+        """Encode image in a worker
+
+        NOTE: image must not be modified until encoded
+
+        :param image: image to be encoded
+        :type image: PIL.Image
+        :param image_format: image format encoding, defaults to 'jpeg'. Refer to pillow image formats (https://pillow.readthedocs.io/en/stable/handbook/image-file-formats.html)
+        :type image_format: str, optional
+        :param params: encoder parameters passed to PIL.Image.save() (e.g. quality=80)
+        :return: encoded image
+        :rtype: bytes or memoryview
+        """
+        if self.mode == self.INLINE:
+            return self.__updateStats(time.perf_counter(), encodeImage(image, image_format, params))
+
+        async with self.__semaphore:
+            start = time.perf_counter()
+
+            if self.mode == self.PROCESS:
+                encoded = await curio.run_in_process(encodeImage, image, image_format, params, True)
+            else:
+                encoded = await curio.run_in_thread(encodeImage, image, image_format, params)
+
+            return self.__updateStats(start, encoded)
+
+    async def encodeAll(self, images, image_format='jpeg', **params):
+        """Encode several small images (e.g. tiles of a frame) in a single call to a worker
+
+        NOTE: images must not be modified until encoded
+
+        :param images: images to be encoded
+        :type images: list of PIL.Image
+        :param image_format: image format encoding, defaults to 'jpeg'. Refer to pillow image formats (https://pillow.readthedocs.io/en/stable/handbook/image-file-formats.html)
+        :type image_format: str, optional
+        :param params: encoder parameters passed to PIL.Image.save() (e.g. quality=80)
+        :return: encoded images, in the same order
+        :rtype: list of bytes or memoryview
+        """
+        if self.mode == self.INLINE:
+            return self.__updateStats(time.perf_counter(), encodeImages(images, image_format, params), len(images))
+
+        async with self.__semaphore:
+            start = time.perf_counter()
+
+            if self.mode == self.PROCESS:
+                encoded = await curio.run_in_process(encodeImages, images, image_format, params, True)
+            else:
+                encoded = await curio.run_in_thread(encodeImages, images, image_format, params)
+
+            return self.__updateStats(start, encoded, len(images))
+
+    def __updateStats(self, start, encoded, count=1):
+        """Add encoding duration to statistics
+
+        :param start: time.perf_counter() when encoding started
+        :type start: float
+        :param encoded: encoded image (or images)
+        :type encoded: bytes or memoryview (or list)
+        :param count: number of images encoded, defaults to 1
+        :type count: int, optional
+        :return: encoded image (or images)
+        :rtype: bytes or memoryview (or list)
+        """
+        self.encoded += count
+        self.encode_time += time.perf_counter() - start
+
+        return encoded
+
+    def getStats(self):
+        """Get encoding statistics
+
+        :return: {
+                    "encoded": <images encoded>,
+                    "avg_time": <average seconds to encode an image>
+                }
+        :rtype: dict
+        """
+        return {
+            "encoded": self.encoded,
+            "avg_time": self.encode_time / self.encoded if self.encoded else 0.0,
+        }
@@ -0,0 +1,160 @@
+from PIL import Image, ImageDraw, ImageFont
+from collections import OrderedDict
+import threading
+
+"""Process-wide cache of fonts, text sizes and rendered text
+"""
+
+class OmniaFonts:
+    """Fonts shared by every UI, display and device of the process.
+
+    Loading a TrueType font reads and parses the font file, and measuring or drawing text rasterizes its glyphs with FreeType:
+    fonts are loaded once per (font name, size), text sizes are measured once per (font, text), and text is rendered once
+    per (font, text) as a coverage mask, pasted with the text color by drawText().
+    All the caches are LRU, bounded by number of entries.
+    """
+
+    FONT_CACHE_SIZE = 32    # maximum number of loaded fonts
+    SIZE_CACHE_SIZE = 1024  # maximum number of measured texts
+    TEXT_CACHE_SIZE = 256   # maximum number of rendered texts
+
+    __lock = threading.Lock()   # fonts are used by worker threads too
+
+    __fonts = OrderedDict()     # {(font_name, font_size): ImageFont.FreeTypeFont}
+    __sizes = OrderedDict()     # {(font, text): (width, height)}
+    __texts = OrderedDict()     # {(font, text): (mask, (x, y) offset of the mask)}
+
+    # {cache name: {"hits": int, "misses": int}}
+    __stats = { name: {"hits": 0, "misses": 0} for name in ("fonts", "sizes", "texts") }
+
+    @classmethod
+    def getFont(cls, font_name, font_size):
+        """Get a TrueType font, loaded once
+
+        :param font_name: path of the font file
+        :type font_name: str
+        :param font_size: size of the font (in points)
+        :type font_size: int
+        :return: font, shared: it must not be modified
+        :rtype: ImageFont.FreeTypeFont
+        """
+        return cls.__lookup(cls.__fonts, "fonts", cls.FONT_CACHE_SIZE, (font_name, font_size),
+                            lambda: ImageFont.truetype(font_name, font_size))
+
+    @classmethod
+    def getTextSize(cls, font, text):
+        """Get the size of a text, measured once per font
+
+        :param font: font of the text
+        :type font: ImageFont.FreeTypeFont
+        :param text: text to be measured
+        :type text: str
+        :return: (width, height), see ImageFont.FreeTypeFont.getsize()
+        :rtype: tuple
+        """
+        return cls.__lookup(cls.__sizes, "sizes", cls.SIZE_CACHE_SIZE, (font, text), lambda: font.getsize(text))
+
+    @classmethod
+    def drawText(cls, image, xy, text, fill, font):
+        """Draw text on image like ImageDraw.text(), rendering it once per font
+
+        :param image: image to draw on
+        :type image: PIL.Image
+        :param xy: top-left corner of the text
+        :type xy: tuple of int
+        :param text: text to be drawn
+        :type text: str
+        :param fill: color of the text
+        :type fill: tuple or str
+        :param font: font of the text
+        :type font: ImageFont.FreeTypeFont
+        """
+        if "\n" in text or not isinstance(font, ImageFont.FreeTypeFont):
+            ImageDraw.Draw(image).text(xy, text, fill=fill, font=font)  # multiline text is laid out by ImageDraw
+            return
+
+        mask, offset = cls.__lookup(cls.__texts, "texts", cls.TEXT_CACHE_SIZE, (font, text), lambda: cls.__renderText(font, text))
+
+        if mask:
+            image.paste(fill, (xy[0] + offset[0], xy[1] + offset[1]), mask)
+
+    @staticmethod
+    def __renderText(font, text):
+        """Render text as a coverage mask
+
+        :param font: font of the text
+        :type font: ImageFont.FreeTypeFont
+        :param text: text to be rendered
+        :type text: str
+        :return: (mask, offset): "L" image of the text (None if nothing is drawn), (x, y) of its top-left corner relative to the text position
+        :rtype: tuple
+        """
+        # drawn with a margin for glyphs overflowing their box (e.g. negative bearings), then cropped to the drawn pixels
+        margin = font.size
+        width, height = font.getsize(text)
+
+        mask = Image.new("L", (width + 2 * margin, height + 2 * margin))
+        ImageDraw.Draw(mask).text((margin, margin), text, fill=255, font=font)
+
+        box = mask.getbbox()
+
+        if box is None:     # nothing drawn (e.g. spaces)
+            return (None, (0, 0))
+
+        return (mask.crop(box), (box[0] - margin, box[1] - margin))
+
+    @classmethod
+    def __lookup(cls, cache, name, max_size, key, load):
+        """Get a value from an LRU cache, loading it on a miss
+
+        :param cache: cache
+        :type cache: OrderedDict
+        :param name: name of the cache in the statistics
+        :type name: str
+        :param max_size: maximum number of entries of the cache
+        :type max_size: int
+        :param key: key of the value
+        :type key: hashable
+        :param load: called without arguments to load a missing value
+        :type load: callable
+        :return: value
+        """
+        with cls.__lock:
+            if key in cache:
+                cache.move_to_end(key)
+                cls.__stats[name]["hits"] += 1
+                return cache[key]
+
+            cls.__stats[name]["misses"] += 1
+
+        value = load()  # exceptions (e.g. missing font file) are raised to the caller, nothing is cached
+
+        with cls.__lock:
+            cache[key] = value
+            cache.move_to_end(key)
+
+            while len(cache) > max_size:
+                cache.popitem(last=False)
+
+        return value
+
+    @classmethod
+    def clear(cls):
+        """Empty the caches, fonts already in use stay valid
+        """
+        with cls.__lock:
+            cls.__fonts.clear()
+            cls.__sizes.clear()
+            cls.__texts.clear()
+
+    @classmethod
+    def getStats(cls):
+        """Get cache statistics
+
+        :return: {<"fonts", "sizes" or "texts">: {"hits": <cache hits>, "misses": <cache misses>, "entries": <cached values>}}
+        :rtype: dict
+        """
+        caches = {"fonts": cls.__fonts, "sizes": cls.__sizes, "texts": cls.__texts}
+
+        with cls.__lock:
+            return { name: dict(cls.__stats[name], entries=len(cache)) for name, cache in caches.items() }
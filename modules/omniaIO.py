@@ -262,9 +262,9 @@ class OmniaPins:
 
         :param data: sum of all the values corresponding to each HIGH pin,
                      each value is calculated as 1 << (pin number)
-        :type data: bytes
+        :type data: memoryview
         """
-        data = int(data)
+        data = int(bytes(data))
 
         high_pin = None
 
@@ -331,8 +331,8 @@ class OmniaADC:
         
         self.omniaProtocol.restoreReceiveCallback(OMT.READ_ADC)
     
-    def __received(self, data):
-        data = int(data)
+    async def __received(self, data):
+        data = int(bytes(data))
         self.__callback(data)   # user's callback
 
 # ---------------------------------------------------- #
@@ -382,7 +382,7 @@ class OmniaI2C:
         :type i2c_address: int
         :param read_length: how much data you want to read (in bytes)
         :type read_length: int
-        :param callback: callback function, called when I2C value is received
+        :param callback: callback coroutine function, awaited with the received I2C data (memoryview)
         :type callback: function object
         """
 
@@ -1,12 +1,35 @@
 from PIL import Image, ImageDraw, ImageFont
 import logging
 import time
+import os
 import xml.etree.ElementTree as ET
+from types import MappingProxyType
 from ast import literal_eval as make_tuple
 
+### Omnia libraries ###
+from modules.omniaFonts         import OmniaFonts
+from modules.omniaAssets        import OmniaAssets
+### --- ###
+
 class OmniaUI:
+    """Retained-mode UI of buttons, labels and lines, drawn on a PIL image.
+
+    refresh_image() repaints only what changed since the last refresh: every element is compared with the state
+    (signature and bounding box) it was last drawn with, the old and new boxes of the changed ones are merged into
+    damaged rectangles, and only those are repainted from the background. Damaged rectangles are collected until getDamage().
+
+    Elements are composited in two layers: the static layer (background, images and lines, see OmniaUIElement.setStatic())
+    is cached and repainted only where a static element changed, and a damaged rectangle is copied from it, then only the
+    dynamic elements (e.g. labels with changing text) are drawn on top. A rectangle where a static element is drawn above
+    a dynamic one is repainted from the background, so the result is always the same as drawing every element in order.
 
-    default_font = ImageFont.truetype("fonts/Arial.ttf", 20)
+    Visible buttons are indexed in a grid of HIT_CELL_SIZE cells, updated when a button moves, resizes, or is shown or hidden:
+    a click only checks the buttons in its cell, and the topmost one (the last drawn) wins.
+    """
+
+    default_font = OmniaFonts.getFont("fonts/Arial.ttf", 20)
+
+    HIT_CELL_SIZE = 32  # side of the cells of the hit-test grid (in pixels)
 
     def __init__(self, display_dimensions, click_callback=None, click_bias=0, background_color=(255,255,255), background_image=None, font=None, debug=False):
 
@@ -23,6 +46,16 @@ class OmniaUI:
         # Image utilities
         self.image = Image.new("RGBA", (self.width, self.height), background_color)
         self.draw = ImageDraw.Draw(self.image)
+        self.generation = 0     # increased every time the image changes, see getGeneration()
+
+        # Damage
+        self.damage = []            # rectangles (x0, y0, x1, y1) changed since the last getDamage()
+        self._drawn = {}            # {(element type, element id): (bounding box, signature)} of the elements drawn by refresh_image()
+        self._full_refresh = True   # True if the next refresh_image() must repaint the whole image
+
+        # Static layer
+        self._static_image = None   # background and static elements, composited
+        self._static_drawn = {}     # {(element type, element id): (bounding box, signature)} of the static elements in _static_image
         
         self.orientation = "landscape"
 
@@ -44,6 +77,12 @@ class OmniaUI:
         self.buttons = {}
         self.labels = {}
         self.lines = {}
+
+        # Hit-test index
+        self._hit_grid = {}     # {(column, row): {button_id: z-order}} of the visible buttons overlapping each cell
+        self._hit_cells = {}    # {button_id: cells of the button}
+        self._hit_z = {}        # {button_id: z-order}, buttons added later are drawn on top
+        self._next_z = 0
         
         # Debug
         self.debug = debug
@@ -52,7 +91,7 @@ class OmniaUI:
 
         # XML
         #self.tree = None
-        self.root = None
+        self.template = None    # OmniaUITemplate loaded last
 
         ### Logging ###
         logging.getLogger("PIL").setLevel(logging.WARNING)
@@ -75,35 +114,102 @@ class OmniaUI:
                 self.debug_point = [(x-r, y-r), (x+r, y+r)]
                 #self._draw_debug_point()
             
-            for button_id in self.buttons:
-                button = self.buttons[button_id]
+            button = self.hitTest(coordinates)
 
-                if button.isClicked(coordinates, self.bias):
-                    self.log.debug("Element '{}' clicked".format(button.id))
-                    
-                    if self.click_callback:
-                        self.click_callback(button)
-                        break
-                    else:
-                        return button
+            if button:
+                self.log.debug("Element '{}' clicked".format(button.id))
+                
+                if self.click_callback:
+                    self.click_callback(button)
+                else:
+                    return button
         else:
             #raise ValueError("Click coordinates '{}' outside image".format((x,y)))
             self.log.error("Click coordinates '{}' outside image".format((x,y)))
     
+    def hitTest(self, coordinates):
+        """Returns the topmost visible and clickable button at coordinates (the click bias included)
+
+        :param coordinates: (x, y)
+        :type coordinates: tuple
+        :return: button, None if there's none
+        :rtype: OmniaUIElement
+        """
+        x = coordinates[0]
+        y = coordinates[1]
+
+        cell = self._hit_grid.get((int(x) // self.HIT_CELL_SIZE, int(y) // self.HIT_CELL_SIZE))
+
+        if cell:
+            for button_id in sorted(cell, key=cell.get, reverse=True):  # topmost first
+                button = self.buttons[button_id]
+
+                if button.isClicked(coordinates, self.bias):
+                    return button
+        
+        return None
+
+    def _index_button(self, button):
+        # (re)index the cells overlapped by a button, with the click bias
+        self._unindex_button(button.id)
+
+        if button.id not in self._hit_z:
+            self._hit_z[button.id] = self._next_z
+            self._next_z += 1
+
+        if not button.visible:
+            return
+
+        first_col = max(0, int(button.x0 - self.bias)) // self.HIT_CELL_SIZE
+        last_col = min(self.width, int(button.x1 + self.bias)) // self.HIT_CELL_SIZE
+        first_row = max(0, int(button.y0 - self.bias)) // self.HIT_CELL_SIZE
+        last_row = min(self.height, int(button.y1 + self.bias)) // self.HIT_CELL_SIZE
+
+        cells = [ (col, row) for col in range(first_col, last_col + 1) for row in range(first_row, last_row + 1) ]
+        for cell in cells:
+            self._hit_grid.setdefault(cell, {})[button.id] = self._hit_z[button.id]
+        
+        self._hit_cells[button.id] = cells
+
+    def _unindex_button(self, button_id):
+        for cell in self._hit_cells.pop(button_id, []):
+            del self._hit_grid[cell][button_id]
+
+            if not self._hit_grid[cell]:
+                del self._hit_grid[cell]
+
+    def _element_changed(self, element):
+        # called by elements of this UI when their box or visibility changes
+        if element.type == "button" and self.buttons.get(element.id) is element:
+            self._index_button(element)
+
     ### ELEMENTS ###
 
-    def _draw_element(self, element):
+    def _draw_element(self, element, image=None, offset=(0, 0)):
+        # draw on image (a region of the UI image, whose top-left corner is at offset), defaults to the UI image
         if element.visible:
+            if image is None:
+                image = self.image
+                draw = self.draw
+
+                self.generation += 1
+                self._add_damage(element.getBoundingBox())
+            else:
+                draw = ImageDraw.Draw(image)
+            
+            dx = -offset[0]
+            dy = -offset[1]
+
             if element.type == "line":
-                self.draw.line(element.getXY(), fill=element.color, width=element.width)
+                draw.line([ (x + dx, y + dy) for x, y in element.getXY() ], fill=element.color, width=element.width)
             else:
                 if element.image:
-                    self.image.paste(element.image, element.box[0], mask=element.image)
+                    image.paste(element.image, (element.x0 + dx, element.y0 + dy), mask=element.image)
                 else:
                     if element.outline_color:
-                        self.draw.rectangle(element.box, fill=element.background_color, outline=element.outline_color)
+                        draw.rectangle([ (element.x0 + dx, element.y0 + dy), (element.x1 + dx, element.y1 + dy) ], fill=element.background_color, outline=element.outline_color)
 
-                    self.draw.text(( element.x0 + element.padding, element.y0 + element.padding ), element.text, fill=element.text_color, font=element.font)
+                    OmniaFonts.drawText(image, ( element.x0 + element.padding + dx, element.y0 + element.padding + dy ), element.text, element.text_color, element.font)
 
     def addElement(self, element):
         element_id = element.id
@@ -114,6 +220,8 @@ class OmniaUI:
             if not element_id in self.buttons:
                 # register button
                 self.buttons[element_id] = element
+                element._ui = self
+                self._index_button(element)
 
                 # draw button
                 self._draw_element(element)
@@ -150,7 +258,9 @@ class OmniaUI:
 
     def removeElement(self, element_id):
         if element_id in self.buttons:
-            self.buttons.pop(element_id)
+            self.buttons.pop(element_id)._ui = None
+            self._unindex_button(element_id)
+            self._hit_z.pop(element_id)
             self.refresh_image()
         elif element_id in self.labels:
             self.labels.pop(element_id)
@@ -179,6 +289,8 @@ class OmniaUI:
             if element_id in self.buttons:
                 # register button
                 self.buttons[element_id] = element
+                element._ui = self
+                self._index_button(element)
 
                 # draw button
                 self._draw_element(element)
@@ -220,27 +332,163 @@ class OmniaUI:
     ### IMAGE ###
 
     def refresh_image(self):
-        self.clear_image()
-        for button_id in self.buttons:
-            self._draw_element(self.buttons[button_id])
+        """Repaint the elements that changed since the last refresh (all of them after clear_image() or a background change)
+
+        :return: damaged rectangles (x0, y0, x1, y1), repainted from the background
+        :rtype: list
+        """
+        elements = [ (("button", button_id), self.buttons[button_id]) for button_id in self.buttons ]
+        elements += [ (("label", label_id), self.labels[label_id]) for label_id in self.labels ]
+        elements += [ (("line", line_id), self.lines[line_id]) for line_id in self.lines ]
+
+        # state of every element: (bounding box, or None if hidden, signature)
+        drawn = {}
+        for key, element in elements:
+            drawn[key] = (element.getBoundingBox() if element.visible else None, element.getSignature())
         
-        for label_id in self.labels:
-            self._draw_element(self.labels[label_id])
+        debug_box = None
+        if self.debug and self.debug_point:
+            (x0, y0), (x1, y1) = self.debug_point
+            debug_box = (x0, y0, x1 + 1, y1 + 1)
+            drawn[("debug", None)] = (debug_box, debug_box)
+
+        static_keys = { key for key, element in elements if element.isStatic() }
+        self._refresh_static_layer(elements, drawn, static_keys)
+
+        if self._full_refresh:
+            damage = [ (0, 0, self.width, self.height) ]
+        else:
+            damage = self._diff_drawn(self._drawn, drawn)
+
+        for box in damage:
+            # elements in the rectangle, in drawing order
+            box_elements = [ (key, element) for key, element in elements if self._intersects(drawn[key][0], box) ]
+            dynamic = [ i for i, (key, _) in enumerate(box_elements) if key not in static_keys ]
+
+            if dynamic and any( key in static_keys for key, _ in box_elements[dynamic[0]:] ):
+                # a static element is drawn above a dynamic one: repaint the rectangle on a copy of its background
+                region = self._get_background(box)
+            else:
+                # copy the rectangle from the static layer, then draw the dynamic elements
+                region = self._static_image.crop(box)
+                box_elements = [ box_elements[i] for i in dynamic ]
+
+            for key, element in box_elements:
+                self._draw_element(element, region, box[:2])
+
+            if self._intersects(debug_box, box):
+                ImageDraw.Draw(region).ellipse([ (debug_box[0] - box[0], debug_box[1] - box[1]), (debug_box[2] - 1 - box[0], debug_box[3] - 1 - box[1]) ], fill=(255,0,0))
+            
+            self.image.paste(region, box[:2])
         
-        for line_id in self.lines:
-            self._draw_element(self.lines[line_id])
+        self._drawn = drawn
+        self._full_refresh = False
+
+        if damage:
+            self.generation += 1
+            self.damage += damage
+
+        return damage
+    
+    def _refresh_static_layer(self, elements, drawn, static_keys):
+        # repaint the static layer where static elements changed (all of it after a background change)
+        static_drawn = { key: drawn[key] for key in static_keys }
+
+        if self._full_refresh or self._static_image is None or self._static_image.size != (self.width, self.height):
+            self._static_image = Image.new("RGBA", (self.width, self.height))
+            static_damage = [ (0, 0, self.width, self.height) ]
+        elif static_drawn == self._static_drawn:
+            static_damage = []  # most refreshes only change dynamic elements
+        else:
+            static_damage = self._diff_drawn(self._static_drawn, static_drawn)
+
+        for box in static_damage:
+            region = self._get_background(box)
+
+            for key, element in elements:
+                if key in static_keys and self._intersects(drawn[key][0], box):
+                    self._draw_element(element, region, box[:2])
+
+            self._static_image.paste(region, box[:2])
         
-        if self.debug:
-            if self.debug_point:
-                self._draw_debug_point()
+        self._static_drawn = static_drawn
+
+    def _diff_drawn(self, old_drawn, drawn):
+        # rectangles of the elements that changed between two states {key: (bounding box, signature)}, merged
+        damage = []
+        for key, (box, signature) in drawn.items():
+            old_box, old_signature = old_drawn.get(key, (None, None))
+
+            if signature != old_signature or box != old_box:
+                damage += [ b for b in (old_box, box) if b ]
+        
+        damage += [ old_box for key, (old_box, _) in old_drawn.items() if key not in drawn and old_box ]   # removed elements
+
+        return self._merge_boxes(damage)
+
+    def _get_background(self, box):
+        # copy of the background in box
+        if self.background_image:
+            return self.background_image.crop(box)
+        
+        return Image.new("RGBA", (box[2] - box[0], box[3] - box[1]), self.background_color)
+
+    def _merge_boxes(self, boxes):
+        # clip boxes to the image, then merge overlapping or adjacent ones until none overlap
+        merged = []
+        for x0, y0, x1, y1 in boxes:
+            box = (max(x0, 0), max(y0, 0), min(x1, self.width), min(y1, self.height))
+
+            if box[0] >= box[2] or box[1] >= box[3]:
+                continue
+
+            i = 0
+            while i < len(merged):
+                other = merged[i]
+
+                if box[0] <= other[2] and other[0] <= box[2] and box[1] <= other[3] and other[1] <= box[3]:
+                    box = (min(box[0], other[0]), min(box[1], other[1]), max(box[2], other[2]), max(box[3], other[3]))
+                    merged.pop(i)
+                    i = 0   # the bigger box can overlap boxes already checked
+                else:
+                    i += 1
+            
+            merged.append(box)
+        
+        return merged
+    
+    def _intersects(self, box, other):
+        return box is not None and box[0] < other[2] and other[0] < box[2] and box[1] < other[3] and other[1] < box[3]
+
+    def _add_damage(self, box):
+        self.damage.append(box)
+    
+    def getDamage(self):
+        """Returns the rectangles of the image changed since the last call (e.g. to send only them to the display)
+
+        :return: damaged rectangles (x0, y0, x1, y1), they can overlap
+        :rtype: list
+        """
+        damage = self.damage
+        self.damage = []
+
+        return damage
 
     def show_image(self):
         self.image.show()
     
     def clear_image(self, box=None):
+        self.generation += 1
+
         if not box:
             box = [0,0,self.width,self.height]
             #print(box)
+
+            # elements are drawn again by the next refresh
+            self._drawn = {}
+            self._full_refresh = True
+        
+        self._add_damage(tuple(box))
         
         if self.background_image:
             self.image.paste(self.background_image, box)
@@ -248,15 +496,32 @@ class OmniaUI:
             self.image.paste(self.background_color, box)
     
     def reset_image(self):
+        for button in self.buttons.values():
+            button._ui = None
+        
+        self._hit_grid = {}
+        self._hit_cells = {}
+        self._hit_z = {}
+
         self.buttons = {}
         self.labels = {}
         self.lines = {}
         self.background_image = None
         self.background_color = (255,255,255)
+        self._full_refresh = True   # background changed
 
     def get_image(self):
         return self.image.copy()
     
+    def getGeneration(self):
+        """Returns the generation of the image: it's increased every time the image is drawn,
+        so the image didn't change if the generation is the same
+
+        :return: generation
+        :rtype: int
+        """
+        return self.generation
+    
     def refresh_and_get_image(self):
         self.refresh_image()
         return self.image.copy()
@@ -268,6 +533,11 @@ class OmniaUI:
 
         self.image = self.image.resize((self.width, self.height))
         self.draw = ImageDraw.Draw(self.image)
+        self.generation += 1
+        self._full_refresh = True
+
+        for button in self.buttons.values():    # cells are clipped to the image
+            self._index_button(button)
 
     def changeOrientation(self):
         if self.orientation == "portrait":
@@ -296,10 +566,12 @@ class OmniaUI:
         image = image.resize((self.width, self.height))
 
         self.background_image = image
+        self._full_refresh = True
         self.refresh_image()
     
     def setBackgroundColor(self, color):
         self.background_color = color
+        self._full_refresh = True
         self.refresh_image()
 
     ### --- ###
@@ -307,179 +579,260 @@ class OmniaUI:
     ### XML ###
 
     def loadFromXMLFile(self, filename):
-        tree = ET.parse(filename)
-        self.root = tree.getroot()
-        self._load_xml()
+        # compiled once, until the file or its images change
+        self._load_template(OmniaUITemplate.fromFile(filename))
     
     def loadFromXML(self, xml_string):
-        self.root = ET.fromstring(xml_string)
-        self._load_xml()
+        self._load_template(OmniaUITemplate(ET.fromstring(xml_string)))
 
-    def _load_xml(self):
+    def _load_template(self, template):
+        self.template = template
         self.reset_image()
 
-        if "dimensions" in self.root.attrib:
-            dim = make_tuple(self.root.attrib["dimensions"])
-            self.width = dim[0]
-            self.height = dim[1]
+        if template.dimensions:
+            self.width = template.dimensions[0]
+            self.height = template.dimensions[1]
             self.image = Image.new("RGBA", (self.width, self.height), self.background_color)
             self.draw = ImageDraw.Draw(self.image)
+            self.generation += 1
+            self._full_refresh = True
         
-        if "orientation" in self.root.attrib:
-            self.orientation = self.root.attrib["orientation"]
-
-            #print(self.orientation, self.width, self.height)
+        if template.orientation:
+            self.orientation = template.orientation
 
             if self.orientation == "landscape" and self.width < self.height:
                 self._invert_dimensions()
             elif self.orientation == "portrait" and self.width >= self.height:
                 self._invert_dimensions()
 
-        if "bg-color" in self.root.attrib:
-            self.background_color = make_tuple(self.root.attrib["bg-color"])
+        if template.background_color:
+            self.background_color = template.background_color
+
+        if template.background_image:
+            self.background_image = template.getBackgroundImage((self.width, self.height))
 
-        if "bg-image" in self.root.attrib:
-            img = Image.open(self.root.attrib["bg-image"])
-            img = img.convert("RGBA")
-            img = img.resize((self.width, self.height))
-            self.background_image = img
+        # elements are created for this UI, their images are shared with the template
+        for elem_type, elem_id, elem in template.elements:
+            if elem_type == "line":
+                line_element = OmniaUILine(elem_id, [elem["start"], elem["end"]])
+
+                if "width" in elem:
+                    line_element.setWidth(elem["width"])
+                
+                if "color" in elem:
+                    line_element.setColor(elem["color"])
+                
+                if "visible" in elem:
+                    line_element.visible = elem["visible"]
+                
+                if "static" in elem:
+                    line_element.setStatic(elem["static"])
+                
+                self.addElement(line_element)
+
+            else:
+                ui_element = OmniaUIElement(elem_id, elem_type, elem["position"], elem["text"])
+
+                if elem_type == "button":
+                    ui_element.clickable = True
+
+                if "image" in elem:
+                    ui_element.addImage(elem["image"])
+                
+                if "visible" in elem:
+                    ui_element.visible = elem["visible"]
+                
+                if "dimensions" in elem:
+                    ui_element.setDimensions(elem["dimensions"])
 
-        for child in self.root:
+                if "text-color" in elem:
+                    ui_element.setTextColor(elem["text-color"])
+
+                if "background-color" in elem:
+                    ui_element.setBackgroundColor(elem["background-color"])
+                
+                if "outline-color" in elem:
+                    ui_element.setOutlineColor(elem["outline-color"])
+                
+                if "font-size" in elem:
+                    ui_element.setFontSize(elem["font-size"])
+                
+                if "padding" in elem:
+                    ui_element.setPadding(elem["padding"])
+                
+                if "static" in elem:
+                    ui_element.setStatic(elem["static"])
+                
+                self.addElement(ui_element)
+        
+        self.refresh_image()
+
+    ### --- ###
+
+class OmniaUITemplate:
+    """UI layout compiled from XML, instantiated by OmniaUI.loadFromXMLFile() and OmniaUI.loadFromXML().
+
+    Properties are parsed and images are decoded, converted to RGBA and resized once, when the template is compiled
+    (through OmniaAssets, so icons used by several templates are decoded once too): loading it on a UI only creates its elements.
+    Templates and their images are shared by every UI and must not be modified.
+
+    Templates of XML files are cached until the file, or an image it references, is modified.
+    """
+
+    TUPLE_PROPERTIES = ("position", "start", "end", "dimensions", "color", "text-color", "background-color", "outline-color")
+    INT_PROPERTIES = ("width", "font-size", "padding")
+    REQUIRED_PROPERTIES = {"line": ("start", "end"), "button": ("position", "text"), "label": ("position", "text")}
+
+    __cache = {}    # {absolute path of the XML file: OmniaUITemplate}
+
+    log = logging.getLogger('OmniaUITemplate')
+
+    def __init__(self, root, filename=None):
+        """Compile an XML layout
+
+        :param root: root of the XML layout
+        :type root: xml.etree.ElementTree.Element
+        :param filename: path of the XML file, defaults to None (not read from a file)
+        :type filename: str, optional
+        """
+        self.filename = filename
+        self.__files = {}   # {path: (mtime, size)} of the files the template is compiled from
+        self.__background_path = None
+
+        if filename:
+            self.__addFile(filename)
+
+        self.dimensions = None
+        self.orientation = None
+        self.background_color = None
+        self.background_image = None
+
+        if "dimensions" in root.attrib:
+            self.dimensions = make_tuple(root.attrib["dimensions"])
+        
+        if "orientation" in root.attrib:
+            self.orientation = root.attrib["orientation"]
+
+        if "bg-color" in root.attrib:
+            self.background_color = make_tuple(root.attrib["bg-color"])
+
+        if "bg-image" in root.attrib:
+            self.__background_path = root.attrib["bg-image"]
+            self.background_image = self.__loadImage(self.__background_path)
+        
+        self.elements = tuple(self.__compileElements(root))     # (element type, element id, {property: value})
+
+    @classmethod
+    def fromFile(cls, filename):
+        """Get the template of an XML file, compiled again only if the file or its images were modified
+
+        :param filename: path of the XML file
+        :type filename: str
+        :return: template
+        :rtype: OmniaUITemplate
+        """
+        path = os.path.abspath(filename)
+        template = cls.__cache.get(path)
+
+        if template is None or not template.isValid():
+            template = cls(ET.parse(filename).getroot(), filename)
+            cls.__cache[path] = template
+
+            cls.log.debug("Compiled {!r}".format(filename))
+
+        return template
+
+    def isValid(self):
+        """Check that the files the template is compiled from weren't modified
+
+        :return: True if the template is up to date
+        :rtype: bool
+        """
+        try:
+            return all( self.__getFileVersion(path) == version for path, version in self.__files.items() )
+        except OSError:
+            return False
+
+    def getBackgroundImage(self, size):
+        """Get the background image resized to the UI
+
+        :param size: (width, height) of the UI
+        :type size: tuple
+        :return: background image, None if there is none
+        :rtype: PIL.Image
+        """
+        if self.background_image is None:
+            return None
+
+        return OmniaAssets.getDefault().getImage(self.__background_path, "RGBA", size)
+
+    def __compileElements(self, root):
+        for child in root:
             elem_id = child.attrib['id']
             elem_type = child.tag
             elem = {}
             for sub_child in child:
                 if sub_child.text:
-                    if sub_child.tag == "image" and "dimensions" in sub_child.attrib:
-                        elem[sub_child.tag] = {"text": sub_child.text, "dimensions": make_tuple(sub_child.attrib["dimensions"])}
-                    else:
-                        elem[sub_child.tag] = sub_child.text
-            
-            #print(elem)
-            
-            if len(elem) > 0:
-                if elem_type == "line":
-                    if "start" in elem:
-                        start = elem["start"]
-                        start = make_tuple(start)
-                    else:
-                        #raise ValueError("Start property is required (not found in element with id: '{}')".format(elem_id))
-                        self.log.error("Start property is required (not found in element with id: '{}')".format(elem_id))
-                    
-                    if "end" in elem:
-                        end = elem["end"]
-                        end = make_tuple(end)
-                    else:
-                        #raise ValueError("End property is required (not found in element with id: '{}')".format(elem_id))
-                        self.log.error("End property is required (not found in element with id: '{}')".format(elem_id))
-                    
-                    #print(start, end)
-                    line_element = OmniaUILine(elem_id, [start, end])
-
-                    if "width" in elem:
-                        width = int(elem["width"])
-                        line_element.setWidth(width)
+                    if sub_child.tag == "image":
+                        if "dimensions" in sub_child.attrib:
+                            elem["image"] = self.__loadImage(sub_child.text, make_tuple(sub_child.attrib["dimensions"]))
                     
-                    if "color" in elem:
-                        color = elem["color"]
-                        color = make_tuple(color)
-                        line_element.setColor(color)
+                    elif sub_child.tag in ("visible", "static"):
+                        if sub_child.text in ['true', 'True', '1']:
+                            elem[sub_child.tag] = True
+                        elif sub_child.text in ['false', 'False', '0']:
+                            elem[sub_child.tag] = False
                     
-                    if "visible" in elem:
-                        visible = elem["visible"]
-                        if visible in ['true', 'True', '1']:
-                            line_element.visible = True
-                        elif visible in ['false', 'False', '0']:
-                            line_element.visible = False
-                    
-                    self.addElement(line_element)
-
-                else:
-                    if "position" in elem:
-                        position = elem["position"]
-                        position = make_tuple(position)
-                    else:
-                        #raise ValueError("Position property is required (not found in element with id: '{}')".format(elem_id))
-                        self.log.error("Position property is required (not found in element with id: '{}')".format(elem_id))
+                    elif sub_child.tag in self.TUPLE_PROPERTIES:
+                        elem[sub_child.tag] = make_tuple(sub_child.text)
                     
+                    elif sub_child.tag in self.INT_PROPERTIES:
+                        elem[sub_child.tag] = int(sub_child.text)
                     
-                    if "text" in elem:
-                        text = elem["text"]
                     else:
-                        #raise ValueError("Text property is required (not found in element with id: '{}')".format(elem_id))
-                        self.log.error("Text property is required (not found in element with id: '{}')".format(elem_id))
+                        elem[sub_child.tag] = sub_child.text
+            
+            if len(elem) > 0:
+                missing = [ prop for prop in self.REQUIRED_PROPERTIES.get(elem_type, ()) if prop not in elem ]
 
-                    ui_element = OmniaUIElement(elem_id, elem_type, position, text)
+                if missing:
+                    #raise ValueError("{} property is required (not found in element with id: '{}')".format(missing[0], elem_id))
+                    self.log.error("{} property is required (not found in element with id: '{}')".format(missing[0].capitalize(), elem_id))
+                    continue
 
-                    if elem_type == "button":
-                        ui_element.clickable = True
+                yield (elem_type, elem_id, MappingProxyType(elem))
 
-                    if "image" in elem:
-                        image = elem["image"]
-                        if "text" in image:
-                            img = Image.open(image["text"])
-                            img = img.convert("RGBA")
-                            img = img.resize(image["dimensions"])
-                            ui_element.addImage(img)
-                    
-                    
-                    if "visible" in elem:
-                        visible = elem["visible"]
-                        if visible in ['true', 'True', '1']:
-                            ui_element.visible = True
-                        elif visible in ['false', 'False', '0']:
-                            ui_element.visible = False
+    def __loadImage(self, filename, dimensions=None):
+        self.__addFile(filename)
 
-                    
-                    if "dimensions" in elem:
-                        dimensions = elem["dimensions"]
-                        dimensions = make_tuple(dimensions)
-                        ui_element.setDimensions(dimensions)
-
-                    if "text-color" in elem:
-                        text_color = elem["text-color"]
-                        text_color = make_tuple(text_color)
-                        ui_element.setTextColor(text_color)
-
-                    if "background-color" in elem:
-                        background_color = elem["background-color"]
-                        background_color = make_tuple(background_color)
-                        ui_element.setBackgroundColor(background_color)
-                    
-                    if "outline-color" in elem:
-                        outline_color = elem["outline-color"]
-                        outline_color = make_tuple(outline_color)
-                        ui_element.setOutlineColor(outline_color)
-                    
-                    if "font-size" in elem:
-                        font_size = int(elem["font-size"])
-                        ui_element.setFontSize(font_size)
-                    
-                    if "padding" in elem:
-                        padding = int(elem["padding"])
-                        ui_element.setPadding(padding)
-                    
-                    self.addElement(ui_element)
-        
-        self.refresh_image()
+        return OmniaAssets.getDefault().getImage(filename, "RGBA", dimensions)
 
-    ### --- ###
+    def __addFile(self, filename):
+        self.__files[filename] = self.__getFileVersion(filename)
+
+    @staticmethod
+    def __getFileVersion(filename):
+        stat = os.stat(filename)
+        return (stat.st_mtime_ns, stat.st_size)
 
 class OmniaUIElement:
 
-    def __init__(self, id, element_type, position, text, image=None, clickable=False, visible=True, dimensions=(70,30), text_color=(0,0,0), font_name="fonts/Arial.ttf", font_size=20, padding=5, background_color=None, outline_color=None):
+    def __init__(self, id, element_type, position, text, image=None, clickable=False, visible=True, dimensions=(70,30), text_color=(0,0,0), font_name="fonts/Arial.ttf", font_size=20, padding=5, background_color=None, outline_color=None, static=None):
 
         # Id
         self.id = id
 
         # Type
         self.type = element_type
+
+        # UI the element was added to, notified when its box or visibility changes
+        self._ui = None
         
         # Font
         self.font_size = font_size
         self.font_name = font_name
         
-        self.font = ImageFont.truetype(self.font_name, self.font_size)
+        self.font = OmniaFonts.getFont(self.font_name, self.font_size)
         
         # Padding
         self.padding = padding
@@ -491,7 +844,7 @@ class OmniaUIElement:
         self.dimensions = dimensions
 
         if text != '':
-            text_size = self.font.getsize(text)
+            text_size = OmniaFonts.getTextSize(self.font, text)
             self.dimensions = ( text_size[0], text_size[1] )
         
         self.x0 = position[0]
@@ -518,6 +871,9 @@ class OmniaUIElement:
         # Click
         self.clickable = clickable
 
+        # Layer: True (static), False (dynamic) or None (static if it's an image), see setStatic()
+        self.static = static
+
         # set initial box
         self._update_box()
     
@@ -530,6 +886,30 @@ class OmniaUIElement:
         else:
             return False
 
+    def getBoundingBox(self):
+        """Returns the rectangle the element is drawn in, text overflowing the box included
+
+        :return: (x0, y0, x1, y1), x1 and y1 excluded
+        :rtype: tuple
+        """
+        x0, y0, x1, y1 = self.x0, self.y0, self.x1 + 1, self.y1 + 1  # outline is drawn on x1, y1 too
+
+        if not self.image:
+            text_width, text_height = OmniaFonts.getTextSize(self.font, self.text)
+            x1 = max(x1, self.x0 + self.padding + text_width + 1)
+            y1 = max(y1, self.y0 + self.padding + text_height + 1)
+
+        return (x0, y0, x1, y1)
+    
+    def getSignature(self):
+        """Returns what the element looks like: if it's the same, the element doesn't need to be drawn again
+
+        :return: signature, compared with ==
+        :rtype: tuple
+        """
+        return (self.visible, self.x0, self.y0, self.x1, self.y1, self.text, id(self.font), self.padding,
+                self.text_color, self.background_color, self.outline_color, id(self.image))
+
     def _update_box(self):
         self.x1 = self.x0 + self.dimensions[0]
         self.y1 = self.y0 + self.dimensions[1]
@@ -541,9 +921,23 @@ class OmniaUIElement:
         
         self.box = [( self.x0, self.y0 ), ( self.x1, self.y1 )]
 
+        if self._ui:
+            self._ui._element_changed(self)
+    
+    @property
+    def visible(self):
+        return self._visible
+    
+    @visible.setter
+    def visible(self, visible):
+        self._visible = visible
+
+        if self._ui:
+            self._ui._element_changed(self)
+
     def setText(self, text):
         self.text = text
-        text_size = self.font.getsize(text)
+        text_size = OmniaFonts.getTextSize(self.font, text)
         self.dimensions = ( text_size[0], text_size[1] )
 
         self._update_box()
@@ -588,24 +982,39 @@ class OmniaUIElement:
     
     def setFontName(self, font_name):
         self.font_name = font_name
-        self.font = ImageFont.truetype(self.font_name, self.font_size)
+        self.font = OmniaFonts.getFont(self.font_name, self.font_size)
     
     def getFontName(self):
         return self.font_name
 
     def setFontSize(self, font_size):
         self.font_size = font_size
-        self.font = ImageFont.truetype(self.font_name, self.font_size)
+        self.font = OmniaFonts.getFont(self.font_name, self.font_size)
     
     def getFontSize(self):
         return self.font_size
     
     def setPadding(self, padding):
         self.padding = padding
+    
+    def setStatic(self, static):
+        """Sets the layer of the element: static elements are cached by the UI with the background,
+        dynamic ones are drawn on top of it at every refresh. Use static for elements that rarely change
+
+        :param static: True (static), False (dynamic) or None (static if it's an image, dynamic if it's text)
+        :type static: bool or None
+        """
+        self.static = static
+    
+    def isStatic(self):
+        if self.static is None:
+            return self.image is not None
+        
+        return self.static
 
 class OmniaUILine:
 
-    def __init__(self, line_id, xy, width=1, color=(0,0,0), visible=True):
+    def __init__(self, line_id, xy, width=1, color=(0,0,0), visible=True, static=True):
 
         self.id = line_id
 
@@ -621,6 +1030,8 @@ class OmniaUILine:
 
         self.visible = visible
 
+        self.static = static    # see OmniaUIElement.setStatic()
+
         self.type = "line"
     
     def setXY(self, xy):
@@ -633,6 +1044,25 @@ class OmniaUILine:
     def getXY(self):
         return [(self.lx0, self.ly0), (self.lx1, self.ly1)]
     
+    def getBoundingBox(self):
+        """Returns the rectangle the line is drawn in
+
+        :return: (x0, y0, x1, y1), x1 and y1 excluded
+        :rtype: tuple
+        """
+        margin = self.width // 2 + 1
+
+        return (min(self.lx0, self.lx1) - margin, min(self.ly0, self.ly1) - margin,
+                max(self.lx0, self.lx1) + margin + 1, max(self.ly0, self.ly1) + margin + 1)
+    
+    def getSignature(self):
+        """Returns what the line looks like: if it's the same, the line doesn't need to be drawn again
+
+        :return: signature, compared with ==
+        :rtype: tuple
+        """
+        return (self.visible, self.lx0, self.ly0, self.lx1, self.ly1, self.width, self.color)
+    
     def setWidth(self, width):
         self.width = width
     
@@ -643,4 +1073,10 @@ class OmniaUILine:
         self.color = color
     
     def getColor(self):
-        return self.color
\ No newline at end of file
+        return self.color
+    
+    def setStatic(self, static):
+        self.static = static
+    
+    def isStatic(self):
+        return self.static
\ No newline at end of file
@@ -0,0 +1,800 @@
+import logging
+import hashlib
+import os
+import time
+import mmap
+import struct
+import threading
+import collections
+import numpy
+import cv2
+import curio
+
+### Omnia libraries ###
+from core.omniaMessageTypes      import OmniaMessageTypes as OMT
+### --- ###
+
+"""Utilities for video streaming
+"""
+
+class OmniaVideoRateController:
+    """Adaptive quality and frame pacing of a video stream.
+
+    Chooses JPEG quality, resolution scale and frame skip from a ladder of levels (LEVELS, best first),
+    so that the stream holds the target fps. At every frame, the cost of a frame is estimated as:
+        encoding time (OmniaDisplay.encode_time) + time to the wire (bulk messages) + half RTT (OmniaProtocol latency statistics)
+    and compared with the frame budget, 1 / target fps (times 1 + frame skip, since skipped frames don't need to be sent).
+    The level gets worse after DEGRADE_AFTER frames over budget (or with dropped frames, or below target fps),
+    and better after UPGRADE_AFTER frames under HEADROOM of the budget.
+    """
+
+    # (JPEG quality, resolution scale, frames skipped after each sent frame)
+    LEVELS = [
+        (85, 1.0, 0),
+        (75, 1.0, 0),
+        (65, 1.0, 0),
+        (55, 0.75, 0),
+        (45, 0.75, 0),
+        (45, 0.5, 0),
+        (35, 0.5, 1),
+        (35, 0.5, 2),
+    ]
+
+    DEGRADE_AFTER = 3       # consecutive frames over budget before lowering the level
+    UPGRADE_AFTER = 30      # consecutive frames under headroom before raising the level
+    HEADROOM = 0.6          # ratio of the budget a frame must stay under to raise the level
+    MIN_FPS_RATIO = 0.9     # achieved fps under this ratio of the target counts as over budget
+    FPS_WEIGHT = 0.2        # weight of the last frame interval in the fps moving average
+    MIN_SLEEP = 0.001       # seconds
+
+    def __init__(self, omniaDisplay, target_fps=30, level=0):
+        """Initialization
+
+        :param omniaDisplay: display the video is streamed to
+        :type omniaDisplay: OmniaDisplay instance
+        :param target_fps: frames per second to hold, defaults to 30
+        :type target_fps: float, optional
+        :param level: initial index in LEVELS, defaults to 0 (best quality)
+        :type level: int, optional
+        """
+
+        ### Display ###
+        self.omniaDisplay = omniaDisplay
+        self.omniaProtocol = omniaDisplay.omniaProtocol
+        ### --- ###
+
+        ### Rate ###
+        self.target_fps = target_fps
+        self.level = level
+        ### --- ###
+
+        ### Measures ###
+        self.fps = 0.0      # moving average of sent frames per second
+        self.cost = 0.0     # last estimated cost of a frame (in seconds)
+        self.frames = 0     # frames sent
+
+        self.__last_frame_time = None
+        self.__last_dropped = omniaDisplay.dropped_frames
+        self.__over_budget = 0
+        self.__under_budget = 0
+        ### --- ###
+
+        ### Log ###
+        self.log = logging.getLogger(
+            '[{}]: OmniaVideoRateController'.format(self.omniaProtocol.client_info["name"])
+        )
+        ### --- ###
+
+    def nextFrame(self):
+        """Update measures and level, call it once before sending each frame
+
+        :return: parameters of the frame, see getParameters()
+        :rtype: dict
+        """
+        now = time.perf_counter()
+
+        if self.__last_frame_time is not None:
+            interval = now - self.__last_frame_time
+
+            if interval > 0:
+                if self.fps == 0.0:
+                    self.fps = 1 / interval
+                else:
+                    self.fps += (1 / interval - self.fps) * self.FPS_WEIGHT
+
+        self.__last_frame_time = now
+        self.frames += 1
+
+        self.cost = (
+            self.omniaDisplay.encode_time
+            + self.omniaProtocol.getWireLatency(OMT.PRIORITY_BULK)["avg"] / 1000    # ms to seconds
+            + self.omniaProtocol.getLatencyStats()["ewma"] / 2000     # half RTT, in seconds
+        )
+
+        dropped = self.omniaDisplay.dropped_frames - self.__last_dropped
+        self.__last_dropped = self.omniaDisplay.dropped_frames
+
+        budget = self.getFrameInterval()
+        slow = self.frames > self.DEGRADE_AFTER and self.fps < self.getTargetFps() * self.MIN_FPS_RATIO
+
+        if dropped or slow or self.cost > budget:
+            self.__over_budget += 1
+            self.__under_budget = 0
+        elif self.cost < budget * self.HEADROOM:
+            self.__under_budget += 1
+            self.__over_budget = 0
+        else:
+            self.__over_budget = 0
+            self.__under_budget = 0
+
+        if self.__over_budget >= self.DEGRADE_AFTER and self.level < len(self.LEVELS) - 1:
+            self.setLevel(self.level + 1)
+        elif self.__under_budget >= self.UPGRADE_AFTER and self.level > 0:
+            self.setLevel(self.level - 1)
+
+        return self.getParameters()
+
+    def setLevel(self, level):
+        """Set level, index in LEVELS
+
+        :param level: level
+        :type level: int
+        """
+        self.level = max(0, min(level, len(self.LEVELS) - 1))
+
+        self.__over_budget = 0
+        self.__under_budget = 0
+        self.fps = 0.0  # measured again at the new rate
+        self.frames = 0
+
+        self.log.debug("video level: {}, parameters: {}".format(self.level, self.getParameters()))
+
+    def getParameters(self):
+        """Get parameters of the current level
+
+        :return: {
+                    "quality": <JPEG quality>,
+                    "scale": <resolution scale>,
+                    "skip": <frames to skip after each sent frame>
+                }
+        :rtype: dict
+        """
+        quality, scale, skip = self.LEVELS[self.level]
+
+        return {
+            "quality": quality,
+            "scale": scale,
+            "skip": skip,
+        }
+
+    def getTargetFps(self):
+        """Get frames per second to send at the current level (target fps divided by 1 + frame skip)
+
+        :return: frames per second
+        :rtype: float
+        """
+        return self.target_fps / (1 + self.LEVELS[self.level][2])
+
+    def getFrameInterval(self):
+        """Get seconds between two sent frames at the current level
+
+        :return: seconds
+        :rtype: float
+        """
+        return 1 / self.getTargetFps()
+
+    def getSleepTime(self):
+        """Get seconds to wait before the next frame, to keep the frame interval
+
+        :return: seconds
+        :rtype: float
+        """
+        if self.__last_frame_time is None:
+            return self.MIN_SLEEP
+
+        next_frame_time = self.__last_frame_time + self.getFrameInterval()
+
+        return max(self.MIN_SLEEP, next_frame_time - time.perf_counter())
+
+    def getMetrics(self):
+        """Get chosen parameters and measures
+
+        :return: {
+                    "level": <index in LEVELS>,
+                    "quality": <JPEG quality>,
+                    "scale": <resolution scale>,
+                    "skip": <frames skipped after each sent frame>,
+                    "target_fps": <frames per second to send at the current level>,
+                    "fps": <achieved frames per second>,
+                    "cost": <estimated seconds to deliver a frame>,
+                    "encode_time": <seconds to encode a frame>,
+                    "dropped_frames": <frames dropped by the display>
+                }
+        :rtype: dict
+        """
+        metrics = self.getParameters()
+        metrics.update({
+            "level": self.level,
+            "target_fps": self.getTargetFps(),
+            "fps": self.fps,
+            "cost": self.cost,
+            "encode_time": self.omniaDisplay.encode_time,
+            "dropped_frames": self.omniaDisplay.dropped_frames,
+        })
+
+        return metrics
+
+# ---------------------------------------------------- #
+
+class OmniaVideoDecoder:
+    """Decodes a video in a background thread, ahead of playback.
+    Frames are resized by cv2 and converted from BGR to RGB into a ring of preallocated arrays,
+    so that the event loop only pops ready frames (see popFrame()) and never touches the codec.
+    """
+
+    RING_SIZE = 4   # default number of preallocated frames
+
+    def __init__(self, path, size, ring_size=RING_SIZE):
+        """Initialization
+
+        :param path: path to the video file
+        :type path: str
+        :param size: (width, height) of the frames, the maximum one if changed by setSize()
+        :type size: tuple
+        :param ring_size: number of preallocated frames, at least 2 (one is held by the caller), defaults to RING_SIZE
+        :type ring_size: int, optional
+        """
+
+        ### Video ###
+        self.path = path
+        self.max_size = tuple(size)
+        self.size = tuple(size)     # (width, height) of the next decoded frames
+        self.skip = 0   # frames skipped after each decoded frame
+        ### --- ###
+
+        ### Ring ###
+        width, height = self.max_size
+        self.__ring = [ numpy.empty(width * height * 3, numpy.uint8) for _ in range(max(2, ring_size)) ]
+        self.__free = collections.deque(range(len(self.__ring)))    # indexes of frames that can be decoded
+        self.__ready = collections.deque()  # (index, (width, height), number in the video) of decoded frames, in order
+        self.__popped = None    # index of the frame held by the caller
+        self.position = -1      # number in the video of the frame held by the caller
+        self.__condition = threading.Condition()
+        ### --- ###
+
+        ### Thread ###
+        self.__thread = None
+        self.__running = False
+        self.__eof = False
+        ### --- ###
+
+        ### Statistics ###
+        self.decoded = 0    # frames decoded
+        self.skipped = 0    # frames skipped without being converted
+        self.underruns = 0  # popFrame() calls with no ready frame
+        ### --- ###
+
+        ### Log ###
+        self.log = logging.getLogger('OmniaVideoDecoder')
+        ### --- ###
+
+    def start(self):
+        """Start decoding from the beginning of the video
+        """
+        self.stop()
+
+        with self.__condition:
+            self.__free.extend(index for index, _, _ in self.__ready)
+            self.__ready.clear()
+            self.position = -1
+
+            if self.__popped is not None:
+                self.__free.append(self.__popped)
+                self.__popped = None
+            
+            self.__running = True
+            self.__eof = False
+
+        self.__thread = threading.Thread(target=self.__decodeLoop, name="OmniaVideoDecoder", daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        """Stop decoding, waiting for the thread to finish the frame it's decoding
+        """
+        with self.__condition:
+            self.__running = False
+            self.__condition.notify_all()
+
+        if self.__thread:
+            self.__thread.join()
+            self.__thread = None
+
+    def __decodeLoop(self):
+        """Decoding thread: decode, resize and convert frames into free arrays of the ring, until the video ends or stop() is called
+        """
+        vidcap = cv2.VideoCapture(self.path)
+        raw = None  # decoded BGR frame, reused by cv2
+        number = -1 # number in the video of the last read frame
+
+        try:
+            while True:
+                with self.__condition:
+                    while self.__running and not self.__free:
+                        self.__condition.wait()
+
+                    if not self.__running:
+                        return
+                    
+                    index = self.__free.popleft()
+                    width, height = self.size
+                    skip = self.skip
+
+                success = True
+                for _ in range(skip):
+                    success = vidcap.grab()     # decode without converting
+                    if not success:
+                        break
+                    number += 1
+                    self.skipped += 1
+
+                if success:
+                    success, raw = vidcap.read(raw)
+                    number += 1
+                
+                if not success:
+                    with self.__condition:
+                        self.__free.append(index)
+                        self.__eof = True
+                    return
+                
+                frame = self.__ring[index][:width * height * 3].reshape(height, width, 3)
+                cv2.resize(raw, (width, height), dst=frame)
+                cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=frame)
+
+                with self.__condition:
+                    self.__ready.append((index, (width, height), number))
+                    self.decoded += 1
+        except Exception:
+            self.log.exception("Cannot decode {!r}".format(self.path))
+
+            with self.__condition:
+                self.__eof = True
+        finally:
+            vidcap.release()
+
+    def popFrame(self):
+        """Get the next decoded frame, without waiting. Releases the frame returned by the previous call,
+        so the returned array is valid only until the next call (PIL.Image.fromarray() copies it).
+        The number in the video of the returned frame is set in `position`.
+
+        :return: RGB frame of shape (height, width, 3), None if no frame is ready
+        :rtype: numpy.ndarray
+        """
+        with self.__condition:
+            if self.__popped is not None:
+                self.__free.append(self.__popped)
+                self.__popped = None
+                self.__condition.notify()
+            
+            if not self.__ready:
+                if not self.__eof:
+                    self.underruns += 1
+                return None
+            
+            index, (width, height), self.position = self.__ready.popleft()
+            self.__popped = index
+
+        return self.__ring[index][:width * height * 3].reshape(height, width, 3)
+
+    def isFinished(self):
+        """Check if the video ended and all its frames have been popped
+
+        :return: True if there are no more frames
+        :rtype: bool
+        """
+        with self.__condition:
+            return self.__eof and not self.__ready
+
+    def setSize(self, size):
+        """Set size of the next decoded frames, frames already decoded keep their size
+
+        :param size: (width, height), not bigger than the size passed at initialization
+        :type size: tuple
+        """
+        width = max(1, min(int(size[0]), self.max_size[0]))
+        height = max(1, min(int(size[1]), self.max_size[1]))
+
+        self.size = (width, height)
+
+    def setSkip(self, skip):
+        """Set frames skipped after each decoded frame
+
+        :param skip: frames to skip
+        :type skip: int
+        """
+        self.skip = max(0, skip)
+
+    def getStats(self):
+        """Get decoding statistics
+
+        :return: {
+                    "decoded": <frames decoded>,
+                    "skipped": <frames skipped>,
+                    "underruns": <times no frame was ready>,
+                    "ready": <frames ready to be popped>
+                }
+        :rtype: dict
+        """
+        with self.__condition:
+            ready = len(self.__ready)
+
+        return {
+            "decoded": self.decoded,
+            "skipped": self.skipped,
+            "underruns": self.underruns,
+            "ready": ready,
+        }
+
+# ---------------------------------------------------- #
+
+class OmniaVideoCache:
+    """On-disk cache of videos transcoded to JPEG frames, one file per (source, resolution, quality).
+    A source is decoded, resized and encoded once, in a worker thread, then played by every client from a memory-mapped file:
+    a frame is a slice of the file, sent by OmniaProtocol with no decoding, encoding or copy (see OmniaVideoCacheFile).
+
+    File layout (big-endian):
+        HEADER: magic, version, width, height, JPEG quality, number of frames, fps, source size, source mtime, index offset
+        frames: FRAME_HEADER (JPEG length) followed by the JPEG, for every frame of the source
+        index: offset of every frame in the file, as uint64
+    A file is transcoded again when the size or modification time of the source differ from its header.
+    """
+
+    CACHE_DIR = 'devices/resources/video/cache'
+    EXTENSION = '.omv'
+    DEFAULT_WORKERS = 1     # videos transcoded at the same time, the others wait
+
+    ### File format ###
+    MAGIC = b'OMNV'
+    VERSION = 1
+    HEADER = struct.Struct('>4sBHHBIdQdQ')
+    FRAME_HEADER = struct.Struct('>I')
+    INDEX_TYPE = numpy.dtype('>u8')
+    ### --- ###
+
+    __default = None    # cache shared by all apps
+
+    def __init__(self, cache_dir=CACHE_DIR, workers=DEFAULT_WORKERS):
+        """Initialization
+
+        :param cache_dir: directory of the transcoded files, defaults to CACHE_DIR
+        :type cache_dir: str, optional
+        :param workers: maximum number of videos transcoded at the same time, defaults to DEFAULT_WORKERS
+        :type workers: int, optional
+        """
+
+        ### Cache ###
+        self.cache_dir = cache_dir
+        self.__files = {}       # (source, (width, height), quality): OmniaVideoCacheFile
+        self.__transcoding = {} # (source, (width, height), quality): transcoding task
+        self.__failed = {}      # (source, (width, height), quality): source mtime, not transcoded again until the source changes
+        self.__semaphore = curio.Semaphore(workers)
+        ### --- ###
+
+        ### Statistics ###
+        self.hits = 0           # getFile() calls returning a transcoded file
+        self.transcoded = 0     # files transcoded
+        self.transcode_time = 0.0   # total seconds spent transcoding
+        ### --- ###
+
+        ### Log ###
+        self.log = logging.getLogger('OmniaVideoCache')
+        ### --- ###
+
+    @classmethod
+    def getDefault(cls):
+        """Get the cache shared by all apps, created with default parameters if not set by setDefault()
+
+        :return: default cache
+        :rtype: OmniaVideoCache
+        """
+        if cls.__default is None:
+            cls.__default = cls()
+
+        return cls.__default
+
+    @classmethod
+    def setDefault(cls, cache):
+        """Set the cache shared by all apps
+
+        :param cache: default cache
+        :type cache: OmniaVideoCache
+        """
+        cls.__default = cache
+
+    def getPath(self, source, size, quality):
+        """Get path of the transcoded file of a source
+
+        :param source: path to the source video
+        :type source: str
+        :param size: (width, height) of the frames
+        :type size: tuple
+        :param quality: JPEG quality
+        :type quality: int
+        :return: path in cache_dir
+        :rtype: str
+        """
+        name = os.path.splitext(os.path.basename(source))[0]
+        source_hash = hashlib.sha1(os.path.abspath(source).encode()).hexdigest()[:8]     # sources with the same name in different directories
+
+        return os.path.join(
+            self.cache_dir,
+            '{}_{}_{}x{}_q{}{}'.format(name, source_hash, int(size[0]), int(size[1]), int(quality), self.EXTENSION)
+        )
+
+    async def getFile(self, source, size, quality, wait=False):
+        """Get transcoded video, transcoding it in a worker thread if it's not in the cache or the source has changed
+
+        :param source: path to the source video
+        :type source: str
+        :param size: (width, height) of the frames
+        :type size: tuple
+        :param quality: JPEG quality
+        :type quality: int
+        :param wait: True to wait for transcoding, otherwise None is returned until the file is ready, defaults to False
+        :type wait: bool, optional
+        :return: transcoded video, None if not ready or the source cannot be transcoded
+        :rtype: OmniaVideoCacheFile
+        """
+        key = (source, (int(size[0]), int(size[1])), int(quality))
+
+        try:
+            stat = os.stat(source)
+        except OSError:
+            self.log.error("Cannot find video {!r}".format(source))
+            return None
+
+        cached = self.__files.get(key)
+
+        if cached and not cached.isValid(stat):    # source changed
+            del self.__files[key]
+            cached.close()
+            cached = None
+        
+        if cached is None and key not in self.__transcoding:
+            if self.__failed.get(key) == stat.st_mtime:
+                return None
+
+            cached = self.__openFile(self.getPath(*key), stat)
+
+            if cached:
+                self.__files[key] = cached
+            else:
+                self.__transcoding[key] = await curio.spawn(self.__transcodeTask, key, daemon=True)
+        
+        if cached is None and wait:
+            await self.__transcoding[key].wait()
+            cached = self.__files.get(key)
+
+        if cached:
+            self.hits += 1
+
+        return cached
+
+    def __openFile(self, path, stat):
+        """Open a file transcoded before, if it's still valid
+
+        :param path: path of the transcoded file
+        :type path: str
+        :param stat: os.stat() of the source
+        :type stat: os.stat_result
+        :return: transcoded video, None if missing or stale
+        :rtype: OmniaVideoCacheFile
+        """
+        if not os.path.exists(path):
+            return None
+
+        try:
+            cached = OmniaVideoCacheFile(path)
+        except (OSError, ValueError):
+            self.log.warning("Invalid cache file {!r}, transcoding again".format(path))
+            return None
+
+        if not cached.isValid(stat):
+            cached.close()
+            return None
+
+        return cached
+
+    async def __transcodeTask(self, key):
+        """Transcode a source in a worker thread and open the transcoded file
+
+        :param key: (source, (width, height), quality)
+        :type key: tuple
+        """
+        source, size, quality = key
+        path = self.getPath(*key)
+
+        try:
+            async with self.__semaphore:
+                self.log.info("Transcoding {!r} to {}x{}, quality {}".format(source, size[0], size[1], quality))
+
+                start = time.perf_counter()
+                await curio.run_in_thread(self.__transcode, source, path, size, quality)
+                self.transcode_time += time.perf_counter() - start
+                self.transcoded += 1
+
+            self.__files[key] = OmniaVideoCacheFile(path)
+        except curio.CancelledError:
+            raise
+        except Exception:
+            self.log.exception("Cannot transcode {!r}".format(source))
+            self.__failed[key] = os.stat(source).st_mtime if os.path.exists(source) else None
+        finally:
+            del self.__transcoding[key]
+
+    def __transcode(self, source, path, size, quality):
+        """Transcode source to path, runs in a worker thread.
+        The file is written to a temporary path and then renamed, so that it's never read while being written.
+
+        :param source: path to the source video
+        :type source: str
+        :param path: path of the transcoded file
+        :type path: str
+        :param size: (width, height) of the frames
+        :type size: tuple
+        :param quality: JPEG quality
+        :type quality: int
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        stat = os.stat(source)
+        width, height = size
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+
+        vidcap = cv2.VideoCapture(source)
+        raw = None  # decoded BGR frame, reused by cv2
+        frame = numpy.empty((height, width, 3), numpy.uint8)
+        offsets = []
+
+        try:
+            if not vidcap.isOpened():
+                raise ValueError("cannot open video")
+
+            with open(tmp_path, 'wb') as f:
+                f.write(bytes(self.HEADER.size))    # written once the index offset is known
+
+                while True:
+                    success, raw = vidcap.read(raw)
+                    if not success:
+                        break
+
+                    cv2.resize(raw, (width, height), dst=frame)
+                    success, jpeg = cv2.imencode('.jpg', frame, [ cv2.IMWRITE_JPEG_QUALITY, quality ])
+                    if not success:
+                        raise ValueError("cannot encode frame {}".format(len(offsets)))
+
+                    offsets.append(f.tell())
+                    f.write(self.FRAME_HEADER.pack(len(jpeg)))
+                    f.write(jpeg)
+                
+                if not offsets:
+                    raise ValueError("no frames")
+                
+                index_offset = f.tell()
+                f.write(numpy.array(offsets, self.INDEX_TYPE).tobytes())
+
+                f.seek(0)
+                f.write(self.HEADER.pack(
+                    self.MAGIC, self.VERSION, width, height, quality, len(offsets), vidcap.get(cv2.CAP_PROP_FPS),
+                    stat.st_size, stat.st_mtime, index_offset
+                ))
+            
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        finally:
+            vidcap.release()
+
+    def getStats(self):
+        """Get cache statistics
+
+        :return: {
+                    "hits": <getFile() calls returning a transcoded file>,
+                    "transcoded": <files transcoded>,
+                    "avg_transcode_time": <average seconds to transcode a file>,
+                    "open": <transcoded files open>,
+                    "transcoding": <files being transcoded>
+                }
+        :rtype: dict
+        """
+        return {
+            "hits": self.hits,
+            "transcoded": self.transcoded,
+            "avg_transcode_time": self.transcode_time / self.transcoded if self.transcoded else 0.0,
+            "open": len(self.__files),
+            "transcoding": len(self.__transcoding),
+        }
+
+# ---------------------------------------------------- #
+
+class OmniaVideoCacheFile:
+    """Video transcoded by OmniaVideoCache, memory-mapped read-only: frames are read by the OS page cache,
+    shared by all the clients playing it.
+    """
+
+    def __init__(self, path):
+        """Initialization
+
+        :param path: path of the transcoded file
+        :type path: str
+        :raises ValueError: if the file is not a valid transcoded video
+        """
+        self.path = path
+
+        with open(path, 'rb') as f:
+            self.__mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        
+        try:
+            magic, version, width, height, quality, frames, fps, source_size, source_mtime, index_offset = \
+                OmniaVideoCache.HEADER.unpack_from(self.__mmap)
+            
+            if magic != OmniaVideoCache.MAGIC or version != OmniaVideoCache.VERSION:
+                raise ValueError("not a transcoded video (version {})".format(OmniaVideoCache.VERSION))
+            
+            # offset of every frame, read from the mapped file
+            self.__index = numpy.frombuffer(self.__mmap, OmniaVideoCache.INDEX_TYPE, count=frames, offset=index_offset)
+        except (struct.error, ValueError):
+            self.__mmap.close()
+            raise ValueError("Invalid transcoded video {!r}".format(path))
+
+        ### Video ###
+        self.width = width
+        self.height = height
+        self.quality = quality
+        self.frames = frames
+        self.fps = fps
+        ### --- ###
+
+        ### Source ###
+        self.source_size = source_size
+        self.source_mtime = source_mtime
+        ### --- ###
+
+        self.__view = memoryview(self.__mmap)
+
+    def isValid(self, stat):
+        """Check if the file was transcoded from the current version of the source
+
+        :param stat: os.stat() of the source
+        :type stat: os.stat_result
+        :return: True if size and modification time of the source are unchanged
+        :rtype: bool
+        """
+        return stat.st_size == self.source_size and stat.st_mtime == self.source_mtime
+
+    def getFrame(self, number):
+        """Get a JPEG frame, without copying it
+
+        :param number: number of the frame, from 0 to frames - 1
+        :type number: int
+        :return: JPEG frame, a slice of the mapped file
+        :rtype: memoryview
+        """
+        offset = int(self.__index[number])
+        length, = OmniaVideoCache.FRAME_HEADER.unpack_from(self.__mmap, offset)
+        offset += OmniaVideoCache.FRAME_HEADER.size
+
+        return self.__view[offset:offset + length]
+
+    def close(self):
+        """Unmap the file. If frames are still referenced (e.g. waiting to be sent), it's unmapped when they are released
+        """
+        self.__index = None
+
+        try:
+            self.__view.release()
+            self.__mmap.close()
+        except BufferError:
+            pass
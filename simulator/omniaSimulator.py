@@ -0,0 +1,652 @@
+import argparse
+import collections
+import io
+import json
+import logging
+import multiprocessing
+import os
+import random
+import sys
+import time
+import curio
+from PIL import Image
+
+### Omnia libraries ###
+from core.omniaMessageTypes      import OmniaMessageTypes
+from core.omniaProtocol          import OmniaProtocol
+from modules.omniaDisplay        import Omnia1BitDisplay, OmniaDisplay
+### --- ###
+
+"""Simulated users (watches) and devices, used to load-test OmniaManager without real hardware.
+
+Run from the repository root, for example:
+    python -m simulator.omniaSimulator --manager --users 3 --devices 6 --duration 60
+"""
+
+class OmniaSimulatedClient(OmniaMessageTypes):
+    """Fake client that connects to OmniaManager with a registered MAC address and speaks OmniaProtocol:
+        - negotiates features and protocol version with PROTOCOL_SETUP
+        - echoes LATENCY messages
+        - reassembles CHUNK messages
+        - sends button bitmasks, BLE scans and touch events, when the manager asked for them
+        - records received frames (images and video frames)
+    """
+
+    FRAME_TYPES = (OmniaMessageTypes.ONE_BIT_IMAGE, OmniaMessageTypes.PARTIAL_ONE_BIT_IMAGE,
+                   OmniaMessageTypes.RGBA_IMAGE, OmniaMessageTypes.DELTA_FRAME, OmniaMessageTypes.VIDEO_FRAME)
+
+    def __init__(self, mac, client_data, client_type, address, port,
+                 features=OmniaProtocol.SUPPORTED_FEATURES, protocol_version=OmniaProtocol.PROTOCOL_VERSION,
+                 button_rate=1.0, ble_rate=1.0, touch_rate=1.0, ble_ids=[], touch_size=(320, 240), record_frames=0):
+        """Initialization
+
+        :param mac: MAC address sent to the manager for identification (12 characters)
+        :type mac: str
+        :param client_data: data of the client, from users.json or devices.json
+        :type client_data: dict
+        :param client_type: "user" or "device"
+        :type client_type: str
+        :param address: manager IP address
+        :type address: str
+        :param port: manager port
+        :type port: int
+        :param features: bitmask of OmniaProtocol.FEATURE_* values requested, 0 to behave as a legacy client
+        :type features: int, optional
+        :param protocol_version: protocol version sent with PROTOCOL_SETUP
+        :type protocol_version: int, optional
+        :param button_rate: button bitmasks sent per second, 0 disables them, defaults to 1.0
+        :type button_rate: float, optional
+        :param ble_rate: BLE scans sent per second, 0 disables them, defaults to 1.0
+        :type ble_rate: float, optional
+        :param touch_rate: touch events sent per second, 0 disables them, defaults to 1.0
+        :type touch_rate: float, optional
+        :param ble_ids: user ids reported by BLE scans, defaults to []
+        :type ble_ids: list, optional
+        :param touch_size: (width, height) of the simulated touchscreen, defaults to (320, 240)
+        :type touch_size: tuple, optional
+        :param record_frames: number of last received frames kept in self.frames, defaults to 0
+        :type record_frames: int, optional
+        """
+
+        ### Client data ###
+        self.mac = mac
+        self.client_data = client_data
+        self.client_type = client_type
+        self.name = client_data["name"]
+        ### --- ###
+
+        ### Manager ###
+        self.address = address
+        self.port = port
+        self.socket = None
+        ### --- ###
+
+        ### Negotiation ###
+        self.requested_features = features
+        self.requested_version = protocol_version
+        self.features = 0
+        self.protocol_version = OmniaProtocol.TEXT_PARAMS_VERSION
+        self.__setup_done = curio.Event()
+        self.__negotiating = bool(features) or protocol_version > OmniaProtocol.TEXT_PARAMS_VERSION
+        self.__pending = []     # messages sent while negotiating, (message, msg_type), sent with the negotiated framing
+        ### --- ###
+
+        ### Events ###
+        self.button_rate = button_rate
+        self.ble_rate = ble_rate
+        self.touch_rate = touch_rate
+        self.ble_ids = ble_ids
+        self.touch_size = touch_size
+
+        self.input_pins = set()     # pins registered by the manager with INPUT_PIN
+        self.ble_enabled = False
+        self.touch_enabled = False
+        ### --- ###
+
+        ### 1-bit display ###
+        self.one_bit_width = None   # set by ONE_BIT_DISPLAY
+        ### --- ###
+
+        ### Chunks ###
+        self.__chunks = {}  # {original msg_type: bytearray}
+        ### --- ###
+
+        ### Statistics ###
+        self.connected_time = None
+        self.closed = False
+        self.received = collections.Counter()       # {msg_type: messages}
+        self.received_bytes = collections.Counter() # {msg_type: bytes}
+        self.sent = collections.Counter()           # {msg_type: messages}
+        self.frames = collections.deque(maxlen=record_frames)   # last received frames, (time, msg_type, frame)
+        self.last_frame = {}    # {msg_type: last received frame}, partial images and delta frames are applied to the last full one
+        ### --- ###
+
+        ### Log ###
+        self.log = logging.getLogger(
+            '[{}]: OmniaSimulatedClient'.format(self.name)
+        )
+        ### --- ###
+
+    async def run(self, duration=None):
+        """Connect to the manager and run until the connection is closed or duration expires
+
+        :param duration: seconds before disconnecting, None to run forever, defaults to None
+        :type duration: float, optional
+        """
+        try:
+            self.socket = (await curio.open_connection(self.address, self.port)).as_stream()
+        except OSError as e:
+            self.log.error("Cannot connect: {!r}".format(e))
+            self.closed = True
+            return
+
+        self.connected_time = time.perf_counter()
+
+        try:
+            async with self.socket:
+                await self.socket.write(self.mac.encode())  # manager identifies clients by MAC address
+
+                async with curio.TaskGroup(wait=any) as g:
+                    await g.spawn(self.__recvLoop)
+                    await g.spawn(self.__negotiate)
+
+                    if duration is not None:
+                        await g.spawn(curio.sleep, duration)
+        except OSError as e:
+            self.log.warning("Connection lost: {!r}".format(e))
+        finally:
+            self.closed = True
+
+    ### SEND ###
+
+    async def send(self, message, msg_type):
+        """Send message to the manager, framed if FEATURE_FRAMED_RECV was negotiated, ending with '\\n' otherwise.
+        Until the manager answers PROTOCOL_SETUP, messages (LATENCY echoes included) are kept and sent after the answer:
+        the manager reads them with the negotiated framing.
+
+        :param message: message to be sent
+        :type message: bytes
+        :param msg_type: type of the message, use values from OmniaMessageTypes class
+        :type msg_type: str
+        """
+        if self.__negotiating and msg_type != self.PROTOCOL_SETUP:
+            self.__pending.append((message, msg_type))
+            return
+
+        if self.features & OmniaProtocol.FEATURE_FRAMED_RECV:
+            data = OmniaProtocol.MSG_HEADER.pack(len(message) + 1, msg_type.encode()) + message
+        else:
+            data = msg_type.encode() + message + b'\n'
+
+        await self.socket.write(data)
+        self.sent[msg_type] += 1
+
+    async def __negotiate(self):
+        """Request features and protocol version, then start sending events
+        """
+        if self.__negotiating:
+            # sent before any feature is enabled, so it always ends with '\n'
+            await self.send("{}-{}".format(self.requested_features, self.requested_version).encode(), self.PROTOCOL_SETUP)
+            await self.__setup_done.wait()
+
+        async with curio.TaskGroup() as g:
+            await g.spawn(self.__emit, self.button_rate, self.__sendButtons)
+            await g.spawn(self.__emit, self.ble_rate, self.__sendBLE)
+            await g.spawn(self.__emit, self.touch_rate, self.__sendTouch)
+
+    async def __emit(self, rate, send_event):
+        """Call send_event rate times per second, with random jitter
+
+        :param rate: events per second, 0 disables them
+        :type rate: float
+        :param send_event: coroutine that sends one event
+        :type send_event: coroutine function
+        """
+        if rate <= 0:
+            return
+
+        while True:
+            await curio.sleep(random.expovariate(rate))
+            await send_event()
+
+    async def __sendButtons(self):
+        """Send bitmask of a random registered input pin, as "<sum of 1 << pin>"
+        """
+        if self.input_pins:
+            await self.send(str(1 << random.choice(tuple(self.input_pins))).encode(), self.INPUT_PIN)
+
+    async def __sendBLE(self):
+        """Send BLE scan, as "<rssi>+<first_id>,<rssi>+<second_id>,..."
+        """
+        if self.ble_enabled and self.ble_ids:
+            scan = ','.join("{}+{}".format(random.randint(-90, -40), uid) for uid in self.ble_ids)
+            await self.send(scan.encode(), self.READ_BLE)
+
+    async def __sendTouch(self):
+        """Send touch event, as "x,y"
+        """
+        if self.touch_enabled:
+            x = random.randrange(self.touch_size[0])
+            y = random.randrange(self.touch_size[1])
+            await self.send("{},{}".format(x, y).encode(), self.TOUCHSCREEN)
+
+    ### END SEND ###
+
+    ### RECEIVE ###
+
+    async def __recvLoop(self):
+        """Read length-prefixed messages sent by the manager, until the connection is closed
+        """
+        while True:
+            try:
+                header = await self.socket.read_exactly(OmniaProtocol.HEADER.size)
+                length, = OmniaProtocol.HEADER.unpack(header)
+                data = memoryview(await self.socket.read_exactly(length))
+            except EOFError:
+                self.log.info("Connection closed by manager")
+                return
+
+            await self.__handleMessage(chr(data[0]), data[1:])
+
+    async def __handleMessage(self, msg_type, payload):
+        """Handle message received from the manager
+
+        :param msg_type: type of the message
+        :type msg_type: str
+        :param payload: message without its type
+        :type payload: memoryview
+        """
+        if msg_type == self.CHUNK:
+            self.__handleChunk(payload)
+            return
+
+        self.received[msg_type] += 1
+        self.received_bytes[msg_type] += len(payload)
+
+        if msg_type == self.LATENCY:
+            await self.send(bytes(payload), self.LATENCY)
+
+        elif msg_type == self.PROTOCOL_SETUP:
+            answer = [ int(p) for p in bytes(payload).split(b'-') ]
+            self.features = answer[0]
+            if len(answer) > 1:
+                self.protocol_version = answer[1]
+            self.log.debug("negotiated features: {:#x}, protocol version: {}".format(self.features, self.protocol_version))
+
+            self.__negotiating = False
+            pending, self.__pending = self.__pending, []
+            for message, pending_type in pending:
+                await self.send(message, pending_type)
+
+            await self.__setup_done.set()
+
+        elif msg_type in self.FRAME_TYPES:
+            self.__recordFrame(msg_type, payload)
+
+        elif msg_type == self.ONE_BIT_DISPLAY:
+            self.one_bit_width = self.__unpackParams(payload, msg_type)[2]
+
+        elif msg_type == self.INPUT_PIN:
+            self.input_pins.add(self.__unpackParams(payload, msg_type)[0])
+
+        elif msg_type == self.REMOVE_INPUT_PIN:
+            self.input_pins.discard(self.__unpackParams(payload, msg_type)[0])
+
+        elif msg_type == self.READ_BLE:
+            self.ble_enabled = bool(self.__unpackParams(payload, msg_type)[0])
+
+        elif msg_type == self.TOUCHSCREEN:
+            self.touch_enabled = bool(self.__unpackParams(payload, msg_type)[0])
+
+    def __handleChunk(self, payload):
+        """Append CHUNK message to its bulk message, handled when the last chunk is received.
+        CHUNK message is: <original msg_type><last chunk flag><data>
+
+        :param payload: CHUNK message without its type
+        :type payload: memoryview
+        """
+        msg_type = chr(payload[0])
+        buf = self.__chunks.setdefault(msg_type, bytearray())
+        buf += payload[2:]
+
+        if payload[1]:  # last chunk
+            del self.__chunks[msg_type]
+
+            self.received[msg_type] += 1
+            self.received_bytes[msg_type] += len(buf)
+
+            if msg_type in self.FRAME_TYPES:
+                self.__recordFrame(msg_type, buf)
+
+    def __recordFrame(self, msg_type, payload):
+        """Record received frame. Partial 1-bit images are applied to the last ONE_BIT_IMAGE, see Omnia1BitDisplay.
+        Delta frames are applied to the last frame of their type, see OmniaDisplay.setDeltaMode().
+
+        :param msg_type: type of the frame
+        :type msg_type: str
+        :param payload: frame
+        :type payload: bytes-like object
+        """
+        frame = bytes(payload)
+
+        if self.frames.maxlen:
+            self.frames.append((time.perf_counter(), msg_type, frame))
+
+        if msg_type == self.DELTA_FRAME:
+            self.__applyDelta(frame)
+            return
+
+        if msg_type != self.PARTIAL_ONE_BIT_IMAGE:
+            self.last_frame[msg_type] = frame
+            return
+        
+        if self.one_bit_width is None or self.ONE_BIT_IMAGE not in self.last_frame:
+            self.log.warning("Partial image received before the full one")
+            return
+        
+        first_page, n_pages, first_col, n_cols = Omnia1BitDisplay.PARTIAL_HEADER.unpack_from(frame)
+        row_bytes = (self.one_bit_width + 7) // 8
+        first_row = first_page * Omnia1BitDisplay.PAGE_HEIGHT
+
+        image = bytearray(self.last_frame[self.ONE_BIT_IMAGE])
+        data = frame[Omnia1BitDisplay.PARTIAL_HEADER.size:]
+
+        # last page has fewer rows if the height is not a multiple of PAGE_HEIGHT
+        for i in range(min(n_pages * Omnia1BitDisplay.PAGE_HEIGHT, len(data) // n_cols)):
+            start = (first_row + i) * row_bytes + first_col
+            image[start : start + n_cols] = data[i * n_cols : (i + 1) * n_cols]
+        
+        self.last_frame[self.ONE_BIT_IMAGE] = bytes(image)
+
+    def __applyDelta(self, frame):
+        """Paste the tiles of a delta frame on the last frame of its type, stored again as PNG (lossless)
+
+        :param frame: DELTA_FRAME message
+        :type frame: bytes
+        """
+        b_msg_type, tile_size, n_tiles = OmniaDisplay.DELTA_HEADER.unpack_from(frame)
+        msg_type = b_msg_type.decode()
+
+        if msg_type not in self.last_frame:
+            self.log.warning("Delta frame received before the full one")
+            return
+
+        image = Image.open(io.BytesIO(self.last_frame[msg_type]))
+        image.load()
+
+        offset = OmniaDisplay.DELTA_HEADER.size
+        for _ in range(n_tiles):
+            x, y, length = OmniaDisplay.TILE_HEADER.unpack_from(frame, offset)
+            offset += OmniaDisplay.TILE_HEADER.size
+
+            image.paste(Image.open(io.BytesIO(frame[offset : offset + length])), (x, y))
+            offset += length
+        
+        f = io.BytesIO()
+        image.save(f, "png")
+        self.last_frame[msg_type] = f.getvalue()
+
+    def __unpackParams(self, payload, msg_type):
+        """Unpack parameters of a list message, packed or as "<param1>-<param2>-..." depending on the protocol version
+
+        :param payload: message without its type
+        :type payload: memoryview
+        :param msg_type: type of the message
+        :type msg_type: str
+        :return: parameters
+        :rtype: list
+        """
+        if self.protocol_version >= OmniaProtocol.BINARY_PARAMS_VERSION and msg_type in self.PARAMS_STRUCTS:
+            for params_struct in self.PARAMS_STRUCTS[msg_type]:
+                if params_struct.size == len(payload):
+                    return list(params_struct.unpack(payload))
+            return [ 0 ]
+
+        return [ int(p) for p in bytes(payload).split(b'-') ]
+
+    ### END RECEIVE ###
+
+    def getStats(self):
+        """Get statistics of the client
+
+        :return: {
+                    "name": <client name>,
+                    "type": <"user" or "device">,
+                    "connected": <True if it connected to the manager>,
+                    "closed": <True if the connection was closed>,
+                    "uptime": <seconds since connection>,
+                    "received": {msg_type: messages},
+                    "received_bytes": {msg_type: bytes},
+                    "sent": {msg_type: messages},
+                    "frames": <frames received>,
+                    "fps": <frames per second since connection>
+                }
+        :rtype: dict
+        """
+        uptime = time.perf_counter() - self.connected_time if self.connected_time else 0.0
+        frames = sum(self.received[t] for t in self.FRAME_TYPES)
+
+        return {
+            "name": self.name,
+            "type": self.client_type,
+            "connected": self.connected_time is not None,
+            "closed": self.closed,
+            "uptime": uptime,
+            "received": dict(self.received),
+            "received_bytes": dict(self.received_bytes),
+            "sent": dict(self.sent),
+            "frames": frames,
+            "fps": frames / uptime if uptime > 0 else 0.0,
+        }
+
+# ---------------------------------------------------- #
+
+class OmniaSimulatorFleet:
+    """Fleet of simulated clients, using the MAC addresses registered in users.json and devices.json
+    """
+
+    def __init__(self, address, port, users_json_path, devices_json_path, n_users=None, n_devices=None, **client_options):
+        """Initialization
+
+        :param address: manager IP address
+        :type address: str
+        :param port: manager port
+        :type port: int
+        :param users_json_path: registered users, same file passed to OmniaManager
+        :type users_json_path: str
+        :param devices_json_path: registered devices, same file passed to OmniaManager
+        :type devices_json_path: str
+        :param n_users: number of simulated users, None for all registered users, defaults to None
+        :type n_users: int, optional
+        :param n_devices: number of simulated devices, None for all registered devices, defaults to None
+        :type n_devices: int, optional
+        :param client_options: other OmniaSimulatedClient parameters
+        """
+
+        with open(users_json_path, "r") as j:
+            users = json.load(j)
+
+        with open(devices_json_path, "r") as j:
+            devices = json.load(j)
+
+        ### Log ###
+        self.log = logging.getLogger("OmniaSimulatorFleet")
+        ### --- ###
+
+        # manager keeps one client per MAC address, so there can't be more clients than registered ones
+        users = list(users.items())[:n_users]
+        devices = list(devices.items())[:n_devices]
+
+        if (n_users or 0) > len(users) or (n_devices or 0) > len(devices):
+            self.log.warning("Only {} users and {} devices are registered".format(len(users), len(devices)))
+
+        client_options.setdefault("ble_ids", [ u["uid"] for _, u in users if u["uid"] ])
+
+        ### Clients ###
+        self.clients = [
+            OmniaSimulatedClient(mac, dict(data), "user", address, port, **client_options) for mac, data in users
+        ] + [
+            OmniaSimulatedClient(mac, dict(data), "device", address, port, **client_options) for mac, data in devices
+        ]
+        ### --- ###
+
+    async def run(self, duration=None, ramp=0.0):
+        """Connect all clients, one every ramp / len(clients) seconds, and run them for duration seconds
+
+        :param duration: seconds before disconnecting, None to run forever, defaults to None
+        :type duration: float, optional
+        :param ramp: seconds to connect all clients, defaults to 0.0
+        :type ramp: float, optional
+        """
+        delay = ramp / len(self.clients) if self.clients else 0.0
+
+        async with curio.TaskGroup() as g:
+            for client in self.clients:
+                await g.spawn(client.run, duration)
+                await curio.sleep(delay)
+
+    def getStats(self):
+        """Get statistics of all clients
+
+        :return: {
+                    "clients": <number of clients>,
+                    "connected": <clients that connected to the manager>,
+                    "received": {msg_type: messages},
+                    "received_bytes": {msg_type: bytes},
+                    "sent": {msg_type: messages},
+                    "frames": <frames received>,
+                    "fps": <frames per second, sum of all clients>,
+                    "per_client": [ <OmniaSimulatedClient.getStats()>, ... ]
+                }
+        :rtype: dict
+        """
+        per_client = [ c.getStats() for c in self.clients ]
+
+        received = collections.Counter()
+        received_bytes = collections.Counter()
+        sent = collections.Counter()
+        for s in per_client:
+            received.update(s["received"])
+            received_bytes.update(s["received_bytes"])
+            sent.update(s["sent"])
+
+        return {
+            "clients": len(per_client),
+            "connected": sum(s["connected"] for s in per_client),
+            "received": dict(received),
+            "received_bytes": dict(received_bytes),
+            "sent": dict(sent),
+            "frames": sum(s["frames"] for s in per_client),
+            "fps": sum(s["fps"] for s in per_client),
+            "per_client": per_client,
+        }
+
+    def printStats(self, file=sys.stdout):
+        """Print statistics of all clients
+
+        :param file: where to print, defaults to sys.stdout
+        :type file: file object, optional
+        """
+        stats = self.getStats()
+
+        print("{:<16} {:<7} {:>9} {:>8} {:>8} {:>12} {:>8} {:>8}".format(
+            "client", "type", "uptime", "frames", "fps", "recv bytes", "latency", "events"), file=file)
+
+        for s in stats["per_client"]:
+            events = sum(n for t, n in s["sent"].items() if t not in (OmniaMessageTypes.LATENCY, OmniaMessageTypes.PROTOCOL_SETUP))
+            print("{:<16} {:<7} {:>8.1f}s {:>8} {:>8.2f} {:>12} {:>8} {:>8}".format(
+                s["name"], s["type"], s["uptime"], s["frames"], s["fps"],
+                sum(s["received_bytes"].values()), s["received"].get(OmniaMessageTypes.LATENCY, 0), events), file=file)
+
+        print("connected: {}/{}, frames: {} ({:.2f} fps), received: {}, sent: {}".format(
+            stats["connected"], stats["clients"], stats["frames"], stats["fps"], stats["received"], stats["sent"]), file=file)
+
+    def saveFrames(self, directory):
+        """Save last frame received by each client, as "<client name>_<msg_type>.bin"
+
+        :param directory: destination directory
+        :type directory: str
+        """
+        os.makedirs(directory, exist_ok=True)
+
+        for client in self.clients:
+            for msg_type, frame in client.last_frame.items():
+                with open(os.path.join(directory, "{}_{}.bin".format(client.name, msg_type)), "wb") as f:
+                    f.write(frame)
+
+# ---------------------------------------------------- #
+
+def runManager(address, port, users_json_path, devices_json_path, authorizations_json_path):
+    """Run OmniaManager, in a separate process
+
+    :param address: manager IP address
+    :type address: str
+    :param port: manager port
+    :type port: int
+    :param users_json_path: registered users
+    :type users_json_path: str
+    :param devices_json_path: registered devices
+    :type devices_json_path: str
+    :param authorizations_json_path: authorizations
+    :type authorizations_json_path: str
+    """
+    from manager.omniaManager import OmniaManager
+
+    OmniaManager(address, port, users_json_path, devices_json_path, authorizations_json_path).startManager()
+
+def main():
+    parser = argparse.ArgumentParser(description="Connect simulated users and devices to OmniaManager")
+    parser.add_argument("--address", default="127.0.0.1", help="manager IP address")
+    parser.add_argument("--port", type=int, default=50500, help="manager port")
+    parser.add_argument("--users-json", default="users/users.json")
+    parser.add_argument("--devices-json", default="devices/devices.json")
+    parser.add_argument("--authorizations-json", default="authorizations/authorizations.json")
+    parser.add_argument("--manager", action="store_true", help="start OmniaManager in a separate process")
+    parser.add_argument("--users", type=int, default=None, help="simulated users (default: all registered)")
+    parser.add_argument("--devices", type=int, default=None, help="simulated devices (default: all registered)")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds to run")
+    parser.add_argument("--ramp", type=float, default=0.0, help="seconds to connect all clients")
+    parser.add_argument("--button-rate", type=float, default=1.0, help="button bitmasks per second")
+    parser.add_argument("--ble-rate", type=float, default=1.0, help="BLE scans per second")
+    parser.add_argument("--touch-rate", type=float, default=1.0, help="touch events per second")
+    parser.add_argument("--features", type=int, default=OmniaProtocol.SUPPORTED_FEATURES, help="features bitmask requested")
+    parser.add_argument("--protocol-version", type=int, default=OmniaProtocol.PROTOCOL_VERSION)
+    parser.add_argument("--legacy", action="store_true", help="don't negotiate, behave as old firmware")
+    parser.add_argument("--record-frames", type=int, default=0, help="last frames kept by each client")
+    parser.add_argument("--record-dir", default=None, help="save last frame of each client in this directory")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.INFO,
+        format='%(name)s: %(message)s',
+        stream=sys.stderr,
+    )
+
+    manager = None
+    if args.manager:
+        manager = multiprocessing.Process(target=runManager, daemon=True,
+            args=(args.address, args.port, args.users_json, args.devices_json, args.authorizations_json))
+        manager.start()
+        time.sleep(1)   # wait for the server to listen
+
+    fleet = OmniaSimulatorFleet(
+        args.address, args.port, args.users_json, args.devices_json, args.users, args.devices,
+        features=0 if args.legacy else args.features,
+        protocol_version=OmniaProtocol.TEXT_PARAMS_VERSION if args.legacy else args.protocol_version,
+        button_rate=args.button_rate, ble_rate=args.ble_rate, touch_rate=args.touch_rate,
+        record_frames=args.record_frames,
+    )
+
+    curio.run(fleet.run, args.duration, args.ramp)
+
+    fleet.printStats()
+
+    if args.record_dir:
+        fleet.saveFrames(args.record_dir)
+
+    if manager:
+        manager.terminate()
+
+if __name__ == "__main__":
+    main()
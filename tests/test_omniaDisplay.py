@@ -0,0 +1,245 @@
+import io
+import unittest
+import curio
+from PIL                         import Image, ImageDraw
+
+### Omnia libraries ###
+from core.omniaProtocol          import OmniaProtocol
+from core.omniaMessageTypes      import OmniaMessageTypes as OMT
+from modules.omniaDisplay        import OmniaDisplay, Omnia1BitDisplay, OmniaILI9341Display
+from modules.omniaEncoder        import OmniaEncoder
+### --- ###
+
+"""Tests of OmniaDisplay and its subclasses, run from the repository root:
+    python -m unittest discover tests
+"""
+
+class FakeProtocol:
+    """OmniaProtocol used by displays, recording the messages sent
+    """
+
+    FEATURE_PARTIAL_IMAGE = OmniaProtocol.FEATURE_PARTIAL_IMAGE
+    FEATURE_DELTA_FRAME = OmniaProtocol.FEATURE_DELTA_FRAME
+    SEND_BLOCK = OmniaProtocol.SEND_BLOCK
+
+    def __init__(self, features=0):
+        self.client_info = {"name": "test"}
+        self.features = features
+        self.session = 1
+        self.send_policies = {}
+        self.sent = []  # (msg_type, bytes)
+
+    async def send(self, message, msg_type):
+        self.sent.append((msg_type, message if isinstance(message, list) else bytes(message)))
+
+    def hasFeature(self, feature):
+        return bool(self.features & feature)
+
+    def getSession(self):
+        return self.session
+
+    def setSendPolicy(self, msg_type, policy):
+        self.send_policies[msg_type] = policy
+
+class Omnia1BitDisplayTest(unittest.TestCase):
+
+    WIDTH = 128
+    HEIGHT = 64
+
+    def setUp(self):
+        self.protocol = FakeProtocol(OmniaProtocol.FEATURE_PARTIAL_IMAGE)
+        self.display = Omnia1BitDisplay(self.protocol, (self.WIDTH, self.HEIGHT), {"contrast": False, "rotation": False})
+
+    def draw(self, box):
+        """Draw a white rectangle and send the image, returning the messages sent
+
+        :return: (msg_type, payload) of the messages sent
+        :rtype: list
+        """
+        if box:
+            self.display.image_draw.rectangle(box, fill=255)
+        
+        self.display.img_is_new = True
+        self.protocol.sent.clear()
+
+        curio.run(self.display.sendDisplay)
+
+        return self.protocol.sent
+
+    def test_first_image_is_sent_entirely(self):
+        sent = self.draw((0, 0, 7, 7))
+
+        self.assertEqual([ t for t, _ in sent ], [ OMT.ONE_BIT_IMAGE ])
+        self.assertEqual(len(sent[0][1]), self.WIDTH * self.HEIGHT // 8)
+
+    def test_changed_pages_and_columns_are_sent(self):
+        self.draw(None)
+        sent = self.draw((20, 10, 27, 12))  # page 1, byte columns 2 and 3
+
+        self.assertEqual([ t for t, _ in sent ], [ OMT.PARTIAL_ONE_BIT_IMAGE ])
+
+        payload = sent[0][1]
+        header = Omnia1BitDisplay.PARTIAL_HEADER
+
+        self.assertEqual(header.unpack_from(payload), (1, 1, 2, 2))
+        self.assertEqual(len(payload), header.size + Omnia1BitDisplay.PAGE_HEIGHT * 2)
+
+        rows = [ payload[header.size + 2 * i : header.size + 2 * (i + 1)] for i in range(Omnia1BitDisplay.PAGE_HEIGHT) ]
+
+        self.assertEqual(rows, [ b'\x00\x00' ] * 2 + [ b'\x0f\xf0' ] * 3 + [ b'\x00\x00' ] * 3)  # rows 8 to 15, pixels 20 to 27
+
+    def test_unchanged_image_is_not_sent(self):
+        self.draw((0, 0, 7, 7))
+
+        self.assertEqual(self.draw(None), [])
+
+    def test_big_change_is_sent_entirely(self):
+        self.draw(None)
+
+        sent = self.draw((0, 0, self.WIDTH - 1, self.HEIGHT - 1))
+
+        self.assertEqual([ t for t, _ in sent ], [ OMT.ONE_BIT_IMAGE ])
+
+    def test_full_images_without_partial_image_feature(self):
+        self.protocol.features = 0
+        self.draw(None)
+
+        sent = self.draw((20, 10, 27, 12))
+
+        self.assertEqual([ t for t, _ in sent ], [ OMT.ONE_BIT_IMAGE ])
+
+    def test_new_session_sends_full_image(self):
+        self.draw(None)
+        self.protocol.session += 1  # resumed, or PROTOCOL_SETUP negotiated again
+
+        sent = self.draw((20, 10, 27, 12))
+
+        self.assertEqual([ t for t, _ in sent ], [ OMT.ONE_BIT_IMAGE ])
+
+class DeltaFrameTest(unittest.TestCase):
+
+    WIDTH = 128
+    HEIGHT = 96
+
+    def setUp(self):
+        self.protocol = FakeProtocol(OmniaProtocol.FEATURE_DELTA_FRAME)
+        self.display = OmniaDisplay(self.protocol, (self.WIDTH, self.HEIGHT), image_mode="RGB")
+        self.display.setEncoder(OmniaEncoder(OmniaEncoder.INLINE))
+        self.display.setDeltaMode(True)
+
+        self.frame = Image.new("RGB", (self.WIDTH, self.HEIGHT))
+
+    def send(self, box=None, damage=None):
+        """Draw a white rectangle on the frame and send a copy, returning the messages sent
+
+        :return: (msg_type, payload) of the messages sent
+        :rtype: list
+        """
+        if box:
+            ImageDraw.Draw(self.frame).rectangle(box, fill=(255, 255, 255))
+        
+        self.protocol.sent.clear()
+
+        async def send():
+            await self.display.submitImage(self.frame.copy(), 'png', OMT.RGBA_IMAGE, damage)
+
+            while self.display.in_flight:
+                await curio.sleep(0.001)
+        
+        curio.run(send)
+
+        return self.protocol.sent
+
+    def getTiles(self, payload):
+        """Split a DELTA_FRAME message
+
+        :return: (type of the frame, tile size, {(x, y): decoded tile})
+        :rtype: tuple
+        """
+        msg_type, tile_size, n_tiles = OmniaDisplay.DELTA_HEADER.unpack_from(payload)
+        offset = OmniaDisplay.DELTA_HEADER.size
+        tiles = {}
+
+        for _ in range(n_tiles):
+            x, y, length = OmniaDisplay.TILE_HEADER.unpack_from(payload, offset)
+            offset += OmniaDisplay.TILE_HEADER.size
+
+            tiles[(x, y)] = Image.open(io.BytesIO(payload[offset : offset + length])).convert("RGB")
+            offset += length
+        
+        self.assertEqual(offset, len(payload))
+
+        return msg_type.decode(), tile_size, tiles
+
+    def test_changed_tiles_are_sent(self):
+        self.send()
+        sent = self.send((40, 40, 49, 49))
+
+        self.assertEqual([ t for t, _ in sent ], [ OMT.DELTA_FRAME ])
+
+        msg_type, tile_size, tiles = self.getTiles(sent[0][1])
+
+        self.assertEqual((msg_type, tile_size), (OMT.RGBA_IMAGE, OmniaDisplay.TILE_SIZE))
+        self.assertEqual(list(tiles), [ (32, 32) ])
+        self.assertEqual(tiles[(32, 32)].tobytes(), self.frame.crop((32, 32, 64, 64)).tobytes())
+
+    def test_damage_selects_tiles(self):
+        self.send()
+        sent = self.send((40, 40, 49, 49), damage=[ (40, 40, 50, 50), (100, 0, 110, 10) ])
+
+        msg_type, tile_size, tiles = self.getTiles(sent[0][1])
+
+        self.assertEqual(sorted(tiles), [ (32, 32), (96, 0) ])
+
+    def test_unchanged_frame_is_not_sent(self):
+        self.send()
+
+        self.assertEqual(self.send(), [])
+        self.assertEqual(self.display.unchanged_frames, 1)
+
+    def test_new_session_sends_keyframe(self):
+        self.send()
+        self.protocol.session += 1  # the client lost the reference frame
+
+        sent = self.send((40, 40, 49, 49))
+
+        self.assertEqual([ t for t, _ in sent ], [ OMT.RGBA_IMAGE ])
+        self.assertEqual(self.display.keyframes, 2)
+
+    def test_full_frames_without_delta_frame_feature(self):
+        self.protocol.features = 0
+        self.send()
+
+        sent = self.send((40, 40, 49, 49))
+
+        self.assertEqual([ t for t, _ in sent ], [ OMT.RGBA_IMAGE ])
+
+    def test_send_policies_are_blocking_in_delta_mode(self):
+        self.assertEqual(self.protocol.send_policies, { msg_type: OmniaProtocol.SEND_BLOCK for msg_type in OmniaDisplay.DELTA_TYPES })
+
+class OmniaILI9341DisplayTest(unittest.TestCase):
+
+    def test_generation_is_sent_again_after_new_session(self):
+        protocol = FakeProtocol()
+        display = OmniaILI9341Display(protocol, (64, 48))
+        display.setEncoder(OmniaEncoder(OmniaEncoder.INLINE))
+
+        async def send(generation):
+            await display.sendDisplay('png', generation)
+
+            while display.in_flight:
+                await curio.sleep(0.001)
+        
+        curio.run(send, 1)
+        curio.run(send, 1)
+
+        self.assertEqual((display.rendered_frames, display.suppressed_frames), (1, 1))
+
+        protocol.session += 1
+        curio.run(send, 1)
+
+        self.assertEqual(display.rendered_frames, 2)
+        self.assertEqual([ t for t, _ in protocol.sent ], [ OMT.RGBA_IMAGE ] * 2)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import unittest
+
+### Omnia libraries ###
+from core.omniaLatency           import OmniaLatencyStats
+### --- ###
+
+"""Tests of OmniaLatencyStats, run from the repository root:
+    python -m unittest discover tests
+"""
+
+class OmniaLatencyStatsTest(unittest.TestCase):
+
+    def test_no_samples(self):
+        stats = OmniaLatencyStats().getStats()
+
+        self.assertEqual(stats, {"last": 0.0, "ewma": 0.0, "min": 0.0, "p50": 0.0, "p95": 0.0, "p99": 0.0, "jitter": 0.0, "samples": 0})
+
+    def test_ewma_and_jitter(self):
+        latency_stats = OmniaLatencyStats(ewma_weight=0.125, jitter_weight=0.0625)
+
+        latency_stats.addSample(10.0)   # the first sample is the average, without variation
+
+        self.assertEqual(latency_stats.ewma, 10.0)
+        self.assertEqual(latency_stats.jitter, 0.0)
+
+        latency_stats.addSample(18.0)
+
+        self.assertEqual(latency_stats.ewma, 11.0)
+        self.assertEqual(latency_stats.jitter, 0.5)
+        self.assertEqual(latency_stats.last, 18.0)
+
+    def test_percentiles(self):
+        latency_stats = OmniaLatencyStats(size=100)
+
+        for rtt in reversed(range(1, 101)):
+            latency_stats.addSample(float(rtt))
+
+        stats = latency_stats.getStats()
+
+        self.assertEqual((stats["min"], stats["p50"], stats["p95"], stats["p99"]), (1.0, 50.0, 95.0, 99.0))
+        self.assertEqual(latency_stats.getPercentile(100), 100.0)
+
+    def test_ring_keeps_last_samples(self):
+        latency_stats = OmniaLatencyStats(size=4)
+
+        for rtt in range(1, 11):
+            latency_stats.addSample(float(rtt))
+
+        stats = latency_stats.getStats()
+
+        self.assertEqual(stats["min"], 7.0)
+        self.assertEqual(stats["samples"], 10)
+
+if __name__ == "__main__":
+    unittest.main()
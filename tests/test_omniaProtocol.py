@@ -0,0 +1,567 @@
+import socket
+import unittest
+import curio
+
+### Omnia libraries ###
+from core.omniaProtocol          import OmniaProtocol
+### --- ###
+
+"""Tests of OmniaProtocol, run from the repository root:
+    python -m unittest discover tests
+"""
+
+class RecordingStream:
+    """Stand-in for curio.io.SocketStream without a raw socket, so that OmniaProtocol joins buffers and calls write(),
+    recording every write. Writes wait while blocked is True and raise error if it's set
+    """
+
+    def __init__(self):
+        self.writes = []    # data of every write() call
+        self.blocked = False
+        self.error = None
+
+    async def write(self, data):
+        while self.blocked:
+            await curio.sleep(0.001)
+
+        if self.error:
+            raise self.error
+
+        self.writes.append(bytes(data))
+
+    async def readline(self):
+        await curio.sleep(3600)
+
+    async def flush(self):
+        pass
+
+    async def close(self):
+        pass
+
+    def getMessages(self):
+        """Split what was written in messages
+
+        :return: list of (msg_type, payload)
+        :rtype: list
+        """
+        data = b''.join(self.writes)
+        messages = []
+
+        while data:
+            length, = OmniaProtocol.HEADER.unpack_from(data)
+            message = data[OmniaProtocol.HEADER.size : OmniaProtocol.HEADER.size + length]
+            messages.append((chr(message[0]), message[1:]))
+            data = data[OmniaProtocol.HEADER.size + length:]
+
+        return messages
+
+class OmniaProtocolTestCase(unittest.TestCase):
+    """Runs a test coroutine in a curio kernel, with OmniaProtocol on one end of a socket pair and the client on the other
+    """
+
+    def runProtocol(self, test, features=0, protocol_version=OmniaProtocol.TEXT_PARAMS_VERSION, recv=True):
+        """Run test(protocol, client)
+
+        :param test: coroutine function, awaited with the OmniaProtocol and the client socket (curio.io.Socket)
+        :type test: coroutine function
+        :param features: features of the client, as if negotiated, defaults to 0
+        :type features: int, optional
+        :param protocol_version: protocol version of the client, defaults to TEXT_PARAMS_VERSION
+        :type protocol_version: int, optional
+        :param recv: True to start the receive task, defaults to True
+        :type recv: bool, optional
+        """
+        async def main():
+            server_socket, client_socket = socket.socketpair()
+            client = curio.io.Socket(client_socket)
+
+            protocol = OmniaProtocol(curio.io.Socket(server_socket).as_stream(), {
+                "name": "test",
+                "type": "device",
+                "features": features,
+                "protocol_version": protocol_version,
+            })
+
+            if recv:
+                protocol.recv_task = await protocol.taskGroup.spawn(protocol.recv)
+
+            try:
+                await curio.timeout_after(5, test, protocol, client)
+            finally:
+                await protocol.taskGroup.cancel_remaining()
+                await protocol.socket.close()
+                await client.close()
+
+        curio.run(main)
+
+    def runStream(self, test, features=0, protocol_version=OmniaProtocol.TEXT_PARAMS_VERSION):
+        """Run test(protocol, stream), with OmniaProtocol writing to a RecordingStream
+
+        :param test: coroutine function, awaited with the OmniaProtocol and the stream
+        :type test: coroutine function
+        :param features: features of the client, as if negotiated, defaults to 0
+        :type features: int, optional
+        :param protocol_version: protocol version of the client, defaults to TEXT_PARAMS_VERSION
+        :type protocol_version: int, optional
+        """
+        async def main():
+            stream = RecordingStream()
+
+            protocol = OmniaProtocol(stream, {
+                "name": "test",
+                "type": "device",
+                "features": features,
+                "protocol_version": protocol_version,
+            })
+
+            try:
+                await curio.timeout_after(5, test, protocol, stream)
+            finally:
+                await protocol.taskGroup.cancel_remaining()
+
+        curio.run(main)
+
+    async def readMessage(self, client):
+        """Read a message sent by OmniaProtocol
+
+        :return: (msg_type, payload)
+        :rtype: tuple
+        """
+        header = await self.readExactly(client, OmniaProtocol.HEADER.size)
+        length, = OmniaProtocol.HEADER.unpack(header)
+        data = await self.readExactly(client, length)
+
+        return chr(data[0]), data[1:]
+
+    async def readExactly(self, client, n):
+        """Read n bytes from the client socket
+
+        :return: data, shorter if the connection was closed
+        :rtype: bytes
+        """
+        data = b''
+
+        while len(data) < n:
+            chunk = await client.recv(n - len(data))
+            if not chunk:
+                break
+            data += chunk
+
+        return data
+
+    async def waitFor(self, condition, timeout=1.0):
+        """Yield to the other tasks until condition() is true
+
+        :return: True if condition() became true before timeout
+        :rtype: bool
+        """
+        deadline = await curio.clock() + timeout
+
+        while not condition():
+            if await curio.clock() > deadline:
+                return False
+            await curio.sleep(0.001)
+
+        return True
+
+class ReceiveTest(OmniaProtocolTestCase):
+
+    def receive(self, features, data):
+        """Send data from the client and collect the TOUCHSCREEN messages received
+
+        :return: payloads, in order
+        :rtype: list of bytes
+        """
+        received = []
+
+        async def test(protocol, client):
+            async def callback(message):
+                received.append(bytes(message))
+
+            protocol.registerReceiveCallback(callback, OmniaProtocol.TOUCHSCREEN)
+
+            await client.sendall(data)
+            await self.waitFor(lambda: len(received) == 2)
+
+        self.runProtocol(test, features=features)
+
+        return received
+
+    def test_line_messages(self):
+        received = self.receive(0, b"t10,20\nt30,40\n")
+
+        self.assertEqual(received, [b"10,20", b"30,40"])
+
+    def test_framed_messages_can_contain_new_lines(self):
+        framed = b''.join(OmniaProtocol.MSG_HEADER.pack(len(m) + 1, b't') + m for m in (b"1\n2", b"\n\x00\n"))
+
+        received = self.receive(OmniaProtocol.FEATURE_FRAMED_RECV, framed)
+
+        self.assertEqual(received, [b"1\n2", b"\n\x00\n"])
+
+    def test_oversized_frame_closes_connection(self):
+        async def test(protocol, client):
+            await client.sendall(OmniaProtocol.HEADER.pack(OmniaProtocol.MAX_RECV_SIZE + 1))
+
+            self.assertTrue(await self.waitFor(lambda: not protocol.alive))
+            self.assertEqual(await client.recv(1), b'')     # closed, nothing allocated nor read
+
+        self.runProtocol(test, features=OmniaProtocol.FEATURE_FRAMED_RECV)
+
+    def test_closed_connection_drops_sends(self):
+        async def test(protocol, client):
+            await client.close()
+
+            self.assertTrue(await self.waitFor(lambda: not protocol.alive))
+            self.assertIsNone(protocol.send_task)
+            self.assertIsNone(protocol.latency_task)
+
+            await protocol.send(b'frame', OmniaProtocol.VIDEO_FRAME)
+
+            self.assertEqual(protocol.getSendStats(OmniaProtocol.VIDEO_FRAME)["dropped"], 1)
+            self.assertFalse(protocol.isSending())
+
+        self.runProtocol(test)
+
+class NegotiationTest(OmniaProtocolTestCase):
+
+    def test_protocol_setup_enables_features(self):
+        async def test(protocol, client):
+            features = OmniaProtocol.FEATURE_FRAMED_RECV | OmniaProtocol.FEATURE_PARTIAL_IMAGE
+            await client.sendall("p{}-{}\n".format(features, OmniaProtocol.PROTOCOL_VERSION).encode())
+
+            msg_type, answer = await self.readMessage(client)
+
+            self.assertEqual(msg_type, OmniaProtocol.PROTOCOL_SETUP)
+            self.assertEqual(answer, "{}-{}".format(features, OmniaProtocol.PROTOCOL_VERSION).encode())
+            self.assertEqual(protocol.recv_mode, OmniaProtocol.RECV_FRAMED)
+            self.assertTrue(protocol.hasFeature(OmniaProtocol.FEATURE_PARTIAL_IMAGE))
+            self.assertFalse(protocol.hasFeature(OmniaProtocol.FEATURE_DELTA_FRAME))
+            self.assertEqual(protocol.getProtocolVersion(), OmniaProtocol.BINARY_PARAMS_VERSION)
+
+        self.runProtocol(test)
+
+    def test_unsupported_features_and_versions_are_not_enabled(self):
+        async def test(protocol, client):
+            await client.sendall(b"p65535-99\n")
+
+            msg_type, answer = await self.readMessage(client)
+
+            self.assertEqual(answer, "{}-{}".format(OmniaProtocol.SUPPORTED_FEATURES, OmniaProtocol.PROTOCOL_VERSION).encode())
+
+        self.runProtocol(test)
+
+    def test_legacy_setup_answer_has_no_version(self):
+        async def test(protocol, client):
+            await client.sendall(b"p0\n")
+
+            msg_type, answer = await self.readMessage(client)
+
+            self.assertEqual(answer, b"0")
+            self.assertEqual(protocol.recv_mode, OmniaProtocol.RECV_LINE)
+            self.assertEqual(protocol.getProtocolVersion(), OmniaProtocol.TEXT_PARAMS_VERSION)
+
+        self.runProtocol(test)
+
+    def test_protocol_setup_starts_new_session(self):
+        async def test(protocol, client):
+            session = protocol.getSession()
+
+            await client.sendall(b"p1\n")
+            await self.readMessage(client)
+
+            self.assertGreater(protocol.getSession(), session)
+
+        self.runProtocol(test)
+
+class SendQueueTest(OmniaProtocolTestCase):
+
+    def test_small_messages_are_coalesced_in_order(self):
+        async def test(protocol, stream):
+            for i in range(10):
+                await protocol.send(str(i).encode(), OmniaProtocol.LATENCY)
+
+            await self.waitFor(lambda: not protocol.isSending())
+
+            self.assertEqual(len(stream.writes), 1)
+            self.assertEqual(stream.getMessages(), [ (OmniaProtocol.LATENCY, str(i).encode()) for i in range(10) ])
+
+        self.runStream(test)
+
+    def test_big_messages_are_not_coalesced(self):
+        async def test(protocol, stream):
+            for i in range(3):
+                await protocol.send(bytes([i]) * OmniaProtocol.COALESCE_SIZE, OmniaProtocol.ONE_BIT_IMAGE)
+
+            await self.waitFor(lambda: not protocol.isSending())
+
+            self.assertEqual(len(stream.writes), 3)
+
+        self.runStream(test)
+
+    def test_full_queue_blocks_sender(self):
+        async def test(protocol, stream):
+            protocol.setSendQueueSize(2)
+            stream.blocked = True
+
+            await protocol.send([ 0 ], OmniaProtocol.INPUT_PIN)
+            await curio.sleep(0.01)     # the first message is being written, the next ones wait in the queue
+
+            for i in (1, 2):
+                await protocol.send([ i ], OmniaProtocol.INPUT_PIN)
+
+            blocked_send = await curio.spawn(protocol.send, [ 3 ], OmniaProtocol.INPUT_PIN)
+            await curio.sleep(0.01)
+
+            self.assertFalse(blocked_send.terminated)
+            self.assertEqual(protocol.getSendQueueDepth(), 2)
+
+            stream.blocked = False
+            await blocked_send.join()
+            await self.waitFor(lambda: not protocol.isSending())
+
+            self.assertEqual([ p for _, p in stream.getMessages() ], [ str(i).encode() for i in range(4) ])
+            self.assertEqual(protocol.getSendStats(OmniaProtocol.INPUT_PIN)["dropped"], 0)
+
+        self.runStream(test)
+
+    def test_write_error_closes_connection_once(self):
+        async def test(protocol, stream):
+            stream.error = BrokenPipeError(32, "Broken pipe")
+
+            for i in range(5):
+                await protocol.send(b'x' * OmniaProtocol.COALESCE_SIZE, OmniaProtocol.RGBA_IMAGE)
+                await curio.sleep(0.01)
+
+            self.assertFalse(protocol.alive)
+            self.assertIsNone(protocol.send_task)
+            self.assertFalse(protocol.isSending())
+            self.assertEqual(protocol.getSendStats(OmniaProtocol.RGBA_IMAGE), {"messages": 0, "bytes": 0, "copied": 0, "dropped": 4})
+
+        self.runStream(test)
+
+class PriorityTest(OmniaProtocolTestCase):
+
+    def sendFrames(self, protocol, stream, msg_type, frames):
+        """Send frames while the first one is being written, with room for 2 messages in the queue
+
+        :return: payloads written, in order
+        :rtype: list of bytes
+        """
+        async def send():
+            protocol.setSendQueueSize(2)
+            stream.blocked = True
+
+            await protocol.send(frames[0], msg_type)
+            await curio.sleep(0.01)     # the first frame is being written
+
+            for frame in frames[1:]:
+                await protocol.send(frame, msg_type)
+
+            stream.blocked = False
+            await self.waitFor(lambda: not protocol.isSending())
+
+            return [ p for _, p in stream.getMessages() ]
+
+        return send()
+
+    def test_control_messages_are_written_before_bulk(self):
+        async def test(protocol, stream):
+            await protocol.send(b'frame', OmniaProtocol.VIDEO_FRAME)
+            await protocol.send([ 1 ], OmniaProtocol.INPUT_PIN)
+
+            await self.waitFor(lambda: not protocol.isSending())
+
+            self.assertEqual([ t for t, _ in stream.getMessages() ], [ OmniaProtocol.INPUT_PIN, OmniaProtocol.VIDEO_FRAME ])
+
+        self.runStream(test)
+
+    def test_drop_oldest_keeps_last_frames(self):
+        async def test(protocol, stream):
+            frames = [ bytes([i]) * OmniaProtocol.COALESCE_SIZE for i in range(5) ]
+
+            written = await self.sendFrames(protocol, stream, OmniaProtocol.VIDEO_FRAME, frames)
+
+            self.assertEqual(written, [ frames[0], frames[3], frames[4] ])
+            self.assertEqual(protocol.getSendStats(OmniaProtocol.VIDEO_FRAME)["dropped"], 2)
+
+        self.runStream(test)
+
+    def test_drop_newest_keeps_first_frames(self):
+        async def test(protocol, stream):
+            protocol.setSendPolicy(OmniaProtocol.RGBA_IMAGE, OmniaProtocol.SEND_DROP_NEWEST)
+            frames = [ bytes([i]) * OmniaProtocol.COALESCE_SIZE for i in range(5) ]
+
+            written = await self.sendFrames(protocol, stream, OmniaProtocol.RGBA_IMAGE, frames)
+
+            self.assertEqual(written, frames[:3])
+            self.assertEqual(protocol.getSendStats(OmniaProtocol.RGBA_IMAGE)["dropped"], 2)
+
+        self.runStream(test)
+
+    def test_one_bit_images_are_never_dropped(self):
+        async def test(protocol, stream):
+            protocol.setSendPolicy(OmniaProtocol.ONE_BIT_IMAGE, OmniaProtocol.SEND_DROP_OLDEST)
+
+            self.assertEqual(protocol.send_policies.get(OmniaProtocol.ONE_BIT_IMAGE, OmniaProtocol.SEND_BLOCK), OmniaProtocol.SEND_BLOCK)
+
+        self.runStream(test)
+
+    def test_control_messages_are_written_between_chunks(self):
+        async def test(protocol, stream):
+            image = bytes(range(256)) * 40    # 10240 bytes: 3 chunks
+            stream.blocked = True
+
+            await protocol.send(image, OmniaProtocol.RGBA_IMAGE)
+            await curio.sleep(0.01)     # the first chunk is being written
+
+            await protocol.send([ 1 ], OmniaProtocol.INPUT_PIN)
+
+            stream.blocked = False
+            await self.waitFor(lambda: not protocol.isSending())
+
+            messages = stream.getMessages()
+
+            self.assertEqual([ t for t, _ in messages ], [ OmniaProtocol.CHUNK, OmniaProtocol.INPUT_PIN, OmniaProtocol.CHUNK, OmniaProtocol.CHUNK ])
+
+            chunks = [ p for t, p in messages if t == OmniaProtocol.CHUNK ]
+
+            self.assertEqual([ (chr(c[0]), c[1]) for c in chunks ], [ (OmniaProtocol.RGBA_IMAGE, 0), (OmniaProtocol.RGBA_IMAGE, 0), (OmniaProtocol.RGBA_IMAGE, 1) ])
+            self.assertEqual(b''.join(c[2:] for c in chunks), image)
+            self.assertEqual(protocol.getSendStats(OmniaProtocol.RGBA_IMAGE)["messages"], 1)
+
+        self.runStream(test, features=OmniaProtocol.FEATURE_CHUNKED_BULK)
+
+class ParamsTest(OmniaProtocolTestCase):
+
+    def sendParams(self, params, msg_type, protocol_version):
+        """Send a list message
+
+        :return: payloads written
+        :rtype: list of bytes
+        """
+        written = []
+
+        async def test(protocol, stream):
+            await protocol.send(params, msg_type)
+            await self.waitFor(lambda: not protocol.isSending())
+
+            written.extend(p for _, p in stream.getMessages())
+
+        self.runStream(test, protocol_version=protocol_version)
+
+        return written
+
+    def test_params_are_packed_for_binary_clients(self):
+        written = self.sendParams([ 21, 22, 128, 64, 1 ], OmniaProtocol.ONE_BIT_DISPLAY, OmniaProtocol.BINARY_PARAMS_VERSION)
+
+        self.assertEqual(written, [ bytes([21, 22, 0, 128, 0, 64, 1]) ])
+
+    def test_missing_params_are_not_packed(self):
+        written = self.sendParams([ 21, 22 ], OmniaProtocol.ONE_BIT_DISPLAY, OmniaProtocol.BINARY_PARAMS_VERSION)
+
+        self.assertEqual(written, [ bytes([21, 22]) ])
+
+    def test_params_are_text_for_legacy_clients(self):
+        written = self.sendParams([ 21, 22, 128, 64, 1 ], OmniaProtocol.ONE_BIT_DISPLAY, OmniaProtocol.TEXT_PARAMS_VERSION)
+
+        self.assertEqual(written, [ b"21-22-128-64-1" ])
+
+    def test_params_not_fitting_the_struct_are_dropped(self):
+        for params in ([ 21, 22, 128, 64, 1, 0 ], [ 300 ]):     # too many parameters, out of range
+            with self.subTest(params=params):
+                written = self.sendParams(params, OmniaProtocol.ONE_BIT_DISPLAY, OmniaProtocol.BINARY_PARAMS_VERSION)
+
+                self.assertEqual(written, [])
+
+class LatencyTest(OmniaProtocolTestCase):
+
+    async def echoLatency(self, client, n, framed=False):
+        """Echo n LATENCY messages, like clients do
+
+        :param framed: True to echo length-prefixed messages, defaults to False (lines)
+        :type framed: bool, optional
+        :return: payloads echoed
+        :rtype: list of bytes
+        """
+        echoed = []
+
+        while len(echoed) < n:
+            msg_type, payload = await self.readMessage(client)
+
+            if msg_type != OmniaProtocol.LATENCY:
+                continue
+
+            if framed:
+                await client.sendall(OmniaProtocol.MSG_HEADER.pack(len(payload) + 1, OmniaProtocol.LATENCY.encode()) + payload)
+            else:
+                await client.sendall(OmniaProtocol.LATENCY.encode() + payload + b"\n")
+
+            echoed.append(payload)
+
+        return echoed
+
+    def test_calculate_latency(self):
+        async def test(protocol, client):
+            results = []
+
+            await protocol.calculateLatency(iterations=5, callback=results.append)
+            echoed = await self.echoLatency(client, 5)
+
+            self.assertTrue(await self.waitFor(lambda: results))
+            self.assertEqual(echoed, [ str(i).encode() for i in range(5) ])     # sequence numbers, as text
+            self.assertGreater(results[0], 0.0)
+            self.assertEqual(protocol.getLatency(), results[0])
+            self.assertEqual(protocol.getLatencyStats()["samples"], 5)
+
+        self.runProtocol(test)
+
+    def test_packed_sequence_numbers(self):
+        async def test(protocol, client):
+            results = []
+
+            await protocol.calculateLatency(iterations=3, callback=results.append)
+            echoed = await self.echoLatency(client, 3, framed=True)
+
+            self.assertTrue(await self.waitFor(lambda: results))
+            self.assertEqual(echoed, [ OmniaProtocol.LATENCY_SEQ.pack(i) for i in range(3) ])
+            self.assertEqual(protocol.getLatencyStats()["samples"], 3)
+
+        self.runProtocol(test, features=OmniaProtocol.FEATURE_FRAMED_RECV)
+
+    def test_text_sequence_number_echoed_after_framed_setup(self):
+        async def test(protocol, client):
+            results = []
+
+            await protocol.calculateLatency(iterations=11, callback=results.append)
+            await self.echoLatency(client, 10)
+
+            # the 11th message, "10", is waiting for its echo: 2 bytes, like a packed sequence number
+            await client.sendall("p{}-{}\n".format(OmniaProtocol.FEATURE_FRAMED_RECV, OmniaProtocol.PROTOCOL_VERSION).encode())
+            echoed = await self.echoLatency(client, 1, framed=True)
+
+            self.assertEqual(echoed, [ b"10" ])
+            self.assertTrue(await self.waitFor(lambda: results))
+            self.assertEqual(protocol.getLatencyStats()["samples"], 11)
+
+        self.runProtocol(test)
+
+    def test_lost_sampler_messages_dont_evict_calculate_latency(self):
+        async def test(protocol, client):
+            results = []
+
+            await protocol.calculateLatency(iterations=1, callback=results.append)
+
+            for _ in range(OmniaProtocol.LATENCY_MAX_IN_FLIGHT * 2):    # sampler messages whose echo is lost
+                await protocol._OmniaProtocol__sendLatencyMessage()
+
+            msg_type, payload = await self.readMessage(client)
+            await client.sendall(OmniaProtocol.LATENCY.encode() + payload + b"\n")
+
+            self.assertEqual(payload, b"0")
+            self.assertTrue(await self.waitFor(lambda: results))
+
+        self.runProtocol(test)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,227 @@
+import unittest
+from PIL                         import Image
+
+### Omnia libraries ###
+from modules.omniaUI             import OmniaUI, OmniaUIElement, OmniaUILine
+### --- ###
+
+"""Tests of OmniaUI, run from the repository root:
+    python -m unittest discover tests
+"""
+
+class OmniaUITestCase(unittest.TestCase):
+
+    WIDTH = 320
+    HEIGHT = 240
+
+    def setUp(self):
+        self.ui = OmniaUI((self.WIDTH, self.HEIGHT))
+
+    def addLabel(self, label_id, position, text, **params):
+        label = OmniaUIElement(label_id, "label", position, text, **params)
+        self.ui.addElement(label)
+
+        return label
+
+    def addButton(self, button_id, position, dimensions=(70, 30), **params):
+        button = OmniaUIElement(button_id, "button", position, '', clickable=True, dimensions=dimensions, **params)
+        self.ui.addElement(button)
+
+        return button
+
+    def assertFullRedraw(self):
+        """Check that the UI image is the same as drawing the background and every element in order
+        """
+        expected = self.ui._get_background((0, 0, self.WIDTH, self.HEIGHT))
+
+        for elements in (self.ui.buttons, self.ui.labels, self.ui.lines):
+            for element in elements.values():
+                self.ui._draw_element(element, expected)
+
+        self.assertEqual(self.ui.image.tobytes(), expected.tobytes())
+
+class DamageTest(OmniaUITestCase):
+
+    def test_first_refresh_repaints_everything(self):
+        self.addLabel("title", (10, 10), "Title")
+
+        self.assertEqual(self.ui.refresh_image(), [ (0, 0, self.WIDTH, self.HEIGHT) ])
+        self.assertFullRedraw()
+
+    def test_unchanged_elements_are_not_repainted(self):
+        self.addLabel("title", (10, 10), "Title")
+        self.ui.refresh_image()
+        generation = self.ui.getGeneration()
+
+        self.assertEqual(self.ui.refresh_image(), [])
+        self.assertEqual(self.ui.getGeneration(), generation)
+
+    def test_moved_element_damages_old_and_new_box(self):
+        label = self.addLabel("dot", (10, 10), ".")
+        self.addLabel("title", (200, 200), "Title")
+        self.ui.refresh_image()
+
+        old_box = label.getBoundingBox()
+        label.setPosition((100, 10))
+
+        damage = self.ui.refresh_image()
+
+        self.assertEqual(sorted(damage), sorted([ old_box, label.getBoundingBox() ]))
+        self.assertFullRedraw()
+
+    def test_overlapping_boxes_are_merged(self):
+        label = self.addLabel("time", (10, 10), "00:00")
+        self.ui.refresh_image()
+
+        old_box = label.getBoundingBox()
+        label.setText("00:01")
+        label.setPosition((15, 12))
+        new_box = label.getBoundingBox()
+
+        damage = self.ui.refresh_image()
+
+        self.assertEqual(damage, [ (old_box[0], old_box[1], max(old_box[2], new_box[2]), max(old_box[3], new_box[3])) ])
+        self.assertFullRedraw()
+
+    def test_hidden_element_is_erased(self):
+        label = self.addLabel("title", (10, 10), "Title")
+        self.ui.refresh_image()
+
+        label.visible = False
+
+        self.assertEqual(self.ui.refresh_image(), [ label.getBoundingBox() ])
+        self.assertFullRedraw()
+
+    def test_damage_is_collected_until_get_damage(self):
+        label = self.addLabel("title", (10, 10), "Title")
+        self.ui.refresh_image()
+        self.ui.getDamage()
+
+        label.setText("Other")
+        first = self.ui.refresh_image()
+        label.setPosition((100, 100))
+        second = self.ui.refresh_image()
+
+        self.assertEqual(self.ui.getDamage(), first + second)
+        self.assertEqual(self.ui.getDamage(), [])
+
+class HitTest(OmniaUITestCase):
+
+    def test_click_returns_button(self):
+        play = self.addButton("play", (100, 100))
+
+        self.assertIs(self.ui.click((110, 110)), play)
+        self.assertIsNone(self.ui.click((10, 10)))
+
+    def test_topmost_button_wins(self):
+        self.addButton("play", (100, 100))
+        pause = self.addButton("pause", (100, 100))     # same box, added later: drawn on top
+
+        self.assertIs(self.ui.click((110, 110)), pause)
+
+    def test_hidden_button_is_not_clicked(self):
+        play = self.addButton("play", (100, 100))
+        pause = self.addButton("pause", (100, 100))
+
+        pause.visible = False
+
+        self.assertIs(self.ui.click((110, 110)), play)
+
+        pause.visible = True
+
+        self.assertIs(self.ui.click((110, 110)), pause)
+
+    def test_moved_button_is_indexed_again(self):
+        button = self.addButton("next", (10, 10))
+
+        button.setPosition((200, 150))
+
+        self.assertIsNone(self.ui.click((20, 20)))
+        self.assertIs(self.ui.click((210, 160)), button)
+
+    def test_removed_button_is_not_clicked(self):
+        self.addButton("next", (10, 10))
+
+        self.ui.removeElement("next")
+
+        self.assertIsNone(self.ui.click((20, 20)))
+        self.assertEqual(self.ui._hit_grid, {})
+
+    def test_click_bias(self):
+        self.ui = OmniaUI((self.WIDTH, self.HEIGHT), click_bias=10)
+        button = self.addButton("next", (100, 100))     # box (100, 100) - (180, 140) with the padding
+
+        self.assertIs(self.ui.click((95, 145)), button)
+        self.assertIsNone(self.ui.click((85, 100)))
+
+    def test_buttons_are_indexed_in_overlapping_cells(self):
+        self.addButton("next", (40, 40), dimensions=(20, 20))   # box (40, 40) - (70, 70) with the padding: cells 1 and 2
+
+        cell = OmniaUI.HIT_CELL_SIZE
+
+        self.assertEqual(sorted(self.ui._hit_grid), [ (col, row) for col in (40 // cell, 70 // cell) for row in (40 // cell, 70 // cell) ])
+
+class StaticLayerTest(OmniaUITestCase):
+
+    def addIcon(self, icon_id, position, color=(255, 0, 0, 128)):
+        return self.addLabel(icon_id, position, '', image=Image.new("RGBA", (40, 40), color))
+
+    def test_elements_layer(self):
+        icon = self.addIcon("icon", (10, 10))
+        label = self.addLabel("title", (10, 10), "Title")
+        line = OmniaUILine("line", ((0, 0), (10, 10)))
+
+        self.assertTrue(icon.isStatic())
+        self.assertFalse(label.isStatic())
+        self.assertTrue(line.isStatic())
+
+        icon.setStatic(False)
+        label.setStatic(True)
+
+        self.assertFalse(icon.isStatic())
+        self.assertTrue(label.isStatic())
+
+    def test_dynamic_change_keeps_static_layer(self):
+        self.ui.setBackgroundImage(Image.linear_gradient("L").convert("RGBA").resize((self.WIDTH, self.HEIGHT)))
+        self.addIcon("icon", (10, 10))
+        label = self.addLabel("time", (20, 20), "00:00")
+        self.ui.refresh_image()
+
+        static_image = self.ui._static_image.tobytes()
+        label.setText("00:01")
+        damage = self.ui.refresh_image()
+
+        self.assertEqual(damage, [ label.getBoundingBox() ])
+        self.assertEqual(self.ui._static_image.tobytes(), static_image)
+        self.assertFullRedraw()
+
+    def test_static_element_above_dynamic_one(self):
+        label = self.addLabel("time", (20, 20), "00:00")
+        self.ui.addElement(OmniaUILine("line", ((0, 30), (200, 30)), width=3, color=(0, 0, 255)))   # lines are drawn after labels
+        self.ui.refresh_image()
+
+        label.setText("11:11")
+        self.ui.refresh_image()
+
+        self.assertFullRedraw()
+
+    def test_static_change_repaints_static_layer(self):
+        icon = self.addIcon("icon", (10, 10))
+        self.addLabel("time", (20, 20), "00:00")
+        self.addIcon("other", (200, 100), color=(0, 255, 0, 255))
+        self.ui.refresh_image()
+
+        icon.setPosition((100, 100))    # moved under the other icon
+        self.ui.refresh_image()
+
+        self.assertFullRedraw()
+
+        expected = self.ui._get_background((0, 0, self.WIDTH, self.HEIGHT))
+        for element in self.ui.labels.values():
+            if element.isStatic():
+                self.ui._draw_element(element, expected)
+
+        self.assertEqual(self.ui._static_image.tobytes(), expected.tobytes())
+
+if __name__ == "__main__":
+    unittest.main()
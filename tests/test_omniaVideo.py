@@ -0,0 +1,69 @@
+import unittest
+from unittest import mock
+
+### Omnia libraries ###
+from modules.omniaVideo          import OmniaVideoRateController
+### --- ###
+
+"""Tests of OmniaVideoRateController, run from the repository root:
+    python -m unittest discover tests
+"""
+
+class FakeProtocol:
+    """OmniaProtocol measures used by the rate controller, in milliseconds like the real ones
+    """
+
+    def __init__(self, wire_latency, rtt):
+        self.client_info = {"name": "test"}
+        self.wire_latency = wire_latency
+        self.rtt = rtt
+
+    def getWireLatency(self, priority=None):
+        return {"avg": self.wire_latency, "max": self.wire_latency, "messages": 1}
+
+    def getLatencyStats(self):
+        return {"ewma": self.rtt}
+
+class FakeDisplay:
+    """OmniaDisplay measures used by the rate controller
+    """
+
+    def __init__(self, omniaProtocol, encode_time):
+        self.omniaProtocol = omniaProtocol
+        self.encode_time = encode_time  # seconds
+        self.dropped_frames = 0
+
+class OmniaVideoRateControllerTest(unittest.TestCase):
+
+    def runFrames(self, wire_latency, rtt, encode_time, frames=120, fps=30):
+        """Send frames at exactly fps, with constant measures
+
+        :return: rate controller
+        :rtype: OmniaVideoRateController
+        """
+        display = FakeDisplay(FakeProtocol(wire_latency, rtt), encode_time)
+        controller = OmniaVideoRateController(display, fps)
+
+        times = [ i / fps for i in range(frames) ]
+
+        with mock.patch("modules.omniaVideo.time.perf_counter", side_effect=times):
+            for _ in range(frames):
+                controller.nextFrame()
+
+        return controller
+
+    def test_low_latency_link_stays_at_top_level(self):
+        # 3 ms to the wire, 4 ms RTT and 5 ms encoding: well under the 33 ms budget
+        controller = self.runFrames(wire_latency=3.0, rtt=4.0, encode_time=0.005)
+
+        self.assertEqual(controller.level, 0)
+        self.assertLess(controller.cost, controller.getFrameInterval())
+
+    def test_slow_link_lowers_level(self):
+        # 60 ms to the wire: every frame is over budget
+        controller = self.runFrames(wire_latency=60.0, rtt=4.0, encode_time=0.005)
+
+        self.assertGreater(controller.level, 0)
+
+if __name__ == "__main__":
+    unittest.main()